@@ -0,0 +1,222 @@
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET
+
+from .models import Book, Category, Comment, Rating
+from .pagination import CursorPaginator
+from . import autocomplete
+from . import search
+
+# Read-only JSON API for the catalog.
+#
+# Rows are serialized straight from .values() querysets (no model instances),
+# lists use the same keyset cursors as book_list, and `?fields=` lets clients
+# skip what they don't need (e.g. the large `description` HTML).
+
+# public field name -> ORM lookup
+BOOK_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'author': 'author',
+    'description': 'description',
+    'excerpt': 'excerpt',
+    'category': 'category__name',
+    'cover_image': 'cover_image',
+    'created_at': 'created_at',
+    'rating_count': 'rating_count',
+    'rating_avg': 'rating_avg',
+}
+DEFAULT_BOOK_FIELDS = [name for name in BOOK_FIELDS if name != 'description']
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_BATCH_IDS = 100
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _book_fields(request):
+    fields = request.GET.get('fields')
+    if not fields:
+        return DEFAULT_BOOK_FIELDS
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in BOOK_FIELDS]
+    if unknown:
+        raise BadRequest(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _book_values(queryset, fields, extra=()):
+    """values() for the requested public fields, plus any keys needed for paging."""
+    lookups = dict.fromkeys(BOOK_FIELDS[name] for name in ['id', *fields, *extra])
+    return queryset.values(*lookups)
+
+
+def _serialize_book(row, fields):
+    data = {field: row[BOOK_FIELDS[field]] for field in fields}
+    if data.get('cover_image'):
+        data['cover_image'] = default_storage.url(data['cover_image'])
+    elif 'cover_image' in data:
+        data['cover_image'] = None
+    return data
+
+
+def _filtered_books(request):
+    """Same `q` / `category` filters as book_list."""
+    categoryQ = request.GET.get('category')
+    searchQ = request.GET.get('q')
+
+    books = Book.objects.all()
+    if categoryQ:
+        books = books.filter(category__name=categoryQ)
+    if searchQ:
+        if search.is_enabled():
+            # ⚡ subquery on the index: every match, no id list built in Python
+            books = books.filter(id__in=search.matching_ids(searchQ))
+        else:
+            books = books.filter(
+                Q(title__icontains=searchQ) |
+                Q(description__icontains=searchQ) |
+                Q(category__name__icontains=searchQ)
+            ).distinct()
+    return books
+
+
+def _page_response(page, serialize):
+    return JsonResponse({
+        'results': [serialize(row) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+@require_GET
+def book_list(request):
+    try:
+        fields = _book_fields(request)
+        limit = _limit(request)
+    except BadRequest as exc:
+        return _error(str(exc))
+
+    ordering = 'rating' if request.GET.get('sort') == 'rating' else 'latest'
+    keys = ['created_at'] if ordering == 'latest' else ['rating_avg', 'rating_count']
+    books = _book_values(_filtered_books(request), fields, extra=keys)
+    page = CursorPaginator(books, limit, ordering=ordering).get_page(request.GET.get('cursor'))
+    return _page_response(page, lambda row: _serialize_book(row, fields))
+
+
+@require_GET
+def book_detail(request, id):
+    try:
+        fields = _book_fields(request)
+    except BadRequest as exc:
+        return _error(str(exc))
+
+    row = _book_values(Book.objects.filter(id=id), fields).first()
+    if row is None:
+        return _error("book not found", status=404)
+    return JsonResponse(_serialize_book(row, fields))
+
+
+@require_GET
+def book_batch(request):
+    """Many books by id in one round trip: ?ids=1,2,3 (order is kept, unknown ids are listed in `missing`)."""
+    try:
+        fields = _book_fields(request)
+        ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return _error("ids must be a comma separated list of integers")
+    except BadRequest as exc:
+        return _error(str(exc))
+    if not ids:
+        return _error("ids is required")
+    if len(ids) > MAX_BATCH_IDS:
+        return _error(f"at most {MAX_BATCH_IDS} ids per request")
+
+    rows = {row['id']: row for row in _book_values(Book.objects.filter(id__in=ids), fields)}
+    return JsonResponse({
+        'results': [_serialize_book(rows[book_id], fields) for book_id in ids if book_id in rows],
+        'missing': [book_id for book_id in ids if book_id not in rows],
+    })
+
+
+@require_GET
+def category_list(request):
+    categories = Category.objects.order_by('name').values('id', 'name')
+    return JsonResponse({'results': list(categories)})
+
+
+@require_GET
+def book_ratings(request, id):
+    try:
+        limit = _limit(request)
+    except BadRequest as exc:
+        return _error(str(exc))
+
+    ratings = Rating.objects.filter(book_id=id).values('id', 'score', user_name=F('user__username'))
+    page = CursorPaginator(ratings, limit, ordering='id').get_page(request.GET.get('cursor'))
+    return _page_response(page, lambda row: {'id': row['id'], 'user': row['user_name'], 'score': row['score']})
+
+
+@require_GET
+def book_comments(request, id):
+    try:
+        limit = _limit(request)
+    except BadRequest as exc:
+        return _error(str(exc))
+
+    comments = (
+        Comment.objects.filter(book_id=id)
+        .with_rating_score()
+        .values('id', 'content', 'created_at', 'annotated_rating_score', user_name=F('user__username'))
+    )
+    page = CursorPaginator(comments, limit, ordering='latest').get_page(request.GET.get('cursor'))
+    return _page_response(page, lambda row: {
+        'id': row['id'],
+        'user': row['user_name'],
+        'content': row['content'],
+        'created_at': row['created_at'],
+        'rating_score': row['annotated_rating_score'],
+    })
+
+
+def _suggestion_url(suggestion):
+    if suggestion['type'] == autocomplete.BOOK:
+        return reverse('book_details', args=[suggestion['id']])
+    if suggestion['type'] == autocomplete.CATEGORY:
+        return f"{reverse('book_list')}?{urlencode({'category': suggestion['label']})}"
+    return f"{reverse('book_list')}?{urlencode({'q': suggestion['label']})}"
+
+
+@require_GET
+def autocomplete_view(request):
+    """Search-as-you-type: ?q=<prefix>, answered from the in-memory prefix index (no SQL)."""
+    try:
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        return _error("limit must be an integer")
+
+    prefix = request.GET.get('q', '')
+    suggestions = autocomplete.suggest(prefix, limit)
+    for suggestion in suggestions:
+        suggestion['url'] = _suggestion_url(suggestion)
+    response = JsonResponse({'query': prefix, 'results': suggestions})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
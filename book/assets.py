@@ -0,0 +1,156 @@
+import gzip
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are written without it
+    brotli = None
+
+# Production serving of uploaded covers (MEDIA_ROOT) and collected static
+# files (STATIC_ROOT).
+#
+# Both kinds of file are content-addressed: covers are stored as
+# book_covers/<hash>.<ext> (covers.hashed_upload_to) and collectstatic writes
+# styles.<hash>.css through the manifest storage below. A hashed name never
+# changes content, so it is sent with a one year `immutable` Cache-Control;
+# anything else gets SHORT_MAX_AGE and is revalidated through its ETag.
+#
+# With OFFLOAD set, Django only checks the request and answers with an
+# X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) header; the web
+# server then sends the bytes instead of a Python worker.
+
+DEFAULTS = {
+    'OFFLOAD': None,                # None, 'x-accel-redirect' or 'x-sendfile'
+    'OFFLOAD_PREFIX': {             # nginx `internal` locations for x-accel-redirect
+        'media': '/protected/media/',
+        'static': '/protected/static/',
+    },
+    'MAX_AGE': 60 * 60 * 24 * 365,  # content-hashed names
+    'SHORT_MAX_AGE': 60 * 60,       # everything else
+}
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.svg', '.json', '.txt', '.map', '.xml', '.html'}
+# precompressed variants, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# a 12+ hex digit path segment: styles.3f2a9c81b0d4.css, book_covers/9b1e...c4.jpg,
+# book_covers/variants/9b1e...c4/card.webp
+HASHED_NAME = re.compile(r'(^|[/.])[0-9a-f]{12,}([./]|$)')
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_ASSETS', {})}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic storage: content-hashed names (ManifestStaticFilesStorage)
+    plus a .gz (and .br when brotli is installed) next to every text asset,
+    kept only when it is actually smaller.
+    """
+    # a reference to a file missing from the manifest renders unhashed instead of raising
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if dry_run or isinstance(processed, Exception) or not hashed_name:
+                continue
+            if posixpath.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self._compress(hashed_name)
+
+    def _compress(self, name):
+        with self.open(name) as handle:
+            content = handle.read()
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content)
+        for suffix, compressed in variants.items():
+            if len(compressed) >= len(content):
+                continue
+            path = Path(self.path(name + suffix))
+            path.write_bytes(compressed)
+
+
+def is_hashed(path):
+    return bool(HASHED_NAME.search(path))
+
+
+def serve(request, path, kind='media'):
+    """
+    Serve a file from MEDIA_ROOT (kind='media') or STATIC_ROOT (kind='static')
+    with long-lived caching headers, conditional GET and optional offload.
+    """
+    options = get_options()
+    root = settings.MEDIA_ROOT if kind == 'media' else settings.STATIC_ROOT
+    try:
+        fullpath = Path(safe_join(root, path))
+    except (SuspiciousFileOperation, ValueError):  # '..' or an absolute path
+        raise Http404("File not found.")
+    if not fullpath.is_file():
+        raise Http404("File not found.")
+
+    encoding = None
+    if kind == 'static' and not options['OFFLOAD']:
+        # (nginx picks precompressed variants itself: gzip_static / brotli_static)
+        encoding, fullpath = _negotiate(request, fullpath)
+
+    # per variant: a gzip body must not revalidate an identity one
+    stat = fullpath.stat()
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = _file_response(fullpath, path, kind, options)
+        response.headers['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            # FileResponse guesses the encoding from the suffix; be explicit
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    if kind == 'static' and posixpath.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        response.headers['Vary'] = 'Accept-Encoding'
+    if is_hashed(path):
+        response.headers['Cache-Control'] = f"public, max-age={options['MAX_AGE']}, immutable"
+    else:
+        response.headers['Cache-Control'] = f"public, max-age={options['SHORT_MAX_AGE']}"
+    return response
+
+
+def _file_response(fullpath, path, kind, options):
+    # the type of the requested file, not of a .gz / .br variant
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    offload = options['OFFLOAD']
+    if offload == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Accel-Redirect'] = options['OFFLOAD_PREFIX'][kind] + path
+        return response
+    if offload == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Sendfile'] = str(fullpath)
+        return response
+    return FileResponse(fullpath.open('rb'), content_type=content_type, filename=posixpath.basename(path))
+
+
+def _negotiate(request, fullpath):
+    """Pick a precompressed variant the client accepts (written by collectstatic)."""
+    if fullpath.suffix.lower() not in COMPRESSIBLE_EXTENSIONS:
+        return None, fullpath
+    accepted = {
+        token.split(';')[0].strip().lower()
+        for token in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    for encoding, suffix in ENCODINGS:
+        candidate = fullpath.with_name(fullpath.name + suffix)
+        if encoding in accepted and candidate.is_file():
+            return encoding, candidate
+    return None, fullpath
@@ -0,0 +1,251 @@
+"""
+Async versions of the catalog, detail and profile pages, served when
+BOOK_ASYNC_VIEWS is on (the default under asgi.py).
+
+Under ASGI a sync view costs a hop through the sync thread pool per request;
+these run on the event loop and await the ORM instead. Independent queries
+are started together with asyncio.gather. Note that Django's async ORM still
+executes SQL in a worker thread (one connection per thread), so on SQLite the
+gathered queries overlap their Python work rather than their database work;
+the gain is in how many requests a worker keeps in flight. That only pays off
+when requests spend their time waiting (a remote cache, replica latency, many
+slow clients, long-lived connections): against a local SQLite file
+benchmark_concurrency measures WSGI ahead (92 vs 72 req/s).
+
+Same templates, context and caching as the sync views in views.py.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import Count, Q
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.http import urlencode
+
+from . import cache
+from . import forms
+from . import leaderboards
+from . import search
+from . import views
+from .models import Book, Category, LeaderboardEntry, PendingRating, Rating, SimilarBook
+from .pagination import CursorPage, CursorPaginator
+from .routers import replica_reads
+
+PER_PAGE = 6
+
+
+async def _apaginate(queryset, page_number, per_page=PER_PAGE):
+    """Paginator.get_page() without sync queries: COUNT through acount(), rows through async iteration."""
+    paginator = Paginator(queryset, per_page)
+    paginator.count = await queryset.acount()  # fills the cached_property
+    page_obj = paginator.get_page(page_number)
+    page_obj.object_list = [obj async for obj in page_obj.object_list]
+    return page_obj
+
+
+async def _category_list(version=None):
+    async def load():
+        return [c async for c in Category.objects.order_by('name').only('id', 'name', 'book_count')]
+    return await cache.aget_local('categories', 'categories', load, version=version)
+
+
+async def _sidebar_categories(version, facet_source):
+    categories = await _category_list(version)
+    if facet_source is None:
+        return [(category, category.book_count) for category in categories]
+
+    counts = {
+        category_id: n async for category_id, n in
+        facet_source.order_by().values_list('category_id').annotate(n=Count('id', distinct=True))
+    }
+    return [(category, counts.get(category.id, 0)) for category in categories]
+
+
+async def _trending():
+    return [
+        entry async for entry in
+        leaderboards.entries(LeaderboardEntry.TRENDING).defer('book__description')[:views.TRENDING_SIDEBAR_SIZE]
+    ]
+
+
+async def _catalog_validators(request):
+    versions = await cache.aget_versions(*views.CATALOG_SCOPES)
+    return f'"catalog-{cache.page_digest(request, versions)}"', None
+
+
+async def _book_validators(request, id):
+    row = await Book.objects.filter(pk=id).values_list('version', 'updated_at').afirst()
+    if row is None:
+        return None
+    version, updated_at = row
+    return views.book_etag(id, version), updated_at
+
+
+@cache.conditional_page(_catalog_validators)
+@cache.cache_anonymous_page(lambda request: list(views.CATALOG_SCOPES))
+@replica_reads
+async def book_list(request):
+    categoryQ = request.GET.get('category')
+    searchQ = request.GET.get('q')
+    sortQ = request.GET.get('sort')
+    page_number = request.GET.get('page')
+    if searchQ:
+        sortQ = None  # views.book_list
+
+    facet_source = None
+    if searchQ and search.is_enabled():
+        # the FTS lookups (COUNT, then one LIMIT/OFFSET slice) are raw cursor queries
+        paginator = Paginator(search.SearchResults(searchQ, category=categoryQ), PER_PAGE)
+        page_obj = await sync_to_async(paginator.get_page)(page_number)
+        facet_source = Book.objects.filter(id__in=search.matching_ids(searchQ))
+        books_by_id = {
+            book.id: book async for book in Book.objects.filter(id__in=page_obj.object_list).defer('description')
+        }
+        page_obj.object_list = [books_by_id[i] for i in page_obj.object_list if i in books_by_id]
+    elif sortQ in views.LEADERBOARD_SORTS:
+        board = views.LEADERBOARD_SORTS[sortQ]
+        page_obj = await _apaginate(leaderboards.entries(board, categoryQ).defer('book__description'), page_number)
+        if page_obj.paginator.count:
+            page_obj.object_list = [entry.book for entry in page_obj.object_list]
+        else:
+            # board not computed yet: rank live (the top-rated prior is one sync aggregate)
+            books = Book.objects.defer('description')
+            if categoryQ:
+                books = books.filter(category_id__in = [
+                    category.id for category in await _category_list() if category.name == categoryQ
+                ])
+            page_obj = await _apaginate(await sync_to_async(leaderboards.live_ranking)(board, books), page_number)
+    else:
+        books = Book.objects.defer('description')
+        if searchQ:
+            books = books.filter(
+                Q(title__icontains = searchQ) |
+                Q(description__icontains = searchQ) |
+                Q(category__name__icontains = searchQ)
+            ).distinct()
+            facet_source = books
+        if categoryQ:
+            books = books.filter(category_id__in = [
+                category.id for category in await _category_list() if category.name == categoryQ
+            ])
+
+        if getattr(settings, 'BOOK_LIST_CURSOR_PAGINATION', False):
+            paginator = CursorPaginator(books, PER_PAGE, ordering='rating' if sortQ == 'rating' else 'latest')
+            page_obj = await paginator.aget_page(request.GET.get('cursor'))
+        else:
+            if sortQ == 'rating':
+                books = books.order_by('-rating_avg', '-rating_count', '-id')
+            else:
+                # newest first, walking book_latest_idx (book_category_latest_idx with a category)
+                books = books.order_by('-created_at', '-id')
+            page_obj = await _apaginate(books, page_number)
+
+    versions = await cache.aget_versions(
+        'catalog', 'categories', 'leaderboards', *(f'book:{book.id}' for book in page_obj.object_list)
+    )
+    for book in page_obj.object_list:
+        book.cache_version = versions[f'book:{book.id}']
+
+    # the sidebars can't be loaded lazily by the template here (no sync ORM on the event loop)
+    sidebar_categories, trending = await asyncio.gather(
+        _sidebar_categories(versions['categories'], facet_source), _trending()
+    )
+
+    context = {
+        'page_obj' : page_obj,
+        'sidebar_categories' : sidebar_categories,
+        'categories_version' : versions['categories'],
+        'facets_version' : versions['catalog'] if facet_source is not None else '',
+        'trending' : trending,
+        'leaderboards_version' : versions['leaderboards'],
+        'search_query' : searchQ,
+        'categoryQ' : categoryQ,
+        'sortQ' : sortQ,
+        'cursor_mode' : isinstance(page_obj, CursorPage),
+        'filter_query' : urlencode({
+            key: value for key, value in (('q', searchQ), ('category', categoryQ), ('sort', sortQ)) if value
+        }),
+    }
+    return render(request, 'book/book_list.html', context)
+
+
+async def _get_book(id):
+    try:
+        book = await Book.objects.select_related('category').defer('description').aget(id=id)
+    except Book.DoesNotExist:
+        raise Http404("No Book matches the given query.")
+    if not book.description_html:
+        # not backfilled yet: the template falls back to the raw description
+        await book.arefresh_from_db(fields=['description'])
+    return book
+
+
+async def _similar_books(book_id):
+    return [
+        entry.similar async for entry in
+        SimilarBook.objects.filter(book_id=book_id).select_related('similar').defer('similar__description')
+        .order_by('rank')[:views.SIMILAR_BOOKS_SHOWN]
+    ]
+
+
+async def _user_rating(user, book_id):
+    if not user.is_authenticated:
+        return None
+    # a star click may still be pending (write-behind, see ratings.py)
+    pending = await PendingRating.objects.filter(user=user, book_id=book_id).values_list('score', flat=True).afirst()
+    if pending is not None:
+        return pending
+    return await Rating.objects.filter(user=user, book_id=book_id).values_list('score', flat=True).afirst()
+
+
+@cache.conditional_page(_book_validators)
+@cache.cache_anonymous_page(lambda request, id: [f'book:{id}', 'categories'])
+@replica_reads
+async def book_details(request, id):
+    if request.method == 'POST':
+        # writes stay on the sync view (redirect after POST)
+        return await sync_to_async(views.book_details)(request, id)
+
+    user = await request.auser()
+    request.user = user
+
+    # everything on the page depends only on the id: fetch it all at once
+    book, comments_page, similar_books, versions, user_rating = await asyncio.gather(
+        _get_book(id),
+        views._comment_paginator(id).aget_page(),
+        _similar_books(id),
+        cache.aget_versions(f'book:{id}'),
+        _user_rating(user, id),
+    )
+
+    context = {
+        'book' : book,
+        'comments' : comments_page,
+        'similar_books' : similar_books,
+        'comment_form' : forms.CommentForm(),
+        'book_version' : versions[f'book:{id}'],
+        'user_rating' : user_rating,
+    }
+    response = render(request, 'book/book_details.html', context)
+    return views.set_book_validators(request, response, book)
+
+
+@login_required
+async def profile_view(request):
+    if request.method == 'POST':
+        return await sync_to_async(views.profile_view)(request)
+
+    user = await request.auser()
+    request.user = user
+    section = request.GET.get('section', 'profile')
+    context = {'section' : section}
+
+    if section == 'books':
+        context['books'] = [book async for book in Book.objects.filter(author = user.username)]
+    elif section == 'update':
+        context['form'] = forms.UpdateProfileForm(instance=user)
+
+    return render(request, 'user/profile.html', context)
@@ -0,0 +1,344 @@
+import bisect
+import heapq
+import logging
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+
+from django.conf import settings
+
+from .models import Book, Category
+from .search import TOKEN_RE
+
+logger = logging.getLogger(__name__)
+
+# In-memory prefix index for search-as-you-type.
+#
+# Every title, author and category name is an entry, stored once in a few
+# parallel arrays. The index itself is a single array of packed integers,
+# (entry << 16) | offset of a word in the entry's normalized text, sorted by
+# the text from that word on: "the hobbit" is found under "the hobbit" and
+# "hobbit" without storing either string twice. A lookup is two bisects and a
+# scan of the matching slice; hits are ranked by popularity (rating count,
+# summed over the books of an author / category).
+#
+# Each worker builds its own copy (online_library/wsgi.py and asgi.py warm it
+# at startup). Model signals patch the copy of the worker that made the change;
+# other workers pick the change up on their next rebuild, started in a
+# background thread by the first lookup after MAX_AGE seconds.
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_AGE': 300,          # seconds before a worker rebuilds from the database
+    'MAX_SUFFIXES': 6,       # words indexed per label (bounds memory on long titles)
+    'MAX_SCAN': 2000,        # keys examined per lookup (short prefixes rank within these)
+    'DEFAULT_LIMIT': 8,
+    'MAX_LIMIT': 20,
+}
+
+BOOK, AUTHOR, CATEGORY = 'book', 'author', 'category'
+KINDS = (BOOK, AUTHOR, CATEGORY)
+
+OFFSET_BITS = 16
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+NONE = -1
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_AUTOCOMPLETE', {})}
+
+
+def normalize(text):
+    """Casefold and strip accents: "Émile" and "emile" share their keys."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(TOKEN_RE.findall(stripped.casefold()))
+
+
+class PrefixIndex:
+    def __init__(self, max_suffixes=DEFAULTS['MAX_SUFFIXES']):
+        self.max_suffixes = max_suffixes
+        self.lock = threading.RLock()
+        self._keys = array('q')          # packed (entry, word offset), sorted by suffix text
+        # per entry (a removed entry keeps its slot with text None until the next rebuild)
+        self._texts = []                 # normalized text
+        self._labels = []                # display text
+        self._kinds = bytearray()        # index into KINDS
+        self._object_ids = array('q')    # Book / Category id (NONE for authors)
+        self._popularity = array('q')
+        self._author_of = array('q')     # books: their author entry
+        self._category_of = array('q')   # books: their category entry (or NONE)
+        self._book_count = array('q')    # authors: books referencing them
+        # lookups into the entries
+        self._books = {}                 # book id -> entry
+        self._categories = {}            # category id -> entry
+        self._authors = {}               # normalized author -> entry
+
+    # --- building / patching ---
+
+    @classmethod
+    def build(cls, max_suffixes=DEFAULTS['MAX_SUFFIXES']):
+        index = cls(max_suffixes)
+        for category_id, name in Category.objects.values_list('id', 'name').iterator():
+            index._categories[category_id] = index._new_entry(CATEGORY, name, category_id)
+        books = Book.objects.values_list('id', 'title', 'author', 'category_id', 'rating_count')
+        for book_id, title, author, category_id, rating_count in books.iterator(chunk_size=2000):
+            index._add_book(book_id, title, author, category_id, rating_count)
+        # one sort instead of an insort per key
+        keys = [key for entry in range(len(index._texts)) for key in index._entry_keys(entry)]
+        keys.sort(key=index._suffix)
+        index._keys = array('q', keys)
+        return index
+
+    def put_book(self, book_id, title, author, category_id, rating_count):
+        with self.lock:
+            self.remove_book(book_id)
+            for entry in self._add_book(book_id, title, author, category_id, rating_count):
+                self._insert_keys(entry)
+
+    def remove_book(self, book_id):
+        with self.lock:
+            entry = self._books.pop(book_id, None)
+            if entry is None:
+                return
+            self._shift(entry, -self._popularity[entry])
+            author = self._author_of[entry]
+            self._book_count[author] -= 1
+            if not self._book_count[author]:
+                del self._authors[self._texts[author]]
+                self._drop_entry(author)
+            self._drop_entry(entry)
+
+    def shift_popularity(self, book_id, delta):
+        """A book gained (or lost) ``delta`` ratings."""
+        with self.lock:
+            entry = self._books.get(book_id)
+            if entry is not None and delta:
+                self._shift(entry, delta)
+
+    def put_category(self, category_id, name):
+        with self.lock:
+            entry = self._categories.get(category_id)
+            if entry is None:
+                self._categories[category_id] = entry = self._new_entry(CATEGORY, name, category_id)
+            elif self._labels[entry] == name:
+                return
+            else:
+                # renamed: same entry (its books and popularity stay linked), new keys
+                self._remove_keys(entry)
+                self._texts[entry], self._labels[entry] = normalize(name), name
+            self._insert_keys(entry)
+
+    def remove_category(self, category_id):
+        with self.lock:
+            entry = self._categories.pop(category_id, None)
+            if entry is not None:
+                self._drop_entry(entry)
+
+    def _add_book(self, book_id, title, author, category_id, rating_count):
+        """Book entry plus author bookkeeping; returns the entries that need keys."""
+        entry = self._books[book_id] = self._new_entry(BOOK, title, book_id)
+        new_entries = [entry]
+        author_text = normalize(author)
+        author_entry = self._authors.get(author_text)
+        if author_entry is None:
+            author_entry = self._authors[author_text] = self._new_entry(AUTHOR, author, NONE)
+            new_entries.append(author_entry)
+        self._book_count[author_entry] += 1
+        self._author_of[entry] = author_entry
+        self._category_of[entry] = self._categories.get(category_id, NONE)
+        self._shift(entry, rating_count)
+        return new_entries
+
+    def _shift(self, book_entry, delta):
+        # a book's ratings count towards its author and category as well
+        self._popularity[book_entry] += delta
+        self._popularity[self._author_of[book_entry]] += delta
+        if self._category_of[book_entry] != NONE:
+            self._popularity[self._category_of[book_entry]] += delta
+
+    def _new_entry(self, kind, label, object_id):
+        self._texts.append(normalize(label))
+        self._labels.append(label)
+        self._kinds.append(KINDS.index(kind))
+        self._object_ids.append(object_id)
+        for column in (self._popularity, self._author_of, self._category_of, self._book_count):
+            column.append(0)
+        return len(self._texts) - 1
+
+    def _drop_entry(self, entry):
+        self._remove_keys(entry)
+        self._texts[entry] = self._labels[entry] = None
+
+    def _entry_keys(self, entry):
+        text = self._texts[entry]
+        if not text:
+            return []
+        offsets = [0] + [position + 1 for position, char in enumerate(text) if char == ' ']
+        return [(entry << OFFSET_BITS) | offset for offset in offsets[:self.max_suffixes] if offset <= OFFSET_MASK]
+
+    def _suffix(self, key):
+        return self._texts[key >> OFFSET_BITS][key & OFFSET_MASK:]
+
+    def _insert_keys(self, entry):
+        for key in self._entry_keys(entry):
+            self._keys.insert(bisect.bisect_left(self._keys, self._suffix(key), key=self._suffix), key)
+
+    def _remove_keys(self, entry):
+        for key in self._entry_keys(entry):
+            suffix = self._suffix(key)
+            position = bisect.bisect_left(self._keys, suffix, key=self._suffix)
+            # several entries can share a suffix: find this entry's key among them
+            while position < len(self._keys) and self._suffix(self._keys[position]) == suffix:
+                if self._keys[position] == key:
+                    del self._keys[position]
+                    break
+                position += 1
+
+    # --- lookups ---
+
+    def search(self, prefix, limit=DEFAULTS['DEFAULT_LIMIT'], max_scan=DEFAULTS['MAX_SCAN']):
+        """The ``limit`` most popular titles / authors / categories with a word starting with ``prefix``."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            start = bisect.bisect_left(self._keys, prefix, key=self._suffix)
+            end = bisect.bisect_left(self._keys, prefix + '\U0010ffff', start, key=self._suffix)
+            entries = {key >> OFFSET_BITS for key in self._keys[start:min(end, start + max_scan)]}
+            ranked = heapq.nlargest(limit, entries, key=lambda entry: (self._popularity[entry], -entry))
+            return [
+                {
+                    'type': KINDS[self._kinds[entry]],
+                    'label': self._labels[entry],
+                    'id': self._object_ids[entry] if self._object_ids[entry] != NONE else None,
+                }
+                for entry in ranked
+            ]
+
+    def stats(self):
+        """Entry counts and an estimate of the memory held by the index, in bytes."""
+        with self.lock:
+            size = sum(sys.getsizeof(column) for column in (
+                self._keys, self._texts, self._labels, self._kinds, self._object_ids,
+                self._popularity, self._author_of, self._category_of, self._book_count,
+            ))
+            size += sum(sys.getsizeof(text) for text in self._texts if text is not None)
+            size += sum(sys.getsizeof(label) for label in self._labels if label is not None)
+            for mapping in (self._books, self._categories, self._authors):
+                size += sys.getsizeof(mapping) + sum(sys.getsizeof(key) for key in mapping)
+            return {
+                'books': len(self._books),
+                'authors': len(self._authors),
+                'categories': len(self._categories),
+                'keys': len(self._keys),
+                'bytes': size,
+            }
+
+
+# --- per-worker instance ---
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+_refresher = None  # the background rebuild thread, while one runs
+_refresher_lock = threading.Lock()  # not _build_lock: a lookup must not wait for a build
+
+
+def get_index():
+    """
+    This worker's index. Only the very first lookup waits for a build; once it
+    is older than MAX_AGE a background thread rebuilds it and swaps it in,
+    lookups keep the old one meanwhile.
+    """
+    options = get_options()
+    if _index is None:
+        return rebuild(options)
+    if time.monotonic() - _built_at > options['MAX_AGE']:
+        refresh_in_background()
+    return _index
+
+
+def rebuild(options=None):
+    global _index, _built_at
+    options = options or get_options()
+    with _build_lock:
+        if _index is not None and time.monotonic() - _built_at <= options['MAX_AGE']:
+            return _index  # another thread just built it
+        started = time.perf_counter()
+        index = PrefixIndex.build(options['MAX_SUFFIXES'])
+        # ⚡ one assignment: a lookup sees the old index or the new one. Changes committed
+        # while the build was reading may be missed until the next rebuild, as in other workers.
+        _index, _built_at = index, time.monotonic()
+    stats = index.stats()
+    logger.info(
+        "Autocomplete index built in %.0f ms: %d keys, %.1f KiB",
+        (time.perf_counter() - started) * 1000, stats['keys'], stats['bytes'] / 1024,
+    )
+    return index
+
+
+def refresh_in_background():
+    """Start a rebuild thread unless one is already running; returns it."""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is not None and _refresher.is_alive():
+            return _refresher
+        _refresher = threading.Thread(target=_rebuild_quietly, name='autocomplete-build', daemon=True)
+        _refresher.start()
+        return _refresher
+
+
+def warm():
+    """Build the index in the background at worker startup (first lookups build it themselves if needed)."""
+    if not get_options()['ENABLED']:
+        return
+    refresh_in_background()
+
+
+def _rebuild_quietly():
+    from django.db import connection
+    try:
+        rebuild()
+    except Exception:
+        # e.g. tables not migrated yet: lookups keep the index they have
+        logger.exception("Could not build the autocomplete index")
+    finally:
+        connection.close()
+
+
+def suggest(prefix, limit=None):
+    options = get_options()
+    if not options['ENABLED']:
+        return []
+    limit = max(1, min(limit or options['DEFAULT_LIMIT'], options['MAX_LIMIT']))
+    return get_index().search(prefix, limit, options['MAX_SCAN'])
+
+
+# Signal hooks: only patch an index this worker already holds.
+
+def book_saved(book):
+    if _index is not None:
+        _index.put_book(book.id, book.title, book.author, book.category_id, book.rating_count)
+
+
+def book_deleted(book_id):
+    if _index is not None:
+        _index.remove_book(book_id)
+
+
+def category_saved(category):
+    if _index is not None:
+        _index.put_category(category.id, category.name)
+
+
+def category_deleted(category_id):
+    if _index is not None:
+        _index.remove_category(category_id)
+
+
+def ratings_changed(book_id, delta):
+    if _index is not None:
+        _index.shift_popularity(book_id, delta)
@@ -0,0 +1,284 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, urlencode
+
+# Response and fragment cache for the catalog pages.
+#
+# Nothing is ever deleted: every cache key embeds the current version of the
+# "scopes" it depends on, and the model signals in signals.py bump those
+# versions. Scopes:
+#   'catalog'     anything shown on book_list (books, their ratings)
+#   'categories'  the category list, names and book counts
+#   'book:<id>'   one book's detail page (the book, its ratings and comments)
+KEY_PREFIX = 'bookcache'
+
+
+def get_cache():
+    return caches[getattr(settings, 'BOOK_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'BOOK_CACHE_TIMEOUT', 600)
+
+
+def _version_key(scope):
+    return f'{KEY_PREFIX}:v:{scope}'
+
+
+def _new_version():
+    # time based, so a version evicted from the cache never comes back with an old value
+    return time.time_ns()
+
+
+def get_versions(*scopes):
+    """Current version of every scope, fetched in one cache round trip."""
+    cache = get_cache()
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(keys)
+    versions = {}
+    for key, scope in keys.items():
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+        versions[scope] = found[key]
+    return versions
+
+
+async def aget_versions(*scopes):
+    """get_versions() for async views."""
+    cache = get_cache()
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = await cache.aget_many(keys)
+    versions = {}
+    for key, scope in keys.items():
+        if key not in found:
+            await cache.aadd(key, _new_version(), timeout=None)
+            found[key] = await cache.aget(key)
+        versions[scope] = found[key]
+    return versions
+
+
+def bump(*scopes):
+    """Invalidate everything cached under the given scopes."""
+    cache = get_cache()
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # missing (never read, or evicted)
+            cache.set(key, _new_version(), timeout=None)
+
+
+# Small, hot, rarely changing values (the category list) held in each worker's
+# memory: {name: (version, value)}. The version comes from the shared cache, so
+# one bump() makes every worker reload on its next request.
+_local_values = {}
+
+
+def get_local(name, scope, loader, version=None):
+    """
+    Process-local copy of ``loader()``, reloaded whenever ``scope`` is bumped.
+    Pass ``version`` when the caller already fetched it with get_versions().
+    """
+    if version is None:
+        version = get_versions(scope)[scope]
+    entry = _local_values.get(name)
+    if entry is None or entry[0] != version:
+        entry = (version, loader())
+        _local_values[name] = entry
+    return entry[1]
+
+
+async def aget_local(name, scope, loader, version=None):
+    """get_local() for async views; ``loader`` is a coroutine function."""
+    if version is None:
+        version = (await aget_versions(scope))[scope]
+    entry = _local_values.get(name)
+    if entry is None or entry[0] != version:
+        entry = (version, await loader())
+        _local_values[name] = entry
+    return entry[1]
+
+
+def page_digest(request, versions):
+    """Fingerprint of a page: its URL plus the versions of the scopes it depends on."""
+    params = urlencode(sorted(request.GET.lists()), doseq=True)
+    stamp = ','.join(f'{scope}={versions[scope]}' for scope in sorted(versions))
+    return hashlib.md5(f'{request.path}?{params}|{stamp}'.encode()).hexdigest()
+
+
+def page_key(request, versions):
+    return f'{KEY_PREFIX}:page:{page_digest(request, versions)}'
+
+
+# response headers stored with a cached page (conditional GET validators)
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+
+def _cache_entry(response):
+    headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+    return response.content, response['Content-Type'], headers
+
+
+def _cached_response(cached):
+    content, content_type, *headers = cached  # (entries written before the headers were kept have none)
+    response = HttpResponse(content, content_type=content_type)
+    for name, value in (headers[0] if headers else {}).items():
+        response[name] = value
+    return response
+
+
+def _cacheable(request, response):
+    # a page that rendered a CSRF token or sets a cookie belongs to one visitor
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def _page_cache_applies(request):
+    return (
+        getattr(settings, 'BOOK_PAGE_CACHE', False)
+        and request.method == 'GET'
+        and not getattr(request, 'static_export', False)
+    )
+
+
+def cache_anonymous_page(scopes):
+    """
+    Cache the rendered response of a GET view for anonymous visitors.
+
+    ``scopes`` is a callable receiving the view arguments (request, **kwargs)
+    and returning the scopes the page depends on. Logged-in users always get a
+    freshly rendered (personalized) page, and so does a static export
+    (``request.static_export``, export.py): its markup differs from the live
+    page and must never be served from the cache. Works on sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _page_cache_applies(request):
+                    return await view(request, *args, **kwargs)
+                # request.user would load the session synchronously
+                user = await request.auser()
+                request.user = user
+                if user.is_authenticated:
+                    return await view(request, *args, **kwargs)
+
+                cache = get_cache()
+                key = page_key(request, await aget_versions(*scopes(request, *args, **kwargs)))
+                cached = await cache.aget(key)
+                if cached is not None:
+                    return _cached_response(cached)
+
+                response = await view(request, *args, **kwargs)
+                if _cacheable(request, response):
+                    await cache.aset(key, _cache_entry(response), get_timeout())
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _page_cache_applies(request) or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            cache = get_cache()
+            key = page_key(request, get_versions(*scopes(request, *args, **kwargs)))
+            cached = cache.get(key)
+            if cached is not None:
+                return _cached_response(cached)
+
+            response = view(request, *args, **kwargs)
+            if _cacheable(request, response):
+                cache.set(key, _cache_entry(response), get_timeout())
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_page(validators):
+    """
+    Conditional GET for anonymous visitors: answer If-None-Match /
+    If-Modified-Since with a 304 before the view runs any query or renders.
+
+    ``validators`` receives the view arguments (request, **kwargs) and returns
+    (etag, last_modified datetime or None), or None to skip validation; for an
+    async view it must be a coroutine function. It is only consulted for
+    conditional requests and for 200 responses the view sent without an ETag,
+    so a view that sets the headers from data it already loaded costs nothing
+    extra on a plain GET. Logged-in users get personal content (their rating,
+    forms), so they are never validated.
+    """
+    def not_modified(request, validated):
+        etag, last_modified = validated
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                user = await request.auser()
+                request.user = user
+                if user.is_authenticated:
+                    return await view(request, *args, **kwargs)
+
+                validated = None
+                if _is_conditional(request):
+                    validated = await validators(request, *args, **kwargs)
+                    response = not_modified(request, validated) if validated else None
+                    if response is not None:
+                        return _set_validators(response, validated)
+                response = await view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.has_header('ETag') and validated is None:
+                    validated = await validators(request, *args, **kwargs)
+                return _set_validators(response, validated)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            validated = None
+            if _is_conditional(request):
+                validated = validators(request, *args, **kwargs)
+                response = not_modified(request, validated) if validated else None
+                if response is not None:
+                    return _set_validators(response, validated)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.has_header('ETag') and validated is None:
+                validated = validators(request, *args, **kwargs)
+            return _set_validators(response, validated)
+        return wrapper
+    return decorator
+
+
+def _is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def _set_validators(response, validated):
+    if validated and response.status_code in (200, 304):
+        etag, last_modified = validated
+        response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+    if response.has_header('ETag'):
+        # revalidate on every visit (a 304 is cheap) instead of heuristic freshness
+        patch_cache_control(response, no_cache=True)
+    return response
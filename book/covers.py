@@ -0,0 +1,129 @@
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models
+from django.db.models.fields.files import ImageFieldFile
+from PIL import Image, ImageOps
+
+# Resized derivatives of Book.cover_image.
+# The original upload is kept untouched; every variant is written in WebP plus a
+# JPEG fallback next to it:  book_covers/variants/<cover name>/<variant>.<ext>
+VARIANTS = {
+    'card': 360,        # list page card
+    'detail': 480,      # detail page cover
+    'card_2x': 720,     # retina card
+    'detail_2x': 960,   # retina detail
+}
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+VARIANTS_DIR = 'book_covers/variants'
+
+# `sizes` attribute for each place a cover is shown (mirrors the Bootstrap grid
+# columns used by book_list.html and book_details.html)
+SIZES = {
+    'card': '(min-width: 1200px) 250px, (min-width: 992px) 310px, (min-width: 768px) 350px, 100vw',
+    'detail': '(min-width: 1200px) 380px, (min-width: 992px) 320px, (min-width: 768px) 240px, 100vw',
+}
+
+
+COVERS_DIR = 'book_covers'
+HASH_LENGTH = 16
+
+
+def content_hash_name(content, filename):
+    """
+    book_covers/<sha256 of the bytes>.<ext>: a different image always gets a
+    different URL, so covers (and their variants, named after the cover) can be
+    cached forever by browsers and CDNs.
+    """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    extension = posixpath.splitext(filename)[1].lower()
+    return f'{COVERS_DIR}/{digest.hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+class HashedImageFieldFile(ImageFieldFile):
+    def save(self, name, content, save=True):
+        # named after the bytes being saved, not the cover the book has now: covers
+        # a form upload (via pre_save) and cover_image.save(name, ContentFile(...)) alike
+        name = content_hash_name(content, name)
+        if not self.storage.exists(name):
+            super().save(name, content, save)
+            return
+        # same image stored before (another book, a re-upload): point at it
+        self.name = name
+        setattr(self.instance, self.field.attname, name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+
+class HashedImageField(models.ImageField):
+    """ImageField storing every file as book_covers/<content hash>.<ext>."""
+
+    attr_class = HashedImageFieldFile
+
+
+def hashed_upload_to(instance, filename):
+    """Referenced by migration 0015 only; HashedImageField names the files now."""
+    return content_hash_name(instance.cover_image, filename)
+
+
+def variant_name(cover_name, variant, fmt):
+    stem = posixpath.splitext(posixpath.basename(cover_name))[0]
+    return f'{VARIANTS_DIR}/{stem}/{variant}.{fmt}'
+
+
+def variant_url(cover_name, variant, fmt):
+    return default_storage.url(variant_name(cover_name, variant, fmt))
+
+
+def srcset(cover_name, fmt):
+    """`srcset` value listing every width of one format, e.g. "…/card.webp 360w, …"."""
+    widths = sorted(VARIANTS.items(), key=lambda item: item[1])
+    return ', '.join(f'{variant_url(cover_name, variant, fmt)} {width}w' for variant, width in widths)
+
+
+def generate_variants(cover_name):
+    """
+    Write every variant/format of one stored cover. Safe to call again (files
+    are replaced). Returns the number of files written.
+    """
+    with default_storage.open(cover_name, 'rb') as source:
+        original = Image.open(source)
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'L'):
+            original = original.convert('RGB')
+        original.load()
+
+    written = 0
+    for variant, width in VARIANTS.items():
+        # never upscale: small covers just get re-encoded at their own size
+        target_width = min(width, original.width)
+        target_height = round(original.height * target_width / original.width)
+        resized = original.resize((target_width, target_height), Image.LANCZOS)
+        for fmt, (pil_format, options) in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            name = variant_name(cover_name, variant, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+def delete_variants(cover_name):
+    for variant in VARIANTS:
+        for fmt in FORMATS:
+            name = variant_name(cover_name, variant, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpRequest, QueryDict
+from django.template.utils import get_app_template_dirs
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from . import leaderboards
+from . import views
+from .models import Book, Category, LeaderboardEntry
+
+# Static export of the public pages (`manage.py export_static`): what an
+# anonymous visitor sees, rendered once through the sync views and written to
+# a directory a plain web server can serve. One file per URL:
+#
+#   index.html                      /
+#   catalog/page=<n>.html           /?page=<n>              (first CATALOG_PAGES pages)
+#   catalog/category=<name>.html    /?category=<name>       (first page of each category)
+#   books/details/<id>/index.html   /books/details/<id>/
+#
+# <name> is percent-encoded the way a browser sends it, so the web server can
+# map the raw query string to a file and hand anything else to Django, e.g.
+#
+#   location = / {
+#       if ($args = '') { rewrite ^ /index.html last; }
+#       try_files /catalog/$args.html @django;
+#   }
+#   location /books/details/ { try_files $uri/index.html @django; }
+#
+# The per-user parts (navbar login state, rating and comment form) are not
+# exported: the pages carry the anonymous markup plus a data-include URL that
+# base.html fetches for visitors who may be logged in (views.user_nav,
+# views.book_interactive).
+#
+# Every page has a fingerprint of what it shows (Book.version of its books,
+# the sidebar, the templates); the fingerprints of the last export are kept in
+# MANIFEST and only pages whose fingerprint moved are rendered again.
+
+DEFAULTS = {
+    'ROOT': 'export',
+    'CATALOG_PAGES': 10,
+}
+
+MANIFEST = '.export-manifest.json'
+PER_PAGE = 6  # views.book_list
+# characters a browser leaves as they are in a query string (WHATWG "special-query" set)
+QUERY_SAFE = "!$%&()*+,-./:;=?@[\\]^_`{|}~"
+
+Page = namedtuple('Page', ['view', 'kwargs', 'query', 'fingerprint'])
+
+VIEWS = {
+    'book_list': views.book_list,
+    'book_details': views.book_details,
+}
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_EXPORT', {})}
+
+
+def _digest(*parts):
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def templates_digest():
+    """Changes with any template file: a new layout makes every exported page stale."""
+    directories = [Path(settings.BASE_DIR, directory) for engine in settings.TEMPLATES for directory in engine['DIRS']]
+    directories += [Path(directory) for directory in get_app_template_dirs('templates')]
+    files = []
+    for directory in directories:
+        for path in sorted(directory.rglob('*.html')):
+            stat = path.stat()
+            files.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return _digest(files)
+
+
+def category_filename(name):
+    """catalog/ file name of a category page, or None when the name can't be one."""
+    encoded = quote(name, safe=QUERY_SAFE)
+    if not encoded or '/' in encoded:
+        return None  # left to Django
+    return f'catalog/category={encoded}.html'
+
+
+def plan(catalog_pages=DEFAULTS['CATALOG_PAGES']):
+    """Every page of the export: {relative path: Page}."""
+    templates = templates_digest()
+    categories = list(Category.objects.order_by('name').values_list('id', 'name', 'book_count'))
+    trending = list(
+        leaderboards.entries(LeaderboardEntry.TRENDING)[:views.TRENDING_SIDEBAR_SIZE]
+        .values_list('book_id', 'book__version')
+    )
+    # the category and trending sidebars are on every list page
+    sidebar = _digest(templates, categories, trending)
+    pages = {}
+
+    # ⚡ the same rows, in the same order, as views.book_list puts on each page
+    cursor_mode = getattr(settings, 'BOOK_LIST_CURSOR_PAGINATION', False)
+    books = Book.objects.values_list('id', 'version').order_by('-created_at', '-id')
+    if cursor_mode:
+        # later pages are addressed by cursor, not by a number: only the first one is exported
+        catalog_pages = 1
+    count = books.count()
+    page_count = max(1, min(catalog_pages, -(-count // PER_PAGE)))
+    rows = list(books[:page_count * PER_PAGE])
+    for number in range(1, page_count + 1):
+        fingerprint = _digest(sidebar, count, rows[(number - 1) * PER_PAGE:number * PER_PAGE])
+        if number == 1:
+            pages['index.html'] = Page('book_list', {}, {}, fingerprint)
+        if not cursor_mode:
+            pages[f'catalog/page={number}.html'] = Page('book_list', {}, {'page': str(number)}, fingerprint)
+
+    for category_id, name, book_count in categories:
+        filename = category_filename(name)
+        if filename is None:
+            continue
+        category_books = Book.objects.filter(category_id=category_id).values_list('id', 'version').order_by('-created_at', '-id')
+        fingerprint = _digest(sidebar, book_count, list(category_books[:PER_PAGE]))
+        pages[filename] = Page('book_list', {}, {'category': name}, fingerprint)
+
+    # a detail page changes with its book's version (comments, ratings, category name, similar books)
+    for book_id, version in Book.objects.order_by().values_list('id', 'version').iterator(chunk_size=2000):
+        pages[f'books/details/{book_id}/index.html'] = Page('book_details', {'id': book_id}, {}, _digest(templates, version))
+    return pages
+
+
+def export_request(page):
+    """The anonymous GET request of one page, built directly (no middleware runs)."""
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = reverse(page.view, kwargs=page.kwargs)
+    request.META['QUERY_STRING'] = urlencode(page.query)
+    request.GET = QueryDict(request.META['QUERY_STRING'])
+    request.user = AnonymousUser()
+    # base.html / book_details.html leave the per-user parts as includes, and
+    # cache_anonymous_page keeps the exported markup out of the live page cache
+    request.static_export = True
+    return request
+
+
+def render_page(page):
+    """Anonymous GET of one page through its sync view: (status code, HTML)."""
+    response = VIEWS[page.view](export_request(page), **page.kwargs)
+    return response.status_code, response.content
+
+
+def export_page(root, relpath, page):
+    """Render one page into root; returns (relpath, error message or None)."""
+    try:
+        status, content = render_page(page)
+    except Http404:
+        return relpath, "not found"  # deleted since the plan was made
+    if status != 200:
+        return relpath, f"HTTP {status}"
+    _write(Path(root, relpath), content)
+    return relpath, None
+
+
+def remove_page(root, relpath):
+    path = Path(root, relpath)
+    path.unlink(missing_ok=True)
+    if path.name == 'index.html' and path.parent != Path(root):
+        try:
+            path.parent.rmdir()  # books/details/<id>/
+        except OSError:
+            pass
+
+
+def load_manifest(root):
+    try:
+        return json.loads(Path(root, MANIFEST).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(root, manifest):
+    _write(Path(root, MANIFEST), json.dumps(manifest, sort_keys=True).encode())
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the web server never sees a half-written file
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_bytes(content)
+    os.replace(temporary, path)
@@ -0,0 +1,169 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Book, Comment, LeaderboardEntry, Rating
+
+# Leaderboards: recomputed on a schedule (`manage.py refresh_leaderboards`) and
+# read by book_list as a plain indexed range scan instead of a GROUP BY.
+
+DEFAULTS = {
+    'SIZE': 100,                 # rows kept per board
+    'PRIOR_WEIGHT': 10,          # Bayesian prior, in "virtual ratings" at the catalog mean
+    'TRENDING_WINDOW_DAYS': 30,  # activity older than this is ignored
+    'TRENDING_HALF_LIFE_HOURS': 72,
+    'TRENDING_RATING_WEIGHT': 1.0,
+    'TRENDING_COMMENT_WEIGHT': 2.0,
+}
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_LEADERBOARDS', {})}
+
+
+def top_rated_scores(options):
+    """
+    Bayesian average:  (v / (v + m)) * R + (m / (v + m)) * C
+    R = book mean, v = its rating count, C = catalog mean, m = PRIOR_WEIGHT.
+    A book with one 5★ rating no longer beats one with hundreds of 4.6★.
+    Reads the stored aggregates on Book, no join.
+    """
+    weighted = _weighted_rating(options)
+    if weighted is None:
+        return {}
+    rows = (
+        Book.objects.filter(rating_count__gt=0)
+        .annotate(weighted=weighted)
+        .values_list('id', 'category_id', 'weighted')
+    )
+    return {book_id: (category_id, score) for book_id, category_id, score in rows.iterator()}
+
+
+def _weighted_rating(options):
+    totals = Book.objects.aggregate(ratings=Sum('rating_count'), points=Sum('rating_sum'))
+    if not totals['ratings']:
+        return None
+    catalog_mean = totals['points'] / totals['ratings']
+    prior = options['PRIOR_WEIGHT']
+    return (
+        Cast(F('rating_sum'), FloatField()) + Value(prior * catalog_mean)
+    ) / (F('rating_count') + Value(prior))
+
+
+def most_discussed_scores(options):
+    rows = (
+        Comment.objects.values('book_id')
+        .annotate(comments=Count('id'))
+        .values_list('book_id', 'book__category_id', 'comments')
+    )
+    return {book_id: (category_id, float(count)) for book_id, category_id, count in rows.iterator()}
+
+
+def trending_scores(options, now=None):
+    """
+    Exponentially decayed activity: each rating/comment in the window counts
+    weight * 0.5 ** (age / half life).
+    """
+    now = now or timezone.now()
+    since = now - timedelta(days=options['TRENDING_WINDOW_DAYS'])
+    half_life = options['TRENDING_HALF_LIFE_HOURS'] * 3600
+    scores = defaultdict(float)
+    categories = {}
+
+    sources = (
+        (Rating.objects.filter(rated_at__gte=since).values_list('book_id', 'book__category_id', 'rated_at'),
+         options['TRENDING_RATING_WEIGHT']),
+        (Comment.objects.filter(created_at__gte=since).values_list('book_id', 'book__category_id', 'created_at'),
+         options['TRENDING_COMMENT_WEIGHT']),
+    )
+    for rows, weight in sources:
+        for book_id, category_id, at in rows.iterator(chunk_size=10_000):
+            age = max((now - at).total_seconds(), 0)
+            scores[book_id] += weight * math.pow(0.5, age / half_life)
+            categories[book_id] = category_id
+    return {book_id: (categories[book_id], score) for book_id, score in scores.items()}
+
+
+BOARDS = {
+    LeaderboardEntry.TOP_RATED: top_rated_scores,
+    LeaderboardEntry.MOST_DISCUSSED: most_discussed_scores,
+    LeaderboardEntry.TRENDING: trending_scores,
+}
+
+
+def _ranked(items, size):
+    # best score first, newer book wins ties
+    items = sorted(items, key=lambda item: (-item[1], -item[0]))
+    return items[:size]
+
+
+def refresh(boards=None, options=None):
+    """Rebuild the given boards (all by default). Returns {board: rows written}."""
+    options = options or get_options()
+    size = options['SIZE']
+    written = {}
+    for board in boards or BOARDS:
+        scores = BOARDS[board](options)
+
+        overall = [(book_id, score) for book_id, (_, score) in scores.items()]
+        by_category = defaultdict(list)
+        for book_id, (category_id, score) in scores.items():
+            if category_id is not None:
+                by_category[category_id].append((book_id, score))
+
+        rows = [
+            LeaderboardEntry(board=board, category_id=None, rank=rank, book_id=book_id, score=score)
+            for rank, (book_id, score) in enumerate(_ranked(overall, size), start=1)
+        ]
+        for category_id, items in by_category.items():
+            rows.extend(
+                LeaderboardEntry(board=board, category_id=category_id, rank=rank, book_id=book_id, score=score)
+                for rank, (book_id, score) in enumerate(_ranked(items, size), start=1)
+            )
+
+        # readers see either the old board or the new one, never half of each
+        with transaction.atomic():
+            LeaderboardEntry.objects.filter(board=board).delete()
+            LeaderboardEntry.objects.bulk_create(rows, batch_size=2000)
+        written[board] = len(rows)
+    return written
+
+
+def live_ranking(board, books, options=None):
+    """
+    ``books`` ranked by ``board``'s score computed from the tables, for when
+    the board has no rows yet (refresh_leaderboards hasn't run). Trending
+    counts the activity in the window without the decay.
+    """
+    options = options or get_options()
+    if board == LeaderboardEntry.TOP_RATED:
+        score = _weighted_rating(options)
+        if score is None:
+            return books.none()
+        books = books.filter(rating_count__gt=0)
+    elif board == LeaderboardEntry.MOST_DISCUSSED:
+        score = Count('comment')
+    else:
+        since = timezone.now() - timedelta(days=options['TRENDING_WINDOW_DAYS'])
+        score = ExpressionWrapper(
+            Count('rating', filter=Q(rating__rated_at__gte=since), distinct=True) * options['TRENDING_RATING_WEIGHT']
+            + Count('comment', filter=Q(comment__created_at__gte=since), distinct=True) * options['TRENDING_COMMENT_WEIGHT'],
+            output_field=FloatField(),
+        )
+    return books.annotate(score=score).filter(score__gt=0).order_by('-score', '-id')
+
+
+def entries(board, category_name=None):
+    """Queryset of one board, best first (whole catalog, or one category by name)."""
+    queryset = LeaderboardEntry.objects.filter(board=board)
+    if category_name:
+        queryset = queryset.filter(category__name=category_name)
+    else:
+        queryset = queryset.filter(category__isnull=True)
+    return queryset.select_related('book').order_by('rank')
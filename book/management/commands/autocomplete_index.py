@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book import autocomplete
+
+from .benchmark_views import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the autocomplete prefix index the way a worker does and report its size "
+        "(for sizing workers) and lookup latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--query', action='append', default=[],
+            help="Prefix to look up and time (repeatable). Defaults to a-z.",
+        )
+        parser.add_argument('--repeat', type=int, default=200, help="Lookups per prefix.")
+
+    def handle(self, *args, **options):
+        config = autocomplete.get_options()
+        started = time.perf_counter()
+        index = autocomplete.PrefixIndex.build(config['MAX_SUFFIXES'])
+        build_ms = (time.perf_counter() - started) * 1000
+        stats = index.stats()
+        self.stdout.write(
+            f"{stats['books']} books, {stats['authors']} authors, {stats['categories']} categories: "
+            f"{stats['keys']} keys, {stats['bytes'] / 1024:.1f} KiB, built in {build_ms:.0f} ms"
+        )
+
+        timings = []
+        for prefix in options['query'] or 'abcdefghijklmnopqrstuvwxyz':
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                index.search(prefix, config['DEFAULT_LIMIT'], config['MAX_SCAN'])
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f"lookup p50 {percentile(timings, 0.50):.3f} ms, p99 {percentile(timings, 0.99):.3f} ms "
+            f"({len(timings)} lookups)"
+        )
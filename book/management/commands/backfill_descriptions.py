@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book import cache, rendering
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill Book.excerpt / Book.description_html from the CKEditor description for books "
+        "saved before they existed (or loaded with bulk_create). Saves keep them up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help="Re-render every book, not only missing ones.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        books = Book.objects.all() if options['all'] else Book.objects.filter(description_html='')
+        started = time.monotonic()
+        rendered = 0
+        last_id = 0
+
+        while True:
+            batch = list(books.filter(id__gt=last_id).order_by('id').only('id', 'description')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            for book in batch:
+                rendering.render_description(book)
+            with transaction.atomic():
+                Book.objects.bulk_update(batch, ['excerpt', 'description_html'])
+                Book.touch(pk__in=[book.id for book in batch])
+            cache.bump(*(f'book:{book.id}' for book in batch))
+            rendered += len(batch)
+            self.stdout.write(f"{rendered} rendered")
+
+        if rendered:
+            cache.bump('catalog')
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} descriptions in {time.monotonic() - started:.1f}s."))
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from book.models import Book
+
+from .benchmark_views import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent requests at book_list / book_details through the WSGI handler "
+        "(sync views, thread pool like a threaded WSGI server) and the ASGI handler "
+        "(async views, one event loop like uvicorn), and compare throughput and latency. "
+        "Run `seed_library` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handler', choices=('wsgi', 'asgi', 'both'), default='both')
+        parser.add_argument('--requests', type=int, default=300, help="Requests per handler.")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once.")
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--page-cache', action='store_true', help="Leave the anonymous page cache on.")
+        parser.add_argument('--json', action='store_true', help="Print the raw results as JSON.")
+
+    def handle(self, *args, **options):
+        if options['handler'] == 'both':
+            # the URLconf picks sync or async views at import time: one process per handler
+            results = {handler: self._subprocess(handler, options) for handler in ('wsgi', 'asgi')}
+        else:
+            results = {options['handler']: self._measure(options)}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+        else:
+            self._print(results, options)
+
+    def _subprocess(self, handler, options):
+        env = {**os.environ, 'LIBRARY_ASYNC_VIEWS': '1' if handler == 'asgi' else '0'}
+        command = [
+            sys.executable, sys.argv[0], 'benchmark_concurrency', '--json',
+            '--handler', handler,
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+            '--seed', str(options['seed']),
+        ]
+        if options['page_cache']:
+            command.append('--page-cache')
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode:
+            raise CommandError(f"{handler} run failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])[handler]
+
+    def _measure(self, options):
+        handler = options['handler']
+        if (handler == 'asgi') != settings.BOOK_ASYNC_VIEWS:
+            raise CommandError(
+                f"--handler {handler} needs LIBRARY_ASYNC_VIEWS={'1' if handler == 'asgi' else '0'} "
+                "(or run with --handler both)"
+            )
+        rng = random.Random(options['seed'])
+        book_ids = list(Book.objects.order_by('-rating_count').values_list('id', flat=True)[:200])
+        if not book_ids:
+            raise CommandError("No books to benchmark, run `manage.py seed_library` first.")
+        paths = [
+            reverse('book_list') if rng.random() < 0.4 else reverse('book_details', args=[rng.choice(book_ids)])
+            for _ in range(options['requests'])
+        ]
+
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(BOOK_PAGE_CACHE=options['page_cache'], ALLOWED_HOSTS=allowed_hosts):
+            if handler == 'wsgi':
+                timings, elapsed = self._run_wsgi(paths, options['concurrency'])
+            else:
+                timings, elapsed = asyncio.run(self._run_asgi(paths, options['concurrency']))
+
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'concurrency': options['concurrency'],
+            'wall_s': round(elapsed, 2),
+            'req_per_s': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+        }
+
+    def _run_wsgi(self, paths, concurrency):
+        local = threading.local()
+
+        def fetch(path):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.get(path)
+            elapsed = (time.perf_counter() - started) * 1000
+            connections.close_all()  # like the end of a real request
+            if response.status_code >= 400:
+                raise CommandError(f"{response.status_code} from {path}")
+            return elapsed
+
+        Client().get(paths[0])  # warm up
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(fetch, paths))
+        return timings, time.perf_counter() - started
+
+    async def _run_asgi(self, paths, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(path):
+            async with slots:
+                started = time.perf_counter()
+                response = await client.get(path)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise CommandError(f"{response.status_code} from {path}")
+            return elapsed
+
+        await client.get(paths[0])  # warm up
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(fetch(path) for path in paths))
+        return list(timings), time.perf_counter() - started
+
+    def _print(self, results, options):
+        header = f"{'handler':<10}{'req/s':>9}{'wall s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        self.stdout.write(f"{options['requests']} requests, {options['concurrency']} in flight")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for handler, row in results.items():
+            self.stdout.write(
+                f"{handler:<10}{row['req_per_s']:>9}{row['wall_s']:>9}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+            )
@@ -0,0 +1,166 @@
+import json
+import random
+import time
+from statistics import mean
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from book.models import Book, Category
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive book_list, book_details and profile_view through the test client and report "
+        "p50/p95/p99 latency, SQL query counts and bytes rendered. Run `seed_library` first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help="Requests per scenario.")
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--page-cache', action='store_true', help="Leave the anonymous page cache on.")
+        parser.add_argument('--output', help="Write the results as a JSON baseline to this file.")
+        parser.add_argument('--baseline', help="Compare against a JSON baseline written earlier.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help="Allowed p95 / query count growth against the baseline (0.2 = 20%%).",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.clients = {}
+        book_ids = list(Book.objects.order_by('-rating_count').values_list('id', flat=True)[:200])
+        if not book_ids:
+            raise CommandError("No books to benchmark, run `manage.py seed_library` first.")
+
+        category = (
+            Category.objects.annotate(n=Count('book')).order_by('-n').values_list('name', flat=True).first()
+        )
+        title_words = Book.objects.filter(id__in=book_ids[:20]).values_list('title', flat=True)
+        words = [word for title in title_words for word in title.split() if len(word) > 3] or ['book']
+        deep_page = max(1, Book.objects.count() // 6 // 2)
+        user = User.objects.order_by('id').first()
+
+        scenarios = {
+            'book_list': lambda: self._get(reverse('book_list')),
+            'book_list_q': lambda: self._get(reverse('book_list'), {'q': self.rng.choice(words)}),
+            'book_list_category': lambda: self._get(reverse('book_list'), {'category': category or ''}),
+            'book_list_deep_page': lambda: self._get(reverse('book_list'), {'page': deep_page}),
+            'book_details_get': lambda: self._get(reverse('book_details', args=[self.rng.choice(book_ids)])),
+        }
+        if user:
+            scenarios['book_details_get_auth'] = lambda: self._get(
+                reverse('book_details', args=[self.rng.choice(book_ids)]), user=user
+            )
+            scenarios['book_details_post'] = lambda: self._post(
+                reverse('book_details', args=[self.rng.choice(book_ids)]),
+                {'score': self.rng.randint(1, 5), 'content': 'benchmark comment'},
+                user=user,
+            )
+            scenarios['profile_view'] = lambda: self._get(reverse('profile'), {'section': 'books'}, user=user)
+
+        # the test client talks to "testserver"; one user posting in a loop would hit the write limits
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        throttle_off = {**getattr(settings, 'BOOK_THROTTLE', {}), 'ENABLED': False}
+        with override_settings(
+            BOOK_PAGE_CACHE=options['page_cache'], ALLOWED_HOSTS=allowed_hosts, BOOK_THROTTLE=throttle_off,
+        ):
+            results = {name: self._run(run, options['requests']) for name, run in scenarios.items()}
+
+        self._print(results)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {options['output']}")
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    def _client(self, user):
+        # one client per user, logged in once (not measured)
+        if user not in self.clients:
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            self.clients[user] = client
+        return self.clients[user]
+
+    def _get(self, path, params=None, user=None):
+        return self._client(user).get(path, params or {})
+
+    def _post(self, path, data, user=None):
+        # POSTs write: roll them back so repeated runs measure the same data
+        client = self._client(user)
+        response = None
+        try:
+            with transaction.atomic():
+                response = client.post(path, data)
+                raise Rollback
+        except Rollback:
+            pass
+        return response
+
+    def _run(self, run, count):
+        run()  # warm up (template loading, connection)
+        timings, queries, sizes = [], [], []
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = run()
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise CommandError(f"{response.status_code} from {response.request['PATH_INFO']}")
+            timings.append(elapsed)
+            queries.append(len(captured))
+            sizes.append(len(response.content))
+        timings.sort()
+        return {
+            'requests': count,
+            'p50_ms': round(percentile(timings, 0.50), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'queries_avg': round(mean(queries), 1),
+            'queries_max': max(queries),
+            'bytes_avg': round(mean(sizes)),
+        }
+
+    def _print(self, results):
+        header = f"{'scenario':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'max q':>7}{'bytes':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<24}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+                f"{row['queries_avg']:>9}{row['queries_max']:>7}{row['bytes_avg']:>9}"
+            )
+
+    def _compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as handle:
+            baseline = json.load(handle)
+        regressions = []
+        for name, row in results.items():
+            old = baseline.get(name)
+            if not old:
+                continue
+            for metric in ('p95_ms', 'queries_max'):
+                if row[metric] > old[metric] * (1 + tolerance) and row[metric] - old[metric] >= 1:
+                    regressions.append(f"{name}.{metric}: {old[metric]} -> {row[metric]}")
+        if regressions:
+            raise CommandError("Regressions against baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}."))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from book import cache
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the \"readers who liked this also liked\" lists (item-item similarity over "
+        "the Rating matrix) for books whose ratings changed since the last run. Needs numpy and scipy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every book, not only the changed ones.")
+        parser.add_argument('--top', type=int, default=10, help="Similar books kept per book.")
+        parser.add_argument('--block-size', type=int, default=512, help="Books per similarity block.")
+        parser.add_argument('--shrink', type=float, default=10.0, help="Damping for pairs with few common raters.")
+        parser.add_argument('--min-common', type=int, default=2, help="Minimum readers two books must share.")
+        parser.add_argument('--load-chunk', type=int, default=100_000, help="Ratings fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        try:
+            from book import recommendations
+        except ImportError as exc:
+            raise CommandError(f"compute_similar_books needs numpy and scipy ({exc})")
+
+        started = time.monotonic()
+        rewritten = recommendations.compute(
+            full=options['full'],
+            top=options['top'],
+            block_size=options['block_size'],
+            shrink=options['shrink'],
+            min_common=options['min_common'],
+            load_chunk=options['load_chunk'],
+            log=self.stdout.write,
+        )
+        # the lists are shown on the detail pages
+        Book.touch(pk__in=rewritten)
+        cache.bump(*(f'book:{book_id}' for book_id in rewritten))
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {len(rewritten)} books in {time.monotonic() - started:.1f}s."
+        ))
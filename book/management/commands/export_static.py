@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from book import export
+
+
+def _export(job):
+    # runs in a worker process, with its own database connection
+    return export.export_page(*job)
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-render the public catalog (book pages, category pages, the first catalog pages) "
+        "to static HTML. Only pages whose content changed since the last export are rendered again."
+    )
+
+    def add_arguments(self, parser):
+        options = export.get_options()
+        parser.add_argument('--output', default=options['ROOT'], help="Export directory.")
+        parser.add_argument(
+            '--pages', type=int, default=options['CATALOG_PAGES'], help="Numbered catalog pages to export.",
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--all', action='store_true', help="Render every page, changed or not.")
+
+    def handle(self, *args, **options):
+        root = Path(settings.BASE_DIR, options['output'])
+        pages = export.plan(options['pages'])
+        manifest = export.load_manifest(root)
+
+        removed = [relpath for relpath in manifest if relpath not in pages]
+        for relpath in removed:
+            export.remove_page(root, relpath)
+            del manifest[relpath]
+
+        jobs = [
+            (root, relpath, page) for relpath, page in pages.items()
+            if options['all'] or manifest.get(relpath) != page.fingerprint or not (root / relpath).is_file()
+        ]
+        done = failed = 0
+        if jobs:
+            if options['workers'] > 1:
+                # forked workers must not share the parent's open connections
+                connections.close_all()
+                pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+                results = pool.map(_export, jobs, chunksize=16)
+            else:
+                pool, results = None, map(_export, jobs)
+            try:
+                for relpath, error in results:
+                    if error:
+                        failed += 1
+                        manifest.pop(relpath, None)
+                        self.stderr.write(f"{relpath}: {error}")
+                        continue
+                    manifest[relpath] = pages[relpath].fingerprint
+                    done += 1
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+                # what was written so far is not rendered again next time
+                export.save_manifest(root, manifest)
+        elif removed:
+            export.save_manifest(root, manifest)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {done} pages ({failed} failed, {len(pages) - len(jobs)} unchanged, "
+            f"{len(removed)} removed) into {root}."
+        ))
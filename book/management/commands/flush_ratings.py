@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book import ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Write pending star ratings (the write-behind buffer filled by the AJAX rating "
+        "endpoint) to the Rating table. Requests queue a flush task (run_worker); run this "
+        "to flush right away, from cron, or with --every where no worker runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=float, help="Only flush scores quiet for this many seconds.")
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--every', type=float, help="Keep running, flushing every N seconds.")
+
+    def handle(self, *args, **options):
+        while True:
+            written = ratings.flush(delay=options['delay'], batch_size=options['batch_size'])
+            if written or not options['every']:
+                self.stdout.write(f"Flushed {written} pending ratings.")
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,55 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from book import cache, covers
+from book.models import Book
+
+
+def _generate(cover_name):
+    # runs in a worker process: only touches storage, never the database
+    try:
+        covers.generate_variants(cover_name)
+        return cover_name, None
+    except (OSError, ValueError) as exc:
+        return cover_name, str(exc)
+
+
+class Command(BaseCommand):
+    help = "Backfill the resized WebP/JPEG cover variants for existing books."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help="Regenerate covers that already have variants.")
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+        if not options['force']:
+            books = books.filter(has_cover_variants=False)
+
+        # several books may share one cover file
+        book_ids_by_cover = {}
+        for book_id, cover_name in books.values_list('id', 'cover_image').iterator():
+            book_ids_by_cover.setdefault(cover_name, []).append(book_id)
+
+        if not book_ids_by_cover:
+            self.stdout.write("Nothing to do.")
+            return
+
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for cover_name, error in pool.map(_generate, book_ids_by_cover, chunksize=8):
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{cover_name}: {error}")
+                    continue
+                Book.objects.filter(id__in=book_ids_by_cover[cover_name]).update(has_cover_variants=True)
+                cache.bump(*(f'book:{book_id}' for book_id in book_ids_by_cover[cover_name]))
+                done += 1
+
+        if done:
+            cache.bump('catalog')
+
+        self.stdout.write(self.style.SUCCESS(f"Generated variants for {done} covers ({failed} failed)."))
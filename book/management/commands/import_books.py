@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from book import cache, covers, rendering, search
+from book.signals import generate_book_cover_variants, reconcile_category_counts
+from book.models import Book, Category, ImportCheckpoint
+
+REQUIRED_FIELDS = ('title', 'author')
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        yield from csv.DictReader(handle)
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None  # malformed line: skipped, still counted for the checkpoint
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream books from a CSV or JSONL file into the catalog with batched bulk_create. "
+        "Columns/keys: title, author, description, category, cover (file name in --covers-dir)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import.")
+        parser.add_argument('--format', choices=sorted(READERS), help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--covers-dir', help="Directory holding the cover images named in the `cover` column.")
+        parser.add_argument(
+            '--checkpoint', action='store_true',
+            help=(
+                "Record the progress in the database with every batch; the same file imported again "
+                "with --checkpoint resumes after the last committed batch."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+        fmt = options['format'] or path.suffix.lstrip('.').lower()
+        if fmt not in READERS:
+            raise CommandError(f"Unknown format {fmt!r}, use --format csv|jsonl")
+
+        self.covers_dir = Path(options['covers_dir']) if options['covers_dir'] else None
+        self.categories = {category.name: category for category in Category.objects.all()}
+        # indexing and queueing the cover variants inline need the primary keys back from bulk_create
+        has_ids = connection.features.can_return_rows_from_bulk_insert
+        self.index = search.is_enabled() and has_ids
+        self.queue_covers = has_ids
+        self.covers_missed = False
+
+        self.checkpoint = str(path.resolve()) if options['checkpoint'] else None
+        done = self._load_checkpoint()
+        if done:
+            self.stdout.write(f"Resuming after record {done}.")
+
+        batch_size = options['batch_size']
+        position = imported = skipped = 0
+        batch = []
+        started = time.monotonic()
+
+        for record in READERS[fmt](path):
+            position += 1
+            if position <= done:
+                continue
+            book = self._build_book(record)
+            if book is None:
+                skipped += 1
+            else:
+                batch.append(book)
+            if len(batch) >= batch_size:
+                imported += self._flush(batch, position)
+                batch = []
+                self._report(imported, skipped, started)
+
+        if batch or position > done:
+            imported += self._flush(batch, position)
+
+        # bulk_create sends no signals: recount categories and refresh the page cache once at the end
+        reconcile_category_counts()
+        cache.bump('catalog', 'categories')
+        self._report(imported, skipped, started, final=True)
+        if search.is_enabled() and not self.index:
+            self.stdout.write("Run `manage.py rebuild_search_index` to make the new books searchable.")
+        if self.covers_missed:
+            self.stdout.write("Run `manage.py generate_cover_variants` to resize the imported covers.")
+
+    def _build_book(self, record):
+        if not isinstance(record, dict):
+            return None
+        if any(not isinstance(record.get(field), str) or not record[field].strip() for field in REQUIRED_FIELDS):
+            return None
+        book = Book(
+            title=record['title'].strip()[:100],
+            author=record['author'].strip()[:100],
+            description=record.get('description') or '',
+            category=self._category(record.get('category')),
+        )
+        rendering.render_description(book)  # bulk_create skips the pre_save signal
+        cover = (record.get('cover') or '').strip()
+        if cover and self.covers_dir:
+            book.cover_image = self._store_cover(cover)
+        return book
+
+    def _category(self, name):
+        name = (name or '').strip()[:100]
+        if not name:
+            return None
+        if name not in self.categories:
+            self.categories[name] = Category.objects.create(name=name)
+        return self.categories[name]
+
+    def _store_cover(self, file_name):
+        source = self.covers_dir / os.path.basename(file_name)
+        if not source.is_file():
+            self.stderr.write(f"cover not found: {source}")
+            return None
+        with open(source, 'rb') as handle:
+            content = File(handle)
+            name = covers.content_hash_name(content, source.name)
+            if default_storage.exists(name):
+                return name  # same image imported before
+            return default_storage.save(name, content)
+
+    def _flush(self, batch, position):
+        # the books, their index rows, their cover tasks and the checkpoint commit together
+        with transaction.atomic():
+            Book.objects.bulk_create(batch)
+            if self.index:
+                search.index_books(batch)
+            self._queue_cover_variants(batch)
+            self._save_checkpoint(position)
+        return len(batch)
+
+    def _queue_cover_variants(self, batch):
+        # bulk_create sends no post_save, so the cover signal never sees these books
+        with_cover = [book for book in batch if book.cover_image]
+        if not with_cover:
+            return
+        if not self.queue_covers:
+            self.covers_missed = True
+            return
+        for book in with_cover:
+            generate_book_cover_variants.enqueue(book.pk, dedupe_key=f'covers:{book.pk}')
+
+    def _load_checkpoint(self):
+        if not self.checkpoint:
+            return 0
+        return ImportCheckpoint.objects.filter(input=self.checkpoint).values_list('records', flat=True).first() or 0
+
+    def _save_checkpoint(self, records):
+        if self.checkpoint:
+            ImportCheckpoint.objects.update_or_create(input=self.checkpoint, defaults={'records': records})
+
+    def _report(self, imported, skipped, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        message = f"{imported} imported, {skipped} skipped, {imported / elapsed:.0f} rows/s"
+        if final:
+            self.stdout.write(self.style.SUCCESS(f"Done in {elapsed:.1f}s: {message}"))
+        else:
+            self.stdout.write(message)
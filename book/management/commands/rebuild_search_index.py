@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from book import search
+from book.models import Book
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index (SQLite FTS5) used by book_list."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            raise CommandError(
+                "Full-text search is disabled (set BOOK_SEARCH_FTS = True on a SQLite database)."
+            )
+        total = search.rebuild(Book.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} books."))
@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.core.management.base import BaseCommand
+
+from book import cache
+from book.models import Book, Rating
+
+
+class Command(BaseCommand):
+    help = "Recompute Book.rating_count / rating_sum / rating_avg from the Rating table and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted books.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = fixed = 0
+        last_id = 0
+
+        while True:
+            books = list(
+                Book.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values('id', 'rating_count', 'rating_sum', 'rating_avg')[:batch_size]
+            )
+            if not books:
+                break
+            last_id = books[-1]['id']
+            checked += len(books)
+
+            # one grouped query per batch for the true totals
+            totals = {
+                row['book_id']: (row['count'], row['total'])
+                for row in Rating.objects.filter(book_id__in=[b['id'] for b in books])
+                .values('book_id')
+                .annotate(count=Count('id'), total=Sum('score'))
+            }
+
+            drifted = []
+            for book in books:
+                count, total = totals.get(book['id'], (0, 0))
+                avg = (total / count) if count else None
+                if (book['rating_count'], book['rating_sum'], book['rating_avg']) != (count, total, avg):
+                    drifted.append(Book(id=book['id'], rating_count=count, rating_sum=total, rating_avg=avg))
+
+            fixed += len(drifted)
+            if drifted and not dry_run:
+                with transaction.atomic():
+                    Book.objects.bulk_update(drifted, ['rating_count', 'rating_sum', 'rating_avg'])
+                    Book.touch(pk__in=[book.id for book in drifted])
+                cache.bump(*(f'book:{book.id}' for book in drifted))
+
+        if fixed and not dry_run:
+            cache.bump('catalog')
+
+        verb = "would be fixed" if dry_run else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} books, {fixed} {verb}."))
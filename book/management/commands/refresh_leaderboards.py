@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book import cache, leaderboards
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the top-rated (Bayesian), most-discussed and trending leaderboards, overall "
+        "and per category. Meant to run on a schedule (cron / systemd timer)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--board', action='append', choices=sorted(leaderboards.BOARDS),
+            help="Only rebuild this board (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = leaderboards.refresh(options['board'])
+        cache.bump('catalog', 'leaderboards')
+        for board, rows in written.items():
+            self.stdout.write(f"{board}: {rows} rows")
+        self.stdout.write(self.style.SUCCESS(f"Leaderboards refreshed in {time.monotonic() - started:.1f}s."))
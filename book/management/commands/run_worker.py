@@ -0,0 +1,129 @@
+import logging
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from book import tasks
+
+logger = logging.getLogger(__name__)
+
+PURGE_EVERY = 300  # seconds
+
+
+class _InlineExecutor:
+    """--concurrency 1: run each task in the worker process itself."""
+
+    def submit(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background tasks (book/tasks.py) on a thread or process pool until stopped. "
+        "--stats prints per-task counts and run times instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1, help="Tasks run at once.")
+        parser.add_argument(
+            '--pool', choices=['thread', 'process'], default='thread',
+            help="thread: I/O-bound tasks (database, files); process: CPU-bound ones (image resizing).",
+        )
+        parser.add_argument('--burst', action='store_true', help="Exit once no task is due.")
+        parser.add_argument('--stats', action='store_true', help="Print task metrics and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self._print_stats()
+            return
+
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = max(1, options['concurrency'])
+        poll = tasks.get_options()['POLL_INTERVAL']
+        if concurrency == 1:
+            executor = _InlineExecutor()
+        elif options['pool'] == 'process':
+            # forked workers must not share the parent's open connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=concurrency, initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='task')
+
+        # SIGTERM (systemd, docker stop): finish the running tasks, claim no more
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        self.stdout.write(f"Worker {worker}: {concurrency} x {options['pool'] if concurrency > 1 else 'inline'}")
+
+        in_flight, done_count, failed_count, purged_at = set(), 0, 0, 0.0
+        try:
+            while not stopping:
+                if len(in_flight) < concurrency:
+                    try:
+                        claimed = tasks.claim(concurrency - len(in_flight), worker)
+                    except OperationalError as exc:
+                        # e.g. SQLite busy past its timeout: try again on the next poll
+                        self.stderr.write(f"Could not claim tasks: {exc}")
+                        claimed = []
+                    for task_id in claimed:
+                        in_flight.add(executor.submit(tasks.execute, task_id))
+                if not in_flight:
+                    if options['burst']:
+                        break
+                    time.sleep(poll)
+                else:
+                    finished, in_flight = wait(in_flight, timeout=poll, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        try:
+                            name, ok, duration = future.result()
+                        except Exception as exc:
+                            # the outcome wasn't recorded (database busy, a bug in the bookkeeping):
+                            # the task is retried once its claim expires, the worker keeps going
+                            failed_count += 1
+                            logger.exception("Could not record a task")
+                            self.stderr.write(f"Could not record a task: {exc!r}")
+                            continue
+                        done_count += ok
+                        failed_count += not ok
+                        self.stdout.write(f"{name}: {'done' if ok else 'failed'} in {duration:.1f} ms")
+                if time.monotonic() - purged_at > PURGE_EVERY:
+                    tasks.purge()
+                    purged_at = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # claimed tasks left unfinished here are retried once their claim expires
+            wait(in_flight)
+            executor.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f"Stopped: {done_count} done, {failed_count} failed."))
+
+    def _print_stats(self):
+        def ms(value):
+            return f"{value:.1f}" if value is not None else '-'
+
+        rows = tasks.stats()
+        if not rows:
+            self.stdout.write("No tasks.")
+            return
+        self.stdout.write(
+            f"{'task':<50} {'queued':>6} {'running':>7} {'done':>6} {'failed':>6} {'retried':>7} "
+            f"{'avg ms':>8} {'p95 ms':>8} {'max ms':>8}"
+        )
+        for name, row in rows.items():
+            self.stdout.write(
+                f"{name:<50} {row['queued']:>6} {row['running']:>7} {row['done']:>6} {row['failed']:>6} "
+                f"{row['retried']:>7} {ms(row['avg_ms']):>8} {ms(row['p95_ms']):>8} {ms(row['max_ms']):>8}"
+            )
@@ -0,0 +1,165 @@
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from book import cache, rendering, search
+from book.signals import reconcile_category_counts
+from book.models import Book, Category, Comment, Rating
+
+WORDS = (
+    "shadow river empire garden winter silent crown secret ocean glass iron "
+    "midnight forest city storm golden last letter house dream fire stone "
+    "journey summer daughter king island machine memory night star wolf"
+).split()
+
+AUTHORS = (
+    "Ada Byron", "Tomas Reyes", "Mina Okafor", "Lars Holm", "Priya Nair",
+    "Sofia Marin", "Kenji Sato", "Helen Brooks", "Omar Haddad", "Nora Quinn",
+)
+
+SEED_PASSWORD = 'library-seed'
+
+
+def zipf_cum_weights(count, exponent):
+    """
+    Cumulative popularity weights: item k gets 1 / k**exponent, so a few books
+    get most of the traffic. Cumulative so random.choices doesn't redo the sum.
+    """
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic users, categories, books, ratings and comments "
+        f"(skewed so a few books are very popular). Seeded users log in with '{SEED_PASSWORD}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--ratings', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=5000)
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of book popularity.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        users = self._users(options['users'])
+        categories = self._categories(options['categories'])
+        book_ids = self._books(options['books'], categories)
+
+        # shuffle so popularity is not tied to insertion order
+        self.rng.shuffle(book_ids)
+        weights = zipf_cum_weights(len(book_ids), options['skew'])
+        self._ratings(options['ratings'], users, book_ids, weights)
+        self._comments(options['comments'], users, book_ids, weights)
+
+        # bulk_create bypasses the model signals: rebuild what they maintain
+        call_command('reconcile_ratings', stdout=self.stdout)
+        reconcile_category_counts()
+        if search.is_enabled():
+            call_command('rebuild_search_index', stdout=self.stdout)
+        cache.bump('catalog', 'categories')
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.monotonic() - started:.1f}s."))
+
+    def _title(self):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(2, 4))).title()
+
+    def _users(self, count):
+        password = make_password(SEED_PASSWORD)  # hash once, not per user
+        prefix = f'reader{User.objects.count()}_'
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', password=password) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        self.stdout.write(f"{len(ids)} users")
+        return ids
+
+    def _categories(self, count):
+        existing = set(Category.objects.values_list('name', flat=True))
+        names = [f'{self.rng.choice(WORDS).title()} Stories {i}' for i in range(count)]
+        Category.objects.bulk_create([Category(name=name) for name in names if name not in existing])
+        categories = list(Category.objects.all())
+        self.stdout.write(f"{len(categories)} categories")
+        return categories
+
+    def _books(self, count, categories):
+        first_new_id = (Book.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        for start in range(0, count, self.batch_size):
+            batch = []
+            for _ in range(min(self.batch_size, count - start)):
+                paragraphs = ''.join(
+                    f'<p>{" ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(30, 80)))}.</p>'
+                    for _ in range(self.rng.randint(1, 4))
+                )
+                batch.append(rendering.render_description(Book(
+                    title=self._title(),
+                    author=self.rng.choice(AUTHORS),
+                    description=paragraphs,
+                    category=self.rng.choice(categories) if categories else None,
+                )))
+            with transaction.atomic():
+                Book.objects.bulk_create(batch)
+        ids = list(Book.objects.filter(id__gte=first_new_id).values_list('id', flat=True))
+        self.stdout.write(f"{len(ids)} books")
+        return ids
+
+    def _ratings(self, count, users, book_ids, weights):
+        if not users or not book_ids:
+            return
+        count = min(count, len(users) * len(book_ids))
+        seen = set()
+        batch = []
+        created = 0
+        attempts = count * 20  # heavy skew makes repeats of popular pairs common
+        while created + len(batch) < count and attempts:
+            attempts -= 1
+            pair = (self.rng.choice(users), self.rng.choices(book_ids, cum_weights=weights)[0])
+            if pair in seen:
+                continue  # unique_together (user, book)
+            seen.add(pair)
+            # scores lean positive, like real reviews
+            batch.append(Rating(user_id=pair[0], book_id=pair[1], score=self.rng.choices((1, 2, 3, 4, 5), (1, 2, 4, 6, 5))[0]))
+            if len(batch) >= self.batch_size:
+                created += self._bulk(Rating, batch)
+                batch = []
+        created += self._bulk(Rating, batch)
+        self.stdout.write(f"{created} ratings")
+
+    def _comments(self, count, users, book_ids, weights):
+        if not users or not book_ids:
+            return
+        created = 0
+        for start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - start)
+            books = self.rng.choices(book_ids, cum_weights=weights, k=size)
+            batch = [
+                Comment(
+                    user_id=self.rng.choice(users),
+                    book_id=book_id,
+                    content=' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(5, 40))),
+                )
+                for book_id in books
+            ]
+            created += self._bulk(Comment, batch)
+        self.stdout.write(f"{created} comments")
+
+    def _bulk(self, model, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            model.objects.bulk_create(batch, ignore_conflicts=model is Rating)
+        return len(batch)
@@ -0,0 +1,223 @@
+import contextvars
+import heapq
+import json
+import logging
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template as DjangoBackendTemplate
+from django.utils.cache import patch_vary_headers
+
+slow_request_logger = logging.getLogger('book.slow_requests')
+
+_current_profile = contextvars.ContextVar('book_request_profile', default=None)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,
+    'SLOWEST_QUERIES': 5,
+    'SERVER_TIMING': True,
+}
+
+
+def get_profiling_settings():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_PROFILING', {})}
+
+
+class RequestProfile:
+    def __init__(self, keep_slowest):
+        self.keep_slowest = keep_slowest
+        self.query_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.slowest = []  # min-heap of (duration_ms, sequence, sql, call site)
+
+    def add_query(self, sql, duration_ms):
+        self.query_count += 1
+        self.sql_ms += duration_ms
+        entry_needed = len(self.slowest) < self.keep_slowest or duration_ms > self.slowest[0][0]
+        if entry_needed and self.keep_slowest:
+            # the stack is only walked for queries that make it into the top N
+            entry = (duration_ms, self.query_count, sql, _call_site())
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heapreplace(self.slowest, entry)
+
+
+_PROJECT_ROOT = str(Path(settings.BASE_DIR).resolve()) if hasattr(settings, 'BASE_DIR') else ''
+_THIS_FILE = __file__
+
+
+def _call_site():
+    """First stack frame in project code (not Django, not this module)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(_PROJECT_ROOT)
+            and filename != _THIS_FILE
+            and 'site-packages' not in filename
+        ):
+            return f"{Path(filename).relative_to(_PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _query_timer(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, (time.perf_counter() - started) * 1000)
+
+
+_original_template_render = DjangoBackendTemplate.render
+
+
+def _timed_template_render(self, context=None, request=None):
+    profile = _current_profile.get()
+    if profile is None:
+        return _original_template_render(self, context, request)
+    started = time.perf_counter()
+    sql_before = profile.sql_ms
+    try:
+        return _original_template_render(self, context, request)
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        # lazy querysets evaluated while rendering are already counted as SQL time
+        profile.template_ms += elapsed - (profile.sql_ms - sql_before)
+
+
+class RequestProfilingMiddleware:
+    """
+    Per-request SQL and template timing.
+
+    Records the query count, total SQL time, the slowest statements (with the
+    project line that issued them) and template render time. Emits them as a
+    `Server-Timing` header and logs requests slower than SLOW_REQUEST_MS to the
+    `book.slow_requests` logger as one JSON object per line.
+
+    With BOOK_PROFILING['ENABLED'] off the middleware removes itself from the
+    chain at startup (MiddlewareNotUsed), so it costs nothing to leave installed.
+
+    Sync only. The query timer is installed on the connections of the thread
+    running the middleware; under ASGI Django runs it in the sync thread and
+    the async ORM's thread-sensitive calls come back to that thread, so the
+    async views are measured too. Queries on other threads (sync_to_async with
+    thread_sensitive=False, background rebuilds) use their own connections and
+    are not seen.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.options = get_profiling_settings()
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        DjangoBackendTemplate.render = _timed_template_render
+
+    def __call__(self, request):
+        profile = RequestProfile(self.options['SLOWEST_QUERIES'])
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_query_timer))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if self.options['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={profile.sql_ms:.1f};desc="{profile.query_count} queries"',
+                f'tpl;dur={profile.template_ms:.1f};desc="templates"',
+                f'app;dur={total_ms:.1f};desc="total"',
+            ])
+
+        if total_ms >= self.options['SLOW_REQUEST_MS']:
+            slow_request_logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'sql_ms': round(profile.sql_ms, 1),
+                'template_ms': round(profile.template_ms, 1),
+                'queries': profile.query_count,
+                'slowest_queries': [
+                    {'ms': round(duration, 2), 'sql': sql[:500], 'call_site': call_site}
+                    for duration, _, sql, call_site in sorted(profile.slowest, reverse=True)
+                ],
+            }))
+        return response
+
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class AnonymousFastPathMiddleware:
+    """
+    Anonymous GETs without a session cookie skip the session and auth lookups.
+
+    Such a visitor can only be anonymous, so request.user is set to an
+    AnonymousUser up front instead of the lazy object that would open the
+    session store and ask the auth backends. Templates checking
+    `user.is_authenticated` then leave the session untouched, so the page
+    renders from the catalog tables alone. `Vary: Cookie` is added explicitly
+    (SessionMiddleware only adds it when the session was read): the page still
+    differs for a visitor who logs in.
+
+    Goes after AuthenticationMiddleware. Disabled with BOOK_ANONYMOUS_FAST_PATH
+    (the middleware then removes itself, like RequestProfilingMiddleware).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'BOOK_ANONYMOUS_FAST_PATH', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._applies(request):
+            return self.get_response(request)
+        response = self.get_response(request)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    async def __acall__(self, request):
+        if not self._applies(request):
+            return await self.get_response(request)
+        response = await self.get_response(request)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    @staticmethod
+    def _applies(request):
+        if request.method not in SAFE_METHODS or settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+        user = AnonymousUser()
+
+        async def auser():
+            return user
+
+        request.user = user
+        request.auser = auser
+        return True
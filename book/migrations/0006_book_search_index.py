@@ -0,0 +1,52 @@
+import html
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5("
+    "title, author, description, category, "
+    "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other databases keep using icontains search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Book = apps.get_model('book', 'Book')
+    schema_editor.execute(CREATE_TABLE_SQL)
+    rows = []
+    for book in Book.objects.select_related('category').iterator():
+        description = ' '.join(html.unescape(strip_tags(book.description or '')).split())
+        rows.append((
+            book.id,
+            book.title,
+            book.author,
+            description,
+            book.category.name if book.category_id else '',
+        ))
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO book_search (rowid, title, author, description, category) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS book_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0005_alter_book_description'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0009_similar_books'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='rated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('top_rated', 'Top Rated'), ('most_discussed', 'Most Discussed'), ('trending', 'Trending')], max_length=20)),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='book.book')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='book.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['board', 'category', 'rank'], name='book_leader_board_e49d7f_idx')],
+            },
+        ),
+    ]
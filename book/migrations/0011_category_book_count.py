@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_book_counts(apps, schema_editor):
+    Book = apps.get_model('book', 'Book')
+    Category = apps.get_model('book', 'Category')
+    counts = Book.objects.filter(category__isnull=False).values('category_id').annotate(n=Count('id'))
+    for row in counts:
+        Category.objects.filter(pk=row['category_id']).update(book_count=row['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0010_leaderboards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_book_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:28
+
+import book.covers
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0014_book_rendered_description'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, upload_to=book.covers.hashed_upload_to),
+        ),
+    ]
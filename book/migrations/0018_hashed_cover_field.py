@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:11
+
+import book.covers
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0017_task_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=book.covers.HashedImageField(blank=True, null=True, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,134 @@
+import html
+from html.parser import HTMLParser
+
+from django.db import migrations
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+BATCH_SIZE = 500
+
+# Frozen copy of book/rendering.py (and search.html_to_text) as of this
+# migration: later changes to the live renderer must not change what this
+# backfill writes, nor break it if the module is moved or renamed.
+
+EXCERPT_WORDS = 40
+
+ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'div', 'span', 'blockquote', 'pre', 'code',
+    'strong', 'b', 'em', 'i', 'u', 's', 'sub', 'sup',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'ul', 'ol', 'li', 'a', 'img',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+SAFE_URL_SCHEMES = {'http', 'https', 'mailto'}
+
+
+def html_to_text(value):
+    text = html.unescape(strip_tags(value or ''))
+    return ' '.join(text.split())
+
+
+def _safe_url(value):
+    value = ''.join(value.split()).lower()
+    scheme, colon, _ = value.partition(':')
+    if not colon or any(char in scheme for char in '/?#'):
+        return True
+    return scheme in SAFE_URL_SCHEMES
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = ''
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in ('href', 'src') and not _safe_url(value):
+                continue
+            rendered += f' {name}="{html.escape(value)}"'
+        self.parts.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        return ''.join(self.parts) + ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+
+
+def sanitize_html(value):
+    sanitizer = _Sanitizer()
+    sanitizer.feed(value or '')
+    return sanitizer.result()
+
+
+def make_excerpt(value):
+    return Truncator(html_to_text(value)).words(EXCERPT_WORDS)
+
+
+def render_descriptions(apps, schema_editor):
+    # books saved before 0014 added the fields (what `manage.py backfill_descriptions` does)
+    Book = apps.get_model('book', 'Book')
+    last_id = 0
+    while True:
+        batch = list(
+            Book.objects.filter(id__gt=last_id, description_html='')
+            .order_by('id').only('id', 'description')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for book in batch:
+            book.excerpt = make_excerpt(book.description)
+            book.description_html = sanitize_html(book.description)
+        Book.objects.bulk_update(batch, ['excerpt', 'description_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('book', '0018_hashed_cover_field'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_descriptions, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import User
 from ckeditor.fields import RichTextField
-from django.db.models import Avg  # This import is correctly included
+from . import covers
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Cast, NullIf
+from django.utils import timezone
 
 class Category(models.Model):
-    name = models.CharField(max_length=100)
+    # indexed: book_list filters on category__name
+    name = models.CharField(max_length=100, db_index=True)
+    # ⚡ books in this category, kept in sync by the Book signals in signals.py
+    book_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -17,19 +23,82 @@ class Book(models.Model):
     title = models.CharField(max_length=100)
     author = models.CharField(max_length=100)
     description = RichTextField()
-    cover_image = models.ImageField(upload_to="book_covers/", blank=True, null=True)
+    # ⚡ pre-rendered from description on save (see rendering.py): list cards read the
+    # excerpt with description deferred, the detail page the sanitized HTML
+    excerpt = models.TextField(blank=True, default='')
+    description_html = models.TextField(blank=True, default='')
+    # stored as book_covers/<content hash>.<ext> (long-term cacheable, see covers.py)
+    cover_image = covers.HashedImageField(blank=True, null=True)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # True once the resized WebP/JPEG covers exist (see covers.py)
+    has_cover_variants = models.BooleanField(default=False)
+
+    # ⚡ Denormalized rating aggregates, kept in sync by the Rating signals in signals.py
+    # (see Book.apply_rating_delta). `manage.py reconcile_ratings` repairs any drift.
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_avg = models.FloatField(null=True, blank=True)
+    # set whenever a rating changes; `manage.py compute_similar_books` recomputes these books
+    similarity_dirty = models.BooleanField(default=True, db_index=True)
+    # ⚡ bumped whenever the detail page changes (edits, ratings, comments, similar
+    # books; see Book.touch): ETag / Last-Modified of book_details without rendering it
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # one index per hot query (EXPLAIN QUERY PLAN checks in tests.py)
+        indexes = [
+            # profile_view: books by author (username)
+            models.Index(fields=['author'], name='book_author_idx'),
+            # book_list, latest first: whole catalog and one category
+            models.Index(fields=['created_at', 'id'], name='book_latest_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='book_category_latest_idx'),
+            # book_list sort=rating (also the cursor pagination order)
+            models.Index(fields=['rating_avg', 'rating_count', 'id'], name='book_rating_rank_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored cover so a new upload can be detected on save
+        instance._original_cover = instance.__dict__.get('cover_image')
+        # ...and the stored category, so a move can shift Category.book_count
+        instance._original_category_id = instance.__dict__.get('category_id')
+        # ...and the description (absent when deferred), to re-render it only when it changes
+        instance._original_description = instance.__dict__.get('description')
+        return instance
 
-    # 🐛 FIX: Switched from inefficient Python calculation to efficient Django ORM aggregation (Avg)
     @property
     def average_rating(self):
-        # Annotate the Book queryset with the average 'score' from related 'Rating' objects
-        # The result is a dictionary: {'score__avg': <average_value>}
-        avg_result = self.rating_set.aggregate(Avg('score'))
-        
-        # Return the calculated average, or None if there are no ratings
-        return avg_result['score__avg']
+        # No query: the average is stored on the row (None when there are no ratings)
+        return self.rating_avg
+
+    @classmethod
+    def apply_rating_delta(cls, book_id, count_delta, sum_delta):
+        """
+        Atomically shift the stored aggregates of one book.
+        A single UPDATE with F() expressions, so concurrent ratings can't lose updates.
+        """
+        new_count = F('rating_count') + count_delta
+        new_sum = F('rating_sum') + sum_delta
+        cls.objects.filter(pk=book_id).update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            rating_avg=Cast(new_sum, models.FloatField()) / NullIf(new_count, 0),
+            similarity_dirty=True,
+            **cls.touch_fields(),
+        )
+
+    @staticmethod
+    def touch_fields():
+        # a new version + modification time, for .update(**Book.touch_fields())
+        return {'version': F('version') + 1, 'updated_at': timezone.now()}
+
+    @classmethod
+    def touch(cls, **filters):
+        """Mark the matching books' detail pages as changed (one UPDATE)."""
+        return cls.objects.filter(**filters).update(**cls.touch_fields())
 
     def __str__(self):
         return self.title
@@ -42,27 +111,187 @@ class Rating(models.Model):
     # I'll stick with the default 'rating_set' in the fix.
     book = models.ForeignKey(Book, on_delete=models.CASCADE) 
     score = models.PositiveIntegerField()  # 1–5 stars
+    # last time the score was set (feeds the trending leaderboard)
+    rated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("user", "book")  # ✅ one rating per user per book
+        indexes = [
+            # covering: a book's scores (reconcile, API, recommendations) read from the index alone;
+            # (user, book) lookups use the unique index
+            models.Index(fields=['book', 'user', 'score'], name='rating_book_user_score_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored score so the post_save signal can apply only the difference
+        instance._original_score = instance.__dict__.get('score')
+        return instance
 
     def __str__(self):
         # NOTE: I changed 'rating' to 'score' here to match the field name in the Rating model.
         return f"{self.user} rated {self.book} {self.score}★" 
 
 
+class CommentQuerySet(models.QuerySet):
+    def with_rating_score(self):
+        """
+        Bring in each commenter's score for the commented book in the same query
+        (correlated subquery on the unique (user, book) rating), instead of one
+        Rating lookup per comment.
+        """
+        score = Rating.objects.filter(
+            user=OuterRef('user_id'), book=OuterRef('book_id')
+        ).values('score')[:1]
+        return self.annotate(annotated_rating_score=Subquery(score))
+
+
 class Comment(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
-    # 💡 Minor improvement: Check for a rating in one query.
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # a book's comments, newest first (book_details, "load more")
+            models.Index(fields=['book', 'created_at', 'id'], name='comment_book_latest_idx'),
+        ]
+
     @property
     def rating_score(self):
-        # Use .values_list('score', flat=True) for a cleaner result retrieval
-        score = Rating.objects.filter(user=self.user, book=self.book).values_list('score', flat=True).first()
+        # ⚡ Use the value from CommentQuerySet.with_rating_score() when it was loaded
+        if hasattr(self, 'annotated_rating_score'):
+            return self.annotated_rating_score
+        score = Rating.objects.filter(user_id=self.user_id, book_id=self.book_id).values_list('score', flat=True).first()
         return score # returns the score (int) or None
 
     def __str__(self):
-        return f"{self.user} commented on {self.book}"
\ No newline at end of file
+        return f"{self.user} commented on {self.book}"
+
+
+class SimilarBook(models.Model):
+    """Precomputed "readers who liked this also liked" list (see recommendations.py)."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similar_books')
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()  # 1 = most similar
+
+    class Meta:
+        unique_together = ("book", "rank")  # also the index book_details reads through
+
+    def __str__(self):
+        return f"{self.book} ~ {self.similar} ({self.score:.2f})"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    One row of a precomputed ranking, rebuilt by `manage.py refresh_leaderboards`.
+    category NULL is the whole-catalog board. Reading a board is a range scan
+    on the (board, category, rank) index.
+    """
+    TOP_RATED = 'top_rated'
+    MOST_DISCUSSED = 'most_discussed'
+    TRENDING = 'trending'
+    BOARD_CHOICES = [
+        (TOP_RATED, 'Top Rated'),
+        (MOST_DISCUSSED, 'Most Discussed'),
+        (TRENDING, 'Trending'),
+    ]
+
+    board = models.CharField(max_length=20, choices=BOARD_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    rank = models.PositiveIntegerField()  # 1 = first
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=['board', 'category', 'rank'])]
+
+    def __str__(self):
+        return f"{self.get_board_display()} #{self.rank}: {self.book}"
+
+
+class PendingRating(models.Model):
+    """
+    A star click not yet written to Rating (see ratings.py). Repeated clicks on
+    the same book overwrite this one row; the flush applies the last score.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = ("user", "book")
+
+    def __str__(self):
+        return f"{self.user} pending {self.score}★ on {self.book}"
+
+
+class Task(models.Model):
+    """
+    A deferred call of a @tasks.task function, run by `manage.py run_worker`
+    (see tasks.py). Finished rows keep their timing for the per-task metrics.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # at most one queued task per key: enqueueing it again is a no-op
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # claim token of the worker running it, and when that claim expires (worker died)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # the worker's poll: due tasks, oldest first
+            models.Index(fields=['status', 'run_after'], name='task_due_idx'),
+            # metrics per task name
+            models.Index(fields=['name', 'finished_at'], name='task_name_finished_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], condition=models.Q(status='queued'), name='task_queued_dedupe_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class ImportCheckpoint(models.Model):
+    """
+    How far `manage.py import_books --checkpoint` got through an input file.
+    Written in the transaction of each batch, so a crash never leaves books
+    behind that a resumed import would insert again.
+    """
+    input = models.CharField(max_length=500, unique=True)  # resolved path of the imported file
+    records = models.PositiveIntegerField(default=0)  # records read, up to the last committed batch
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.input} ({self.records} records)"
@@ -0,0 +1,164 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Keyset ("cursor") pagination for the book catalog.
+#
+# Instead of OFFSET + COUNT(*), every page is fetched with a WHERE clause that
+# seeks past the last row of the previous page, so page 1 and page 1000 cost the
+# same. Orderings are descending on every key; the tuple always ends with `id`
+# so it is unique. Nullable keys sort last (SQLite's default for DESC).
+ORDERINGS = {
+    'latest': (('created_at', False), ('id', False)),
+    'rating': (('rating_avg', True), ('rating_count', False), ('id', False)),
+    'id': (('id', False),),
+}
+
+CURSOR_SALT = 'book.pagination.cursor'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, direction):
+    """Opaque, tamper-proof token for a position in the listing."""
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    return signing.dumps({'v': values, 'd': direction}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token, model, keys):
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        values, direction = data['v'], data['d']
+    except (signing.BadSignature, KeyError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or len(values) != len(keys):
+        raise InvalidCursor(token)
+    try:
+        values = [
+            None if value is None else model._meta.get_field(name).to_python(value)
+            for (name, _), value in zip(keys, values)
+        ]
+    except ValidationError:
+        # signed by us, but a value no longer parses as its field (e.g. after a schema change)
+        raise InvalidCursor(token)
+    return values, direction
+
+
+def _seek_filter(keys, values, forward):
+    """
+    Lexicographic "row comes after (forward) / before (backward) the cursor" filter
+    for a DESC NULLS LAST ordering:  k1 < v1  OR  (k1 = v1 AND k2 < v2)  OR ...
+    """
+    condition = Q(pk__in=[])  # always false
+    equal_so_far = Q()
+    for (name, nullable), value in zip(keys, values):
+        if forward:
+            if value is None:
+                step = Q(pk__in=[])  # nothing sorts after NULL
+            else:
+                step = Q(**{f'{name}__lt': value})
+                if nullable:
+                    step |= Q(**{f'{name}__isnull': True})
+        else:
+            if value is None:
+                step = Q(**{f'{name}__isnull': False})
+            else:
+                step = Q(**{f'{name}__gt': value})
+        condition |= equal_so_far & step
+        if value is None:
+            equal_so_far &= Q(**{f'{name}__isnull': True})
+        else:
+            equal_so_far &= Q(**{name: value})
+    return condition
+
+
+class CursorPage:
+    """Quacks enough like django.core.paginator.Page for the list template."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    def __init__(self, queryset, per_page, ordering='latest'):
+        self.keys = ORDERINGS.get(ordering, ORDERINGS['latest'])
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def _order(self, forward):
+        return [f'-{name}' if forward else name for name, _ in self.keys]
+
+    def _cursor_for(self, obj, direction):
+        # rows are model instances, or dicts for .values() querysets
+        if isinstance(obj, dict):
+            values = [obj[name] for name, _ in self.keys]
+        else:
+            values = [getattr(obj, name) for name, _ in self.keys]
+        return encode_cursor(values, direction)
+
+    def _query(self, token):
+        values, direction = None, 'next'
+        if token:
+            try:
+                values, direction = decode_cursor(token, self.queryset.model, self.keys)
+            except InvalidCursor:
+                values = None
+        forward = direction == 'next'
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(_seek_filter(self.keys, values, forward))
+        # one extra row tells us whether there is another page in this direction
+        return queryset.order_by(*self._order(forward))[:self.per_page + 1], values, forward
+
+    def _page(self, rows, values, forward):
+        """CursorPage for the fetched rows, or None when the first page should be served instead."""
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if not forward:
+            if not has_more:
+                # walked back to the start: serve a full first page
+                return None
+            rows.reverse()
+
+        if not rows:
+            return CursorPage([])
+        has_next = has_more if forward else True
+        has_previous = values is not None
+        return CursorPage(
+            rows,
+            next_cursor=self._cursor_for(rows[-1], 'next') if has_next else None,
+            previous_cursor=self._cursor_for(rows[0], 'prev') if has_previous else None,
+        )
+
+    def get_page(self, token=None):
+        """Return the page after/before ``token``; a missing or bad token gives the first page."""
+        queryset, values, forward = self._query(token)
+        page = self._page(list(queryset), values, forward)
+        return page if page is not None else self.get_page()
+
+    async def aget_page(self, token=None):
+        """get_page() through the async ORM."""
+        queryset, values, forward = self._query(token)
+        page = self._page([row async for row in queryset], values, forward)
+        return page if page is not None else await self.aget_page()
@@ -0,0 +1,152 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import autocomplete, cache, tasks
+from .models import Book, PendingRating, Rating
+
+# Write-behind for star ratings.
+#
+# A click only upserts one PendingRating row per (user, book), so a user
+# flipping between stars rewrites the same row instead of the Rating table,
+# the book aggregates and the page cache every time. Once a pair has been
+# quiet for DELAY_SECONDS, flush() writes the last score to Rating in batches
+# (an upsert on the (user, book) unique key) and shifts the book aggregates
+# once per book.
+#
+# A click queues one flush_pending task DELAY_SECONDS ahead (a queued one is
+# reused); when it runs, pairs clicked since are not quiet yet and it queues
+# itself again for the moment the oldest of them will be.
+
+DEFAULTS = {
+    'ENABLED': True,
+    'DELAY_SECONDS': 5,     # quiet period before a pending score is written
+    'BATCH_SIZE': 500,
+}
+
+FLUSH_TASK_KEY = 'ratings:flush'
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_RATING_WRITE_BEHIND', {})}
+
+
+def current_score(user_id, book_id):
+    """The user's score for a book, pending or stored (None if never rated)."""
+    pending = PendingRating.objects.filter(user_id=user_id, book_id=book_id).values_list('score', flat=True).first()
+    if pending is not None:
+        return pending
+    return Rating.objects.filter(user_id=user_id, book_id=book_id).values_list('score', flat=True).first()
+
+
+def submit(user, book, score):
+    """
+    Record a star click. Returns the book's (rating_avg, rating_count) as they
+    will be once this score is applied.
+    """
+    stored = Rating.objects.filter(user=user, book=book).values_list('score', flat=True).first()
+    if not get_options()['ENABLED']:
+        # the Rating signals update the aggregates
+        Rating.objects.update_or_create(user=user, book=book, defaults={'score': score})
+        book.refresh_from_db(fields=['rating_avg', 'rating_count'])
+        return book.rating_avg, book.rating_count
+
+    # one statement: insert, or overwrite the pending score of this pair
+    PendingRating.objects.bulk_create(
+        [PendingRating(user=user, book=book, score=score)],
+        update_conflicts=True,
+        unique_fields=['user', 'book'],
+        update_fields=['score', 'updated_at'],
+    )
+    count = book.rating_count + (stored is None)
+    total = book.rating_sum - (stored or 0) + score
+    return total / count, count
+
+
+def discard(user, book):
+    """Drop a pending score (the user's rating was just written directly)."""
+    PendingRating.objects.filter(user=user, book=book).delete()
+
+
+def flush(delay=None, batch_size=None):
+    """Write pending scores quiet for ``delay`` seconds to Rating. Returns how many were written."""
+    options = get_options()
+    delay = options['DELAY_SECONDS'] if delay is None else delay
+    batch_size = batch_size or options['BATCH_SIZE']
+    cutoff = timezone.now() - timedelta(seconds=delay)
+    written = 0
+    while True:
+        with transaction.atomic():
+            pending = list(
+                PendingRating.objects.filter(updated_at__lte=cutoff)
+                .order_by('id')
+                .values_list('id', 'user_id', 'book_id', 'score')[:batch_size]
+            )
+            if not pending:
+                break
+            changed_books = _apply(pending)
+            # a pair clicked again since we read it keeps its newer row
+            PendingRating.objects.filter(id__in=[row[0] for row in pending], updated_at__lte=cutoff).delete()
+        written += len(pending)
+        if changed_books:
+            cache.bump('catalog', *(f'book:{book_id}' for book_id in changed_books))
+    return written
+
+
+def schedule_flush():
+    """Make sure a flush is queued for when this click has been quiet for DELAY_SECONDS."""
+    options = get_options()
+    if not options['ENABLED']:
+        return
+    # ⚡ one INSERT OR IGNORE: clicks arriving while a flush is queued share it
+    flush_pending.enqueue(dedupe_key=FLUSH_TASK_KEY, countdown=options['DELAY_SECONDS'])
+
+
+@tasks.task
+def flush_pending():
+    if tasks.get_options()['EAGER']:
+        # run inline from the click: there is no worker to come back later, write it now
+        flush(delay=0)
+        return
+    flush()
+    # pairs clicked after this task was queued: come back once the oldest is quiet
+    oldest = PendingRating.objects.order_by('updated_at').values_list('updated_at', flat=True).first()
+    if oldest is not None:
+        quiet_at = oldest + timedelta(seconds=get_options()['DELAY_SECONDS'])
+        countdown = max((quiet_at - timezone.now()).total_seconds(), 0)
+        flush_pending.enqueue(dedupe_key=FLUSH_TASK_KEY, countdown=countdown)
+
+
+def _apply(pending):
+    """Upsert one batch into Rating and shift each book's aggregates once."""
+    # user_id IN (...) AND book_id IN (...), then keep the exact pairs
+    # (one OR per pair would blow SQLite's expression depth limit on big batches)
+    wanted = {(user_id, book_id) for _, user_id, book_id, _ in pending}
+    rows = Rating.objects.filter(
+        user_id__in={user_id for user_id, _ in wanted}, book_id__in={book_id for _, book_id in wanted}
+    ).values_list('user_id', 'book_id', 'score')
+    stored = {(user_id, book_id): score for user_id, book_id, score in rows if (user_id, book_id) in wanted}
+
+    deltas = defaultdict(lambda: [0, 0])  # book_id -> [count delta, sum delta]
+    for _, user_id, book_id, score in pending:
+        old = stored.get((user_id, book_id))
+        if old == score:
+            continue
+        deltas[book_id][0] += old is None
+        deltas[book_id][1] += score - (old or 0)
+
+    # bulk upsert on the (user, book) unique key; bulk_create sends no signals,
+    # so the aggregates are shifted below instead of per row
+    Rating.objects.bulk_create(
+        [Rating(user_id=user_id, book_id=book_id, score=score) for _, user_id, book_id, score in pending],
+        update_conflicts=True,
+        unique_fields=['user', 'book'],
+        update_fields=['score', 'rated_at'],
+    )
+    for book_id, (count_delta, sum_delta) in deltas.items():
+        Book.apply_rating_delta(book_id, count_delta, sum_delta)
+        autocomplete.ratings_changed(book_id, count_delta)
+    return list(deltas)
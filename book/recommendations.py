@@ -0,0 +1,179 @@
+"""
+Item-item "readers who liked this also liked" engine.
+
+Ratings are loaded in chunks into a sparse users x books matrix, centered on
+each user's mean score (adjusted cosine), and similarities are computed one
+block of books at a time with sparse matrix products. Only books flagged with
+Book.similarity_dirty (set whenever one of their ratings changes) are
+recomputed, plus the books whose stored top-N the changed similarities can
+affect. Results land in SimilarBook, which book_details reads with a single
+indexed query.
+
+Needs numpy and scipy; only the management command imports this module.
+"""
+from array import array
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Book, Rating, SimilarBook
+
+
+class RatingMatrix:
+    def __init__(self, users, books, scores):
+        self.book_ids, book_index = np.unique(books, return_inverse=True)
+        _, user_index = np.unique(users, return_inverse=True)
+        shape = (int(user_index.max()) + 1 if len(users) else 0, len(self.book_ids))
+
+        # adjusted cosine: remove each user's rating bias
+        scores = scores.astype(np.float64)
+        user_sum = np.bincount(user_index, weights=scores, minlength=shape[0])
+        user_count = np.bincount(user_index, minlength=shape[0])
+        centered = scores - (user_sum / np.maximum(user_count, 1))[user_index]
+
+        self.centered = sparse.csc_matrix((centered, (user_index, book_index)), shape=shape)
+        self.rated = sparse.csc_matrix((np.ones_like(scores), (user_index, book_index)), shape=shape)
+        self.norms = np.sqrt(np.asarray(self.centered.multiply(self.centered).sum(axis=0))).ravel()
+        self.position = {int(book_id): i for i, book_id in enumerate(self.book_ids)}
+
+    @classmethod
+    def load(cls, chunk_size=100_000):
+        """Stream the Rating table into compact typed arrays (no model instances)."""
+        users, books, scores = array('q'), array('q'), array('b')
+        rows = Rating.objects.values_list('user_id', 'book_id', 'score').order_by()
+        for user_id, book_id, score in rows.iterator(chunk_size=chunk_size):
+            users.append(user_id)
+            books.append(book_id)
+            scores.append(score)
+        return cls(
+            np.frombuffer(users, dtype=np.int64),
+            np.frombuffer(books, dtype=np.int64),
+            np.frombuffer(scores, dtype=np.int8),
+        )
+
+    def similarities(self, columns, shrink, min_common):
+        """
+        Sparse (len(columns) x books) similarity block: adjusted cosine, shrunk
+        towards 0 for pairs with few common raters.
+        """
+        dot = (self.centered[:, columns].T @ self.centered).tocsr()
+        common = (self.rated[:, columns].T @ self.rated).tocsr()
+
+        dot = dot.tocoo()
+        common_values = np.asarray(common[dot.row, dot.col]).ravel()
+        denominator = self.norms[columns][dot.row] * self.norms[dot.col]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = dot.data / denominator * (common_values / (common_values + shrink))
+        keep = (
+            (common_values >= min_common)
+            & np.isfinite(values)
+            & (values > 0)
+            & (np.asarray(columns)[dot.row] != dot.col)  # not similar to itself
+        )
+        return sparse.csr_matrix(
+            (values[keep], (dot.row[keep], dot.col[keep])), shape=(len(columns), len(self.book_ids))
+        )
+
+
+def top_n(row, n):
+    """(columns, scores) of the n largest entries of one sparse row, best first."""
+    if row.nnz == 0:
+        return np.array([], dtype=np.int64), np.array([])
+    data, indices = row.data, row.indices
+    if len(data) > n:
+        best = np.argpartition(-data, n)[:n]
+        data, indices = data[best], indices[best]
+    order = np.argsort(-data, kind='stable')
+    return indices[order], data[order]
+
+
+def compute(full=False, top=10, block_size=512, shrink=10.0, min_common=2, load_chunk=100_000, log=print):
+    """Recompute SimilarBook rows. Returns the ids of the books whose list was rewritten."""
+    books = Book.objects.all() if full else Book.objects.filter(similarity_dirty=True)
+    # every rating change moves Book.version: _store clears the flag of a book only if its
+    # version is still this one, so a book rated again while we compute stays dirty
+    versions = dict(books.values_list('id', 'version'))
+    if not versions:
+        return []
+    dirty_ids = list(versions)
+
+    matrix = RatingMatrix.load(chunk_size=load_chunk)
+    log(f"{matrix.centered.nnz} ratings, {len(matrix.book_ids)} rated books, {len(dirty_ids)} changed")
+
+    dirty = set(dirty_ids)
+    rewritten = set()
+    # books without ratings have no neighbours
+    unrated = [book_id for book_id in dirty_ids if book_id not in matrix.position]
+    for start in range(0, len(unrated), block_size):
+        _store(matrix, {book_id: ([], []) for book_id in unrated[start:start + block_size]}, versions)
+    rewritten.update(unrated)
+
+    columns = [matrix.position[book_id] for book_id in dirty_ids if book_id in matrix.position]
+    # highest new similarity of any other book towards a changed one
+    best_towards_dirty = np.zeros(len(matrix.book_ids))
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        sims = matrix.similarities(block, shrink, min_common)
+        if sims.nnz:
+            best_towards_dirty = np.maximum(best_towards_dirty, sims.max(axis=0).toarray().ravel())
+        _store(matrix, {
+            int(matrix.book_ids[column]): top_n(sims.getrow(i), top)
+            for i, column in enumerate(block)
+        }, versions)
+        rewritten.update(int(matrix.book_ids[column]) for column in block)
+
+    # unchanged books whose top-N can move: they list a changed book, or a
+    # changed book now beats their weakest neighbour
+    affected = set(
+        SimilarBook.objects.filter(similar_id__in=dirty).exclude(book_id__in=dirty).values_list('book_id', flat=True)
+    )
+    weakest = {}
+    for book_id, score, count in _weakest_neighbours():
+        weakest[book_id] = score if count >= top else 0.0
+    for column in np.nonzero(best_towards_dirty)[0]:
+        book_id = int(matrix.book_ids[column])
+        if book_id not in dirty and best_towards_dirty[column] > weakest.get(book_id, 0.0):
+            affected.add(book_id)
+
+    affected_columns = [matrix.position[book_id] for book_id in affected if book_id in matrix.position]
+    log(f"{len(affected_columns)} more books affected by the changes")
+    for start in range(0, len(affected_columns), block_size):
+        block = affected_columns[start:start + block_size]
+        sims = matrix.similarities(block, shrink, min_common)
+        _store(matrix, {
+            int(matrix.book_ids[column]): top_n(sims.getrow(i), top)
+            for i, column in enumerate(block)
+        }, versions)
+        rewritten.update(int(matrix.book_ids[column]) for column in block)
+    return sorted(rewritten)
+
+
+def _weakest_neighbours():
+    return SimilarBook.objects.values('book_id').annotate(
+        weakest=Min('score'), count=Count('id')
+    ).values_list('book_id', 'weakest', 'count')
+
+
+def _store(matrix, results, versions):
+    """
+    Replace the stored lists of the given books: {book_id: (columns, scores)},
+    and clear similarity_dirty of those still at the ``versions`` they were
+    computed from.
+    """
+    if not results:
+        return
+    rows = [
+        SimilarBook(book_id=book_id, similar_id=int(matrix.book_ids[column]), score=float(score), rank=rank)
+        for book_id, (columns, scores) in results.items()
+        for rank, (column, score) in enumerate(zip(columns, scores), start=1)
+    ]
+    with transaction.atomic():
+        SimilarBook.objects.filter(book_id__in=list(results)).delete()
+        SimilarBook.objects.bulk_create(rows, batch_size=2000)
+        # read after the writes above: on SQLite the transaction holds the write lock by now
+        current = Book.objects.filter(pk__in=[book_id for book_id in results if book_id in versions])
+        unchanged = [book_id for book_id, version in current.values_list('id', 'version') if version == versions[book_id]]
+        Book.objects.filter(pk__in=unchanged).update(similarity_dirty=False)
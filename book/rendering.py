@@ -0,0 +1,113 @@
+from html import escape
+from html.parser import HTMLParser
+
+from django.utils.text import Truncator
+
+from .search import html_to_text
+
+# Pre-rendered forms of Book.description (CKEditor HTML), computed once when
+# the description changes (pre_save signal in signals.py, bulk imports,
+# `manage.py backfill_descriptions`; migration 0019 keeps its own frozen copy)
+# instead of on every page view:
+#   Book.excerpt           plain text for the list cards
+#   Book.description_html  allow-listed HTML for the detail page
+
+EXCERPT_WORDS = 40
+
+ALLOWED_TAGS = {
+    'p', 'br', 'hr', 'div', 'span', 'blockquote', 'pre', 'code',
+    'strong', 'b', 'em', 'i', 'u', 's', 'sub', 'sup',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'ul', 'ol', 'li', 'a', 'img',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+# dropped together with everything inside them
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+SAFE_URL_SCHEMES = {'http', 'https', 'mailto'}
+
+
+def _safe_url(value):
+    # relative URLs have no scheme: a ':' before any '/', '?' or '#'
+    value = ''.join(value.split()).lower()
+    scheme, colon, _ = value.partition(':')
+    if not colon or any(char in scheme for char in '/?#'):
+        return True
+    return scheme in SAFE_URL_SCHEMES
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = ''
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in ('href', 'src') and not _safe_url(value):
+                continue  # javascript:, data: ...
+            rendered += f' {name}="{escape(value)}"'
+        self.parts.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # close anything left open inside this tag
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        return ''.join(self.parts) + ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+
+
+def sanitize_html(value):
+    """Allow-listed copy of rich text HTML: no scripts, event handlers or unsafe URLs."""
+    sanitizer = _Sanitizer()
+    sanitizer.feed(value or '')
+    return sanitizer.result()
+
+
+def make_excerpt(value, words=EXCERPT_WORDS):
+    """Plain-text teaser, the same text `|striptags|truncatewords:40` used to produce."""
+    return Truncator(html_to_text(value)).words(words)
+
+
+def render_description(book):
+    """Fill in the stored excerpt / sanitized HTML from book.description."""
+    book.excerpt = make_excerpt(book.description)
+    book.description_html = sanitize_html(book.description)
+    return book
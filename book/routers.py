@@ -0,0 +1,62 @@
+import contextvars
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connections
+
+# Read replica routing.
+#
+# Only the catalog pages read from the replica, and only while serving a GET
+# (the `replica_reads` decorator flags the request). Everything else, and every
+# write, goes to the primary, so a POST never reads its own data from a replica
+# that may lag behind.
+
+REPLICA_ALIAS = 'replica'
+PRIMARY_ALIAS = 'default'
+
+_use_replica = contextvars.ContextVar('book_use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in connections.databases
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # sessions and users stay on the primary: a fresh login must be visible at once
+        if _use_replica.get() and model._meta.app_label == 'book' and replica_configured():
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # same data on both aliases
+        return {obj1._state.db, obj2._state.db} <= {PRIMARY_ALIAS, REPLICA_ALIAS}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a copy of the primary, never migrated directly
+        return db == PRIMARY_ALIAS
+
+
+def replica_reads(view):
+    """Route the ORM reads of a GET/HEAD request through this view to the replica."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _use_replica.set(request.method in ('GET', 'HEAD'))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _use_replica.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _use_replica.set(request.method in ('GET', 'HEAD'))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
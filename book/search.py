@@ -0,0 +1,217 @@
+import html
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+# Full-text index for the catalog search.
+# The FTS5 table is a "shadow" of book_book: rowid == Book.id, and the columns
+# hold plain text (the CKEditor HTML is stripped before indexing).
+SEARCH_TABLE = 'book_search'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "title, author, description, category, "
+    "tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+# bm25() column weights, in the same order as the table columns above.
+# A hit in the title matters far more than one deep inside the description.
+RANK_WEIGHTS = (10.0, 5.0, 1.0, 3.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _read_connection():
+    # ranked lookups follow Book reads, so they hit the replica inside replica_reads
+    from .models import Book
+    return connections[router.db_for_read(Book)]
+
+
+def _write_connection():
+    from .models import Book
+    return connections[router.db_for_write(Book)]
+
+
+def is_enabled():
+    # FTS5 only exists on SQLite; any other backend falls back to icontains
+    return getattr(settings, 'BOOK_SEARCH_FTS', False) and _read_connection().vendor == 'sqlite'
+
+
+def html_to_text(value):
+    """Turn RichTextField HTML into plain, whitespace-collapsed text."""
+    text = html.unescape(strip_tags(value or ''))
+    return ' '.join(text.split())
+
+
+def build_match_query(query):
+    """
+    Convert raw user input into a safe FTS5 MATCH expression.
+
+    Every word is quoted (so FTS operators typed by users are treated as text)
+    and gets a trailing '*' for prefix matching: "tolk" finds "Tolkien".
+    Returns None when there is nothing searchable in the input.
+    """
+    tokens = TOKEN_RE.findall(query or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _row_for(book):
+    return (
+        book.id,
+        book.title,
+        book.author,
+        html_to_text(book.description),
+        book.category.name if book.category_id else '',
+    )
+
+
+def ensure_table():
+    with _write_connection().cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+
+
+def index_book(book):
+    """Insert or replace the index row of a single book."""
+    with _write_connection().cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [book.id])
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, author, description, category) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            _row_for(book),
+        )
+
+
+def index_books(books):
+    """Index freshly inserted books (bulk_create sends no post_save)."""
+    rows = [_row_for(book) for book in books]
+    with _write_connection().cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(row[0],) for row in rows]
+        )
+        _insert_rows(cursor, rows)
+
+
+def remove_book(book_id):
+    with _write_connection().cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [book_id])
+
+
+def rebuild(books, batch_size=1000):
+    """
+    Drop every index row and re-index the given queryset in batches.
+    Returns the number of indexed books.
+    """
+    ensure_table()
+    total = 0
+    with _write_connection().cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        batch = []
+        for book in books.select_related('category').iterator(chunk_size=batch_size):
+            batch.append(_row_for(book))
+            if len(batch) >= batch_size:
+                total += _insert_rows(cursor, batch)
+                batch = []
+        if batch:
+            total += _insert_rows(cursor, batch)
+        # merge the b-tree segments written by the bulk load
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def _insert_rows(cursor, rows):
+    cursor.executemany(
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, author, description, category) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        rows,
+    )
+    return len(rows)
+
+
+def _match_sql(select, match, category):
+    sql = f"SELECT {select} FROM {SEARCH_TABLE} s"
+    params = []
+    if category:
+        sql += (
+            " JOIN book_book b ON b.id = s.rowid"
+            " JOIN book_category c ON c.id = b.category_id"
+        )
+    sql += f" WHERE {SEARCH_TABLE} MATCH %s"
+    params.append(match)
+    if category:
+        sql += " AND c.name = %s"
+        params.append(category)
+    return sql, params
+
+
+def search_book_ids(query, category=None, limit=None, offset=0):
+    """
+    Return the ids of books matching ``query``, best match first.
+
+    ``category`` narrows the result to a single category name (same as the
+    ``category`` filter of book_list). ``limit`` / ``offset`` select a slice
+    of the ranking inside SQLite.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+    sql, params = _match_sql('s.rowid', match, category)
+    sql += f" ORDER BY bm25({SEARCH_TABLE}, {weights}), s.rowid DESC LIMIT %s OFFSET %s"
+    params += [-1 if limit is None else limit, offset]  # LIMIT -1: no limit
+
+    with _read_connection().cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def count_matches(query, category=None):
+    match = build_match_query(query)
+    if match is None:
+        return 0
+    sql, params = _match_sql('COUNT(*)', match, category)
+    with _read_connection().cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()[0]
+
+
+class SearchResults:
+    """
+    The ranked ids of one search, for Paginator: count() is a COUNT(*) over
+    the MATCH and a page is one LIMIT/OFFSET query, so no page of the result
+    set is out of reach and only one page of ids is ever fetched.
+    """
+
+    def __init__(self, query, category=None):
+        self.query = query
+        self.category = category
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = count_matches(self.query, self.category)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError("SearchResults only supports slicing")
+        start = key.start or 0
+        if key.stop is None:
+            return search_book_ids(self.query, self.category, offset=start)
+        return search_book_ids(self.query, self.category, limit=max(key.stop - start, 0), offset=start)
+
+
+def matching_ids(query):
+    """``id__in`` subquery of the books matching ``query`` (no ranking, no id list in Python)."""
+    match = build_match_query(query)
+    if match is None:
+        return []
+    return RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
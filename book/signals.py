@@ -0,0 +1,309 @@
+import logging
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Book, Category, Comment, Rating
+from . import autocomplete
+from . import cache
+from . import covers
+from . import rendering
+from . import search
+from . import tasks
+
+logger = logging.getLogger(__name__)
+
+
+# --- Pre-rendered description (excerpt + sanitized HTML) ---
+
+@receiver(pre_save, sender=Book)
+def render_description_on_save(sender, instance, raw=False, **kwargs):
+    if raw or 'description' not in instance.__dict__:
+        return  # description deferred: it can't have changed
+    changed = instance.description != getattr(instance, '_original_description', None)
+    if changed or not instance.description_html:
+        rendering.render_description(instance)
+        instance._original_description = instance.description
+
+
+# --- Full-text search index sync ---
+
+@receiver(post_save, sender=Book)
+def index_book_on_save(sender, instance, raw=False, **kwargs):
+    if raw or not search.is_enabled():
+        return
+    search.index_book(instance)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book_on_delete(sender, instance, **kwargs):
+    if not search.is_enabled():
+        return
+    search.remove_book(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_on_rename(sender, instance, created, raw=False, **kwargs):
+    if created or raw or not search.is_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {search.SEARCH_TABLE} SET category = %s "
+            "WHERE rowid IN (SELECT id FROM book_book WHERE category_id = %s)",
+            [instance.name, instance.id],
+        )
+
+
+@receiver(pre_delete, sender=Category)
+def unindex_category_on_delete(sender, instance, **kwargs):
+    # Book.category is SET_NULL, which is a bulk UPDATE (no Book post_save)
+    if not search.is_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {search.SEARCH_TABLE} SET category = '' "
+            "WHERE rowid IN (SELECT id FROM book_book WHERE category_id = %s)",
+            [instance.id],
+        )
+
+
+# --- Denormalized rating aggregates on Book ---
+
+@receiver(post_save, sender=Rating)
+def update_book_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        Book.apply_rating_delta(instance.book_id, 1, instance.score)
+    else:
+        old_score = getattr(instance, '_original_score', None)
+        if old_score is None:
+            # instance was not loaded from the db, so the replaced score is unknown:
+            # recount this one book instead
+            reconcile_book_rating(instance.book_id)
+        elif old_score != instance.score:
+            Book.apply_rating_delta(instance.book_id, 0, instance.score - old_score)
+    instance._original_score = instance.score
+
+
+@receiver(post_delete, sender=Rating)
+def update_book_rating_on_delete(sender, instance, **kwargs):
+    score = getattr(instance, '_original_score', None)
+    if score is None:
+        score = instance.score
+    Book.apply_rating_delta(instance.book_id, -1, -score)
+
+
+def reconcile_book_rating(book_id):
+    totals = Rating.objects.filter(book_id=book_id).aggregate(count=Count('id'), total=Sum('score'))
+    count, total = totals['count'], totals['total'] or 0
+    Book.objects.filter(pk=book_id).update(
+        rating_count=count,
+        rating_sum=total,
+        rating_avg=(total / count) if count else None,
+        **Book.touch_fields(),
+    )
+
+
+# --- Per-category book counters ---
+
+@receiver(post_save, sender=Book)
+def update_category_count_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        old_category_id = None
+    elif hasattr(instance, '_original_category_id'):
+        old_category_id = instance._original_category_id
+    else:
+        # not loaded from the db: the previous category is unknown
+        reconcile_category_counts()
+        return
+    if old_category_id != instance.category_id:
+        if old_category_id is not None:
+            # never below zero (PositiveIntegerField), e.g. a count not reconciled after a bulk load
+            Category.objects.filter(pk=old_category_id, book_count__gt=0).update(book_count=F('book_count') - 1)
+        if instance.category_id is not None:
+            Category.objects.filter(pk=instance.category_id).update(book_count=F('book_count') + 1)
+        _bump('categories')
+    instance._original_category_id = instance.category_id
+
+
+@receiver(post_delete, sender=Book)
+def update_category_count_on_delete(sender, instance, **kwargs):
+    category_id = getattr(instance, '_original_category_id', instance.category_id)
+    if category_id is not None:
+        Category.objects.filter(pk=category_id, book_count__gt=0).update(book_count=F('book_count') - 1)
+        _bump('categories')
+
+
+def reconcile_category_counts():
+    """Recount every category in one grouped query (after bulk imports)."""
+    counts = dict(
+        Book.objects.filter(category__isnull=False).order_by()
+        .values_list('category_id').annotate(n=Count('id'))
+    )
+    categories = list(Category.objects.only('id', 'book_count'))
+    drifted = [c for c in categories if c.book_count != counts.get(c.id, 0)]
+    for category in drifted:
+        category.book_count = counts.get(category.id, 0)
+    Category.objects.bulk_update(drifted, ['book_count'], batch_size=500)
+    if drifted:
+        _bump('categories')
+    return len(drifted)
+
+
+# --- Cover image derivatives ---
+
+@receiver(post_save, sender=Book)
+def generate_cover_variants_on_upload(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    name = instance.cover_image.name if instance.cover_image else None
+    if name == getattr(instance, '_original_cover', None) and (instance.has_cover_variants or not name):
+        return
+
+    if instance.has_cover_variants:
+        # the variants on disk are the old cover's until the task has run
+        Book.objects.filter(pk=instance.pk).update(has_cover_variants=False)
+        instance.has_cover_variants = False
+    if name:
+        # ⚡ resizing is deferred to the task queue (inline when BOOK_TASKS['EAGER']); a cover
+        # replaced while the task is still queued shares it, the task reads the current one
+        generate_book_cover_variants.enqueue(instance.pk, dedupe_key=f'covers:{instance.pk}')
+    old_name = getattr(instance, '_original_cover', None)
+    if old_name and old_name != name:
+        _delete_unused_variants(old_name)
+    instance._original_cover = name
+
+
+@receiver(post_delete, sender=Book)
+def delete_cover_variants_on_delete(sender, instance, **kwargs):
+    if instance.cover_image:
+        _delete_unused_variants(instance.cover_image.name)
+
+
+def _delete_unused_variants(name):
+    # after the commit (a rollback keeps the cover), and only once no book shows the image:
+    # identical uploads share one hashed file (covers.HashedImageFieldFile)
+    def delete():
+        if not Book.objects.filter(cover_image=name).exists():
+            covers.delete_variants(name)
+    transaction.on_commit(delete)
+
+
+@tasks.task
+def generate_book_cover_variants(book_id):
+    name = Book.objects.filter(pk=book_id).values_list('cover_image', flat=True).first()
+    if not name:
+        return  # deleted, or the cover removed
+    try:
+        covers.generate_variants(name)
+    except (OSError, ValueError):
+        # unreadable upload, no point retrying: templates keep serving the original file
+        logger.exception("Could not generate cover variants for %s", name)
+        return
+    # unless the cover was replaced in the meantime
+    if Book.objects.filter(pk=book_id, cover_image=name).update(has_cover_variants=True, **Book.touch_fields()):
+        cache.bump('catalog', f'book:{book_id}')
+
+
+# --- Autocomplete prefix index (this worker's copy, see autocomplete.py) ---
+
+@receiver(post_save, sender=Book)
+def update_autocomplete_on_book_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.book_saved(instance)
+
+
+@receiver(post_delete, sender=Book)
+def update_autocomplete_on_book_delete(sender, instance, **kwargs):
+    autocomplete.book_deleted(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def update_autocomplete_on_category_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.category_saved(instance)
+
+
+@receiver(post_delete, sender=Category)
+def update_autocomplete_on_category_delete(sender, instance, **kwargs):
+    autocomplete.category_deleted(instance.id)
+
+
+@receiver(post_save, sender=Rating)
+def update_autocomplete_on_rating_save(sender, instance, created, raw=False, **kwargs):
+    # popularity is the rating count: only a new rating changes it
+    if created and not raw:
+        autocomplete.ratings_changed(instance.book_id, 1)
+
+
+@receiver(post_delete, sender=Rating)
+def update_autocomplete_on_rating_delete(sender, instance, **kwargs):
+    autocomplete.ratings_changed(instance.book_id, -1)
+
+
+# --- Per-book version (conditional GET on book_details) ---
+# Ratings bump it inside Book.apply_rating_delta / reconcile_book_rating.
+
+@receiver(post_save, sender=Book)
+def touch_book_on_edit(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        Book.touch(pk=instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_book_on_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Book.touch(pk=instance.book_id)
+
+
+@receiver(post_save, sender=Category)
+def touch_books_on_category_rename(sender, instance, created, raw=False, **kwargs):
+    # the detail pages show the category name
+    if not created and not raw:
+        Book.touch(category_id=instance.id)
+
+
+@receiver(pre_delete, sender=Category)
+def touch_books_on_category_delete(sender, instance, **kwargs):
+    Book.touch(category_id=instance.id)
+
+
+# --- Page / fragment cache invalidation ---
+# Connected last so they run after the handlers above have updated the book row.
+
+def _bump(*scopes):
+    # Bump now and again once the transaction commits: a page rendered from the
+    # old data in between would otherwise stay cached under the new version.
+    cache.bump(*scopes)
+    transaction.on_commit(lambda: cache.bump(*scopes))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_cache(sender, instance, **kwargs):
+    _bump('catalog', f'book:{instance.id}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    _bump('catalog', 'categories')
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_rating_cache(sender, instance, **kwargs):
+    # the average is shown on the list cards and sorts the catalog
+    _bump('catalog', f'book:{instance.book_id}')
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_cache(sender, instance, **kwargs):
+    _bump(f'book:{instance.book_id}')
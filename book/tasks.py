@@ -0,0 +1,211 @@
+import logging
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+from functools import partial
+from importlib import import_module
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Avg, Count, F, Max, Q
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Durable background tasks in a database table, for follow-up work that should
+# not hold up a request (cover variants, rating flushes). No broker: the
+# `book_task` table is the queue and `manage.py run_worker` drains it.
+#
+#   @tasks.task(max_attempts=5)
+#   def generate_book_covers(book_id): ...
+#
+#   generate_book_covers.enqueue(book.id, dedupe_key=f'covers:{book.id}')
+#
+# Arguments are stored as JSON, so pass ids rather than model instances. A
+# task enqueued inside a transaction only becomes visible when it commits.
+#
+# A worker claims due rows by stamping them with a random token in a single
+# UPDATE (no row locks, so several workers can share a SQLite file), runs them
+# on its thread or process pool and records the outcome and duration on the
+# row. A failure is retried after BACKOFF_SECONDS * 2**(attempt - 1) until
+# max_attempts (unless a task with the same dedupe_key was queued meanwhile: the
+# failed row is then left FAILED, superseded); a claim older than CLAIM_TIMEOUT
+# (the worker died) is taken over by the next poll.
+#
+# With EAGER set (the dev profile default) enqueue() runs the task right away
+# in the caller, so nothing waits for a worker that isn't running.
+
+DEFAULTS = {
+    'EAGER': False,
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_SECONDS': 10,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'CLAIM_TIMEOUT': 600,      # seconds a claimed task may run before another worker retries it
+    'POLL_INTERVAL': 1.0,      # seconds between polls of an idle worker
+    'KEEP_DONE': 60 * 60 * 24,  # seconds finished rows are kept for stats()
+}
+
+_registry = {}
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_TASKS', {})}
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Register ``func`` as a task; adds ``func.enqueue(*args, dedupe_key=None, countdown=0, **kwargs)``."""
+    def decorator(func):
+        func.task_name = name or f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts
+        func.enqueue = partial(enqueue, func)
+        _registry[func.task_name] = func
+        return func
+    return decorator(func) if func is not None else decorator
+
+
+def get_task(name):
+    if name not in _registry:
+        # registered when its module is imported: import it
+        module_name = name.rpartition('.')[0]
+        try:
+            import_module(module_name)
+        except ImportError:
+            pass
+    return _registry[name]
+
+
+def enqueue(func, *args, dedupe_key=None, countdown=0, **kwargs):
+    """
+    Queue ``func(*args, **kwargs)``. Dropped when a task with the same
+    ``dedupe_key`` is already queued. Returns the Task (None when deduplicated
+    or run eagerly).
+    """
+    options = get_options()
+    if options['EAGER']:
+        func(*args, **kwargs)
+        return None
+    row = Task(
+        name=func.task_name,
+        args=list(args),
+        kwargs=kwargs,
+        dedupe_key=dedupe_key,
+        max_attempts=func.max_attempts or options['MAX_ATTEMPTS'],
+        run_after=timezone.now() + timedelta(seconds=countdown),
+    )
+    if dedupe_key is None:
+        row.save()
+        return row
+    # ⚡ one INSERT OR IGNORE against the partial unique index on queued keys
+    Task.objects.bulk_create([row], ignore_conflicts=True)
+    return Task.objects.filter(dedupe_key=dedupe_key, status=Task.QUEUED).first()
+
+
+def claim(limit, worker='worker'):
+    """Mark up to ``limit`` due tasks as running for this caller; returns their ids."""
+    options = get_options()
+    now = timezone.now()
+    token = f'{worker}:{uuid.uuid4().hex[:12]}'
+    due = (
+        Q(status=Task.QUEUED, run_after__lte=now)
+        | Q(status=Task.RUNNING, claimed_until__lt=now)  # abandoned by a dead worker
+    )
+    # ⚡ one UPDATE ... WHERE id IN (SELECT ... LIMIT n): no read-then-write transaction, which
+    # SQLite can't upgrade under contention; rows another worker got first no longer match `due`
+    candidates = Task.objects.filter(due).order_by('run_after', 'id').values('id')[:limit]
+    claimed = Task.objects.filter(due, id__in=candidates).update(
+        status=Task.RUNNING,
+        claimed_by=token,
+        claimed_until=now + timedelta(seconds=options['CLAIM_TIMEOUT']),
+        started_at=now,
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return []
+    return list(Task.objects.filter(claimed_by=token, status=Task.RUNNING).values_list('id', flat=True))
+
+
+def execute(task_id):
+    """Run one claimed task and record its outcome. Returns (name, ok, duration in ms)."""
+    close_old_connections()
+    row = Task.objects.get(pk=task_id)
+    started = time.perf_counter()
+    try:
+        get_task(row.name)(*row.args, **row.kwargs)
+    except Exception:
+        duration = (time.perf_counter() - started) * 1000
+        _failed(row, traceback.format_exc(), duration)
+        logger.warning("Task %s #%s failed (attempt %d/%d)", row.name, row.id, row.attempts, row.max_attempts)
+        return row.name, False, duration
+    duration = (time.perf_counter() - started) * 1000
+    Task.objects.filter(pk=row.pk, claimed_by=row.claimed_by).update(
+        status=Task.DONE, finished_at=timezone.now(), duration_ms=duration, last_error='',
+    )
+    logger.info("Task %s #%s done in %.1f ms", row.name, row.id, duration)
+    return row.name, True, duration
+
+
+def _failed(row, error, duration):
+    options = get_options()
+    update = {'finished_at': timezone.now(), 'duration_ms': duration, 'last_error': error[-4000:]}
+    if row.attempts < row.max_attempts:
+        backoff = min(options['BACKOFF_SECONDS'] * 2 ** (row.attempts - 1), options['MAX_BACKOFF_SECONDS'])
+        # jitter: tasks that failed together don't all come back together
+        backoff *= random.uniform(0.8, 1.2)
+        retry = {'status': Task.QUEUED, 'run_after': timezone.now() + timedelta(seconds=backoff), 'claimed_by': ''}
+        try:
+            with transaction.atomic():
+                Task.objects.filter(pk=row.pk, claimed_by=row.claimed_by).update(**update, **retry)
+            return
+        except IntegrityError:
+            # the same dedupe_key was queued again while this one ran: that twin does the work
+            update['last_error'] = (error[-3900:] + "\nNot retried: superseded by a queued task with the same dedupe_key.")
+    update['status'] = Task.FAILED
+    Task.objects.filter(pk=row.pk, claimed_by=row.claimed_by).update(**update)
+
+
+def run_pending(limit=None, worker='inline'):
+    """Run the due tasks one by one in this process (tests, cron). Returns how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        ids = claim(1, worker)
+        if not ids:
+            break
+        execute(ids[0])
+        ran += 1
+    return ran
+
+
+def purge(keep_seconds=None):
+    """Delete finished rows older than KEEP_DONE (failed ones stay for inspection)."""
+    keep_seconds = get_options()['KEEP_DONE'] if keep_seconds is None else keep_seconds
+    cutoff = timezone.now() - timedelta(seconds=keep_seconds)
+    return Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def stats():
+    """Per task name: queued / running / done / failed counts and run times (ms) of the kept rows."""
+    rows = (
+        Task.objects.values('name')
+        .annotate(
+            queued=Count('id', filter=Q(status=Task.QUEUED)),
+            running=Count('id', filter=Q(status=Task.RUNNING)),
+            done=Count('id', filter=Q(status=Task.DONE)),
+            failed=Count('id', filter=Q(status=Task.FAILED)),
+            retried=Count('id', filter=Q(attempts__gt=1)),
+            avg_ms=Avg('duration_ms', filter=Q(status=Task.DONE)),
+            max_ms=Max('duration_ms', filter=Q(status=Task.DONE)),
+        )
+        .order_by('name')
+    )
+    result = {}
+    for row in rows:
+        durations = sorted(
+            Task.objects.filter(name=row['name'], status=Task.DONE).values_list('duration_ms', flat=True)
+        )
+        row['p95_ms'] = durations[min(len(durations) - 1, int(len(durations) * 0.95))] if durations else None
+        result[row.pop('name')] = row
+    return result
@@ -0,0 +1,30 @@
+from django import template
+
+from book import covers
+
+register = template.Library()
+
+
+@register.inclusion_tag('book/cover_picture.html')
+def cover_picture(book, placement='card', css_class='', style=''):
+    """
+    <picture> for a book cover: WebP srcset with a JPEG fallback once the
+    variants exist, otherwise the original upload.
+    """
+    context = {
+        'book': book,
+        'css_class': css_class,
+        'style': style,
+        # the detail cover is above the fold, list cards are not
+        'lazy': placement == 'card',
+        'has_variants': bool(book.cover_image) and book.has_cover_variants,
+    }
+    if context['has_variants']:
+        name = book.cover_image.name
+        context.update({
+            'webp_srcset': covers.srcset(name, 'webp'),
+            'jpg_srcset': covers.srcset(name, 'jpg'),
+            'fallback_url': covers.variant_url(name, placement, 'jpg'),
+            'sizes': covers.SIZES.get(placement, '100vw'),
+        })
+    return context
@@ -1,3 +1,1676 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import warnings
+from datetime import timedelta
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.db import connection, router
+from django.contrib.auth.models import User
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed, ValidationError
+from django.core.paginator import UnorderedObjectListWarning
+from django.http import HttpResponse
+from django.template import engines
+from django.template.backends.django import Template as DjangoBackendTemplate
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import api, async_views, autocomplete, cache, covers, export, leaderboards, middleware, routers, search, tasks, views
+from . import signals, urls as book_urls
+from .management.commands import import_books
+from .models import Book, Category, Comment, ImportCheckpoint, LeaderboardEntry, PendingRating, Rating, SimilarBook, Task
+from .pagination import CURSOR_SALT, CursorPaginator, encode_cursor
+
+# "SCAN book_book" with no index after it: SQLite reads the whole table
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)\S+$')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite specific")
+class HotQueryPlanTests(TestCase):
+    """
+    Every query on a hot path must be answered through an index. Runs
+    EXPLAIN QUERY PLAN on the SQL the views actually build and fails on a
+    full table scan (or on a missing expected index).
+    """
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset, uses=None):
+        plan = self.plan(queryset)
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        self.assertEqual(scans, [], f"full table scan in:\n  " + "\n  ".join(plan))
+        if uses:
+            self.assertTrue(
+                any(uses in step for step in plan),
+                f"{uses} not used in:\n  " + "\n  ".join(plan),
+            )
+
+    def test_profile_books_by_author(self):
+        self.assertIndexed(Book.objects.filter(author='reader'), uses='book_author_idx')
+
+    def test_book_list_latest(self):
+        paginator = CursorPaginator(Book.objects.all(), 6, ordering='latest')
+        self.assertIndexed(paginator._query(None)[0], uses='book_latest_idx')
+
+    def test_book_list_category(self):
+        # book_list resolves the name through the cached category list first
+        self.assertIndexed(Category.objects.filter(name='Fantasy'), uses='book_category_name')
+        books = Book.objects.filter(category_id__in=[1])
+        paginator = CursorPaginator(books, 6, ordering='latest')
+        self.assertIndexed(paginator._query(None)[0], uses='book_category_latest_idx')
+
+    def test_book_list_top_rated(self):
+        books = Book.objects.order_by('-rating_avg', '-rating_count', '-id')[:6]
+        self.assertIndexed(books, uses='book_rating_rank_idx')
+
+    def test_comments_newest_first(self):
+        comments = views._comment_paginator(1)._query(None)[0]
+        self.assertIndexed(comments, uses='comment_book_latest_idx')
+
+    def test_comment_rating_score_subquery(self):
+        plan = self.plan(Comment.objects.filter(book_id=1).with_rating_score())
+        self.assertFalse([step for step in plan if FULL_SCAN.match(step)], plan)
+        self.assertIn('CORRELATED SCALAR SUBQUERY 1', plan)
+
+    def test_user_rating_lookup(self):
+        scores = Rating.objects.filter(user_id=1, book_id=1).values_list('score', flat=True)
+        self.assertIndexed(scores)
+        self.assertIndexed(PendingRating.objects.filter(user_id=1, book_id=1).values_list('score', flat=True))
+
+    def test_book_ratings(self):
+        self.assertIndexed(Rating.objects.filter(book_id=1).values_list('score', flat=True), uses='COVERING INDEX')
+
+    def test_similar_books(self):
+        similar = SimilarBook.objects.filter(book_id=1).select_related('similar').order_by('rank')[:6]
+        self.assertIndexed(similar)
+
+    def test_conditional_get_validators(self):
+        self.assertIndexed(Book.objects.filter(pk=1).values_list('version', 'updated_at'), uses='PRIMARY KEY')
+
+    def test_leaderboard(self):
+        self.assertIndexed(leaderboards.entries(LeaderboardEntry.TOP_RATED)[:6])
+        self.assertIndexed(leaderboards.entries(LeaderboardEntry.TRENDING, 'Fantasy')[:6])
+
+
+# reads stay on 'default' even under the production profile's replica router
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class AnonymousFastPathTests(TestCase):
+    """A cold anonymous view of a catalog page reads no session and sets no cookies."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Fantasy')
+        cls.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>', category=category)
+
+    def assertCatalogOnly(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['sql'] for q in queries if 'django_session' in q['sql']], [])
+        self.assertEqual(list(response.cookies), [])  # no session, no CSRF token
+        self.assertIn('Cookie', response['Vary'])
+        return queries
+
+    def test_book_list(self):
+        queries = self.assertCatalogOnly(reverse('book_list'))
+        self.assertEqual([q['sql'] for q in queries if 'auth_user' in q['sql']], [])
+
+    def test_book_details(self):
+        self.assertCatalogOnly(reverse('book_details', args=[self.book.id]))
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class ConditionalGetTests(TestCase):
+    """Anonymous revalidation is answered from the version stamps alone."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>')
+        cls.user = User.objects.create_user('reader', password='secret')
+
+    def setUp(self):
+        # versions restart with every test's rollback; cached pages must not outlive it
+        cache.get_cache().clear()
+
+    def revalidate(self, path, response):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_book_details(self):
+        path = reverse('book_details', args=[self.book.id])
+        first = self.client.get(path)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        with self.assertNumQueries(1):  # the version read, nothing else
+            self.assertEqual(self.revalidate(path, first).status_code, 304)
+
+        Comment.objects.create(book=self.book, user=self.user, content='Great')
+        self.assertEqual(self.revalidate(path, first).status_code, 200)
+
+    def test_book_details_rating_changes_version(self):
+        path = reverse('book_details', args=[self.book.id])
+        first = self.client.get(path)
+        Rating.objects.create(book=self.book, user=self.user, score=4)
+        self.assertEqual(self.revalidate(path, first).status_code, 200)
+
+    def test_book_list(self):
+        path = reverse('book_list') + '?sort=rating'
+        first = self.client.get(path)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(path, first).status_code, 304)
+        self.assertEqual(self.client.get(reverse('book_list'), HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        Book.objects.create(title='Dune', author='herbert', description='<p>y</p>')
+        self.assertEqual(self.revalidate(path, first).status_code, 200)
+
+    def test_logged_in_users_are_not_validated(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book_details', args=[self.book.id]))
+        self.assertNotIn('ETag', response)
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class CommentPageTests(TestCase):
+    """The detail page costs the same queries however many comments there are; "Load more" pages by cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>')
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def add_comments(self, count, rated=True):
+        now = timezone.now()
+        start = Comment.objects.count()
+        for n in range(start, start + count):
+            user = User.objects.create(username=f'reader{n}')
+            if rated:
+                Rating.objects.create(user=user, book=self.book, score=n % 5 + 1)
+            comment = Comment.objects.create(book=self.book, user=user, content=f'comment {n}')
+            Comment.objects.filter(pk=comment.pk).update(created_at=now - timedelta(minutes=n))
+
+    def detail_queries(self):
+        cache.get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('book_details', args=[self.book.id])).status_code, 200)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_comments(self):
+        comments = 4  # N and 2N both fit on the first page
+        self.assertLessEqual(2 * comments, views.COMMENTS_PER_PAGE)
+        self.add_comments(comments)
+        expected = self.detail_queries()
+        self.add_comments(comments)
+        with self.assertNumQueries(expected):
+            response = self.client.get(reverse('book_details', args=[self.book.id]))
+        self.assertEqual(len(response.context['comments']), 2 * comments)
+
+    def test_load_more_returns_the_next_page(self):
+        self.add_comments(2 * views.COMMENTS_PER_PAGE + 5, rated=False)
+        newest_first = [f'comment {n}' for n in range(2 * views.COMMENTS_PER_PAGE + 5)]
+
+        response = self.client.get(reverse('book_details', args=[self.book.id]))
+        first = response.context['comments']
+        self.assertEqual([comment.content for comment in first], newest_first[:views.COMMENTS_PER_PAGE])
+        fragment_url = f"{reverse('book_comments', args=[self.book.id])}?cursor={quote(first.next_cursor)}"
+        self.assertContains(response, fragment_url)
+
+        listed = []
+        page = first
+        while page.has_next():
+            response = self.client.get(reverse('book_comments', args=[self.book.id]), {'cursor': page.next_cursor})
+            self.assertEqual(response.status_code, 200)
+            page = response.context['comments']
+            listed += [comment.content for comment in page]
+            self.assertEqual(page.has_next(), bool(page.next_cursor))
+        self.assertEqual(listed, newest_first[views.COMMENTS_PER_PAGE:])
+        self.assertNotContains(response, 'load-more-comments')
+
+    def test_load_more_with_a_bad_cursor_starts_over(self):
+        self.add_comments(views.COMMENTS_PER_PAGE + 1, rated=False)
+        response = self.client.get(reverse('book_comments', args=[self.book.id]), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['comments']), views.COMMENTS_PER_PAGE)
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class StaticExportTests(TestCase):
+    """export_static writes anonymous pages and re-renders only what changed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Science Fiction')
+        cls.book = Book.objects.create(
+            title='Dune', author='herbert', description='<p>x</p>', category=cls.category,
+        )
+        cls.other = Book.objects.create(title='Emma', author='austen', description='<p>y</p>')
+        cls.user = User.objects.create_user('reader', password='secret')
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def export(self):
+        out = io.StringIO()
+        call_command('export_static', output=str(self.root), workers=1, stdout=out)
+        return out.getvalue()
+
+    def test_layout_and_dynamic_includes(self):
+        self.export()
+        details = (self.root / f'books/details/{self.book.id}/index.html').read_text()
+        self.assertIn('Dune', details)
+        self.assertIn(reverse('book_interactive', args=[self.book.id]), details)
+        self.assertIn(reverse('user_nav'), details)
+        self.assertNotIn('type="hidden" name="csrfmiddlewaretoken"', details)
+        self.assertTrue((self.root / 'index.html').is_file())
+        self.assertTrue((self.root / 'catalog/page=1.html').is_file())
+        self.assertIn('Dune', (self.root / 'catalog/category=Science%20Fiction.html').read_text())
+
+    def test_incremental(self):
+        self.export()
+        self.assertIn('Rendered 0 pages', self.export())
+
+        Comment.objects.create(book=self.other, user=self.user, content='Great')
+        # its detail page and the catalog pages showing it, not Dune's pages
+        self.assertIn('Rendered 3 pages (0 failed, 2 unchanged', self.export())
+
+        self.other.delete()
+        output = self.export()
+        self.assertIn('1 removed', output)
+        self.assertFalse((self.root / f'books/details/{self.other.id}').exists())
+
+    @override_settings(BOOK_PAGE_CACHE=True)
+    def test_export_does_not_fill_the_page_cache(self):
+        self.export()
+        response = self.client.get(reverse('book_details', args=[self.book.id]))
+        self.assertNotContains(response, 'data-include')
+
+    @override_settings(BOOK_PAGE_CACHE=True)
+    def test_export_is_not_served_from_the_page_cache(self):
+        self.assertNotContains(self.client.get(reverse('book_details', args=[self.book.id])), 'data-include')
+        self.export()
+        self.assertIn('data-include', (self.root / f'books/details/{self.book.id}/index.html').read_text())
+
+    @override_settings(DEBUG=False, ALLOWED_HOSTS=['library.example'])
+    def test_export_outside_the_test_environment(self):
+        request = export.export_request(export.Page('book_list', {}, {'category': 'Science Fiction'}, ''))
+        self.assertEqual(request.GET['category'], 'Science Fiction')
+        self.assertEqual(request.get_full_path(), '/?category=Science+Fiction')
+        self.export()
+        self.assertIn('Dune', (self.root / 'catalog/category=Science%20Fiction.html').read_text())
+
+    def test_interactive_fragment(self):
+        anonymous = self.client.get(reverse('book_interactive', args=[self.book.id]))
+        self.assertContains(anonymous, 'logged in')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book_interactive', args=[self.book.id]))
+        self.assertContains(response, 'data-rate-url')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class WriteThrottleTests(TestCase):
+    """Comment / rating POSTs are rate limited per user and per IP."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+        cls.user = User.objects.create_user('reader', password='secret')
+        cls.other = User.objects.create_user('other', password='secret')
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.client.force_login(self.user)
+
+    def comment(self, content, **extra):
+        return self.client.post(reverse('book_details', args=[self.book.id]), {'content': content}, **extra)
+
+    @override_settings(BOOK_THROTTLE={'RATES': {'comment': {'user': (2, 60), 'ip': (3, 60)}}})
+    def test_comment_buckets(self):
+        self.assertEqual(self.comment('one').status_code, 302)
+        self.assertEqual(self.comment('two').status_code, 302)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.comment('three')
+        # only the session / user lookups: the limiter itself is cache-only
+        self.assertFalse([query for query in queries if 'book_' in query['sql']])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(Comment.objects.count(), 2)
+
+        # another user from the same address: only the IP bucket has a token left
+        self.client.force_login(self.other)
+        self.assertEqual(self.comment('four').status_code, 302)
+        self.assertEqual(self.comment('five').status_code, 429)
+        self.assertEqual(self.comment('six', REMOTE_ADDR='10.0.0.2').status_code, 302)
+
+    def test_duplicate_comment_is_dropped(self):
+        self.comment('Great book!')
+        self.assertEqual(self.comment('  great   BOOK! ').status_code, 302)
+        self.assertEqual(Comment.objects.filter(book=self.book).count(), 1)
+
+    @override_settings(BOOK_THROTTLE={'RATES': {'rating': {'user': (1, 60)}}})
+    def test_rating_endpoint_answers_json_429(self):
+        path = reverse('rate_book', args=[self.book.id])
+        self.assertEqual(self.client.post(path, {'score': 4}).status_code, 200)
+        response = self.client.post(path, {'score': 5})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['retry_after'], 60)
+        self.assertEqual(response['Retry-After'], '60')
+
+    @override_settings(BOOK_THROTTLE={'RATES': {'comment': {'user': (1, 60)}}})
+    def test_falls_back_to_process_buckets(self):
+        from . import throttle
+
+        class Unreachable:
+            def __getattr__(self, name):
+                raise ConnectionError("cache down")
+
+        with mock.patch.object(throttle.cache, 'get_cache', Unreachable), self.assertLogs('book.throttle'):
+            self.assertIsNone(throttle.check(self.post_request(), 'comment'))
+            self.assertEqual(throttle.check(self.post_request(), 'comment'), 60)
+
+    def post_request(self):
+        request = RequestFactory().post('/')
+        request.user = self.user
+        return request
+
+
+CALLS = []
+
+
+def cover_upload(color, name='cover.png'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 60), color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@tasks.task
+def record_call(value):
+    CALLS.append(value)
+
+
+@tasks.task(max_attempts=2)
+def always_fails():
+    raise RuntimeError("boom")
+
+
+@override_settings(BOOK_TASKS={'EAGER': False, 'BACKOFF_SECONDS': 10}, DATABASE_ROUTERS=[])
+class TaskQueueTests(TestCase):
+    """Deferred work goes through the book_task table and run_worker."""
+
+    def setUp(self):
+        CALLS.clear()
+        cache.get_cache().clear()
+
+    def test_enqueue_and_run(self):
+        record_call.enqueue(1)
+        record_call.enqueue(2, countdown=60)  # not due yet
+        self.assertEqual(CALLS, [])
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(CALLS, [1])
+        done = Task.objects.get(status=Task.DONE)
+        self.assertIsNotNone(done.duration_ms)
+        stats = tasks.stats()['book.tests.record_call']
+        self.assertEqual((stats['done'], stats['queued']), (1, 1))
+
+    def test_dedupe_key(self):
+        first = record_call.enqueue(1, dedupe_key='k')
+        self.assertEqual(record_call.enqueue(2, dedupe_key='k'), first)
+        self.assertEqual(Task.objects.count(), 1)
+        tasks.run_pending()
+        # the key is free again once the queued task has been picked up
+        record_call.enqueue(3, dedupe_key='k')
+        self.assertEqual(Task.objects.filter(status=Task.QUEUED).count(), 1)
+
+    def test_retries_with_backoff(self):
+        always_fails.enqueue()
+        with self.assertLogs('book.tasks', 'WARNING'):
+            tasks.run_pending()
+        row = Task.objects.get()
+        self.assertEqual((row.status, row.attempts), (Task.QUEUED, 1))
+        self.assertGreater(row.run_after, timezone.now() + timedelta(seconds=7))
+        self.assertIn('RuntimeError: boom', row.last_error)
+
+        Task.objects.update(run_after=timezone.now())
+        with self.assertLogs('book.tasks', 'WARNING'):
+            tasks.run_pending()
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_failed_retry_with_a_queued_twin(self):
+        always_fails.enqueue(dedupe_key='k')
+        [task_id] = tasks.claim(1)
+        twin = always_fails.enqueue(dedupe_key='k')  # queued while the first one runs
+        with self.assertLogs('book.tasks', 'WARNING'):
+            self.assertEqual(tasks.execute(task_id)[1], False)
+        failed = Task.objects.get(pk=task_id)
+        self.assertEqual(failed.status, Task.FAILED)
+        self.assertIn('superseded', failed.last_error)
+        self.assertEqual(Task.objects.get(status=Task.QUEUED), twin)
+
+    def test_worker_survives_a_bookkeeping_error(self):
+        record_call.enqueue(1)
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch.object(tasks, 'execute', side_effect=RuntimeError('bookkeeping')), \
+                self.assertLogs('book.management.commands.run_worker', 'ERROR'):
+            call_command('run_worker', concurrency=1, burst=True, stdout=out, stderr=err)
+        self.assertIn('0 done, 1 failed', out.getvalue())
+        self.assertIn('bookkeeping', err.getvalue())
+
+    def test_abandoned_claim_is_taken_over(self):
+        record_call.enqueue(1)
+        self.assertEqual(len(tasks.claim(10, 'dead-worker')), 1)
+        self.assertEqual(tasks.claim(10), [])
+        Task.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        tasks.run_pending()
+        self.assertEqual(CALLS, [1])
+
+    def test_rating_flush_is_queued(self):
+        book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+        self.client.force_login(User.objects.create_user('reader', password='secret'))
+        self.client.post(reverse('rate_book', args=[book.id]), {'score': 4})
+        self.client.post(reverse('rate_book', args=[book.id]), {'score': 5})
+        row = Task.objects.get()
+        self.assertEqual(row.name, 'book.ratings.flush_pending')
+        self.assertGreater(row.run_after, timezone.now())
+
+    def test_replaced_cover_gets_its_variants(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with override_settings(MEDIA_ROOT=media):
+            book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>', cover_image=cover_upload('red'))
+            book.cover_image = cover_upload('blue')
+            book.save()
+            # one queued task for the book, run against the cover it has by then
+            self.assertEqual(Task.objects.filter(status=Task.QUEUED).count(), 1)
+            tasks.run_pending()
+            book.refresh_from_db()
+            self.assertTrue(book.has_cover_variants)
+            self.assertTrue(default_storage.exists(covers.variant_name(book.cover_image.name, 'card', 'webp')))
+
+    def test_run_worker_burst(self):
+        record_call.enqueue(1)
+        always_fails.enqueue()
+        out = io.StringIO()
+        with self.assertLogs('book.tasks', 'WARNING'):
+            call_command('run_worker', concurrency=1, burst=True, stdout=out)
+        self.assertIn('1 done, 1 failed', out.getvalue())
+        call_command('run_worker', stats=True, stdout=out)
+        self.assertIn('book.tests.record_call', out.getvalue())
+
+
+@override_settings(BOOK_TASKS={'EAGER': True}, DATABASE_ROUTERS=[])
+class CoverStorageTests(TestCase):
+    """Covers are stored under the hash of their bytes, however they are saved."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+
+    def test_programmatic_save(self):
+        content = cover_upload('red').read()
+        self.book.cover_image.save('scan.PNG', ContentFile(content))
+        self.book.refresh_from_db()
+        expected = covers.content_hash_name(ContentFile(content), 'scan.png')
+        self.assertEqual(self.book.cover_image.name, expected)
+        self.assertTrue(default_storage.exists(expected))
+        self.assertTrue(self.book.has_cover_variants)
+
+    def test_replacing_a_cover_renames_it(self):
+        self.book.cover_image.save('a.png', ContentFile(cover_upload('red').read()))
+        first = self.book.cover_image.name
+        self.book.cover_image.save('a.png', ContentFile(cover_upload('blue').read()))
+        self.assertNotEqual(self.book.cover_image.name, first)
+
+    def has_variants(self, name):
+        return default_storage.exists(covers.variant_name(name, 'card', 'webp'))
+
+    def test_replaced_cover_variants_are_deleted(self):
+        self.book.cover_image.save('a.png', ContentFile(cover_upload('red').read()))
+        old = self.book.cover_image.name
+        self.assertTrue(self.has_variants(old))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.cover_image.save('a.png', ContentFile(cover_upload('blue').read()))
+        self.assertFalse(self.has_variants(old))
+        self.assertTrue(self.has_variants(self.book.cover_image.name))
+
+    def test_variants_deleted_with_the_last_book_showing_them(self):
+        self.book.cover_image = cover_upload('red')
+        self.book.save()
+        other = Book.objects.create(title='Emma', author='austen', description='<p>x</p>', cover_image=cover_upload('red'))
+        name = self.book.cover_image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.delete()
+        self.assertTrue(self.has_variants(name))  # still Emma's cover
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(self.has_variants(name))
+
+    def test_same_image_is_stored_once(self):
+        self.book.cover_image = cover_upload('red', 'one.png')
+        self.book.save()
+        other = Book.objects.create(title='Emma', author='austen', description='<p>x</p>', cover_image=cover_upload('red', 'two.png'))
+        self.assertEqual(other.cover_image.name, self.book.cover_image.name)
+        self.assertEqual(len(list(Path(settings.MEDIA_ROOT, covers.COVERS_DIR).glob('*.png'))), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "FTS5 is SQLite specific")
+@override_settings(BOOK_SEARCH_FTS=True, BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class FullTextSearchTests(TestCase):
+    """The FTS5 index follows the books, and book_list pages through all of its matches."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.fantasy = Category.objects.create(name='Fantasy')
+
+    def ids(self, query, category=None):
+        return search.search_book_ids(query, category=category)
+
+    def test_index_follows_saves_and_deletes(self):
+        book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>A <b>dragon</b></p>', category=self.fantasy)
+        self.assertEqual(self.ids('hobb'), [book.id])  # prefix match
+        self.assertEqual(self.ids('dragon'), [book.id])  # HTML stripped
+        self.assertEqual(self.ids('fantasy'), [book.id])
+
+        book.title = 'There and Back Again'
+        book.save()
+        self.assertEqual(self.ids('hobbit'), [])
+        self.assertEqual(self.ids('back again'), [book.id])
+
+        self.fantasy.name = 'Mythopoeia'
+        self.fantasy.save()
+        self.assertEqual(self.ids('mythopoeia'), [book.id])
+        self.assertEqual(self.ids('again', category='Mythopoeia'), [book.id])
+
+        book.delete()
+        self.assertEqual(self.ids('again'), [])
+
+    def test_ranking_and_operators(self):
+        in_description = Book.objects.create(title='Notes', author='x', description='<p>about dragons</p>')
+        in_title = Book.objects.create(title='Dragons', author='y', description='<p>notes</p>')
+        self.assertEqual(self.ids('dragons'), [in_title.id, in_description.id])
+        # FTS syntax typed by a user is just text (both books mention notes)
+        self.assertCountEqual(self.ids('dragons NOT notes'), [in_title.id, in_description.id])
+        self.assertEqual(self.ids('"dragons'), [in_title.id, in_description.id])
+        self.assertEqual(self.ids('!!!'), [])
+
+    def test_pages_through_every_match(self):
+        books = [Book.objects.create(title=f'Dune {n}', author='herbert', description='<p>x</p>') for n in range(8)]
+        results = search.SearchResults('dune')
+        self.assertEqual(results.count(), 8)
+        self.assertEqual(results[6:12], [books[1].id, books[0].id])  # same rank: newest first
+
+        response = self.client.get(reverse('book_list'), {'q': 'dune', 'page': 2})
+        page_obj = response.context['page_obj']
+        self.assertEqual((page_obj.paginator.count, page_obj.number), (8, 2))
+        self.assertEqual([book.id for book in page_obj.object_list], [books[1].id, books[0].id])
+
+        api = self.client.get(reverse('api_book_list'), {'q': 'dune', 'limit': 20}).json()
+        self.assertEqual(len(api['results']), 8)
+
+    def test_sidebar_counts_every_match(self):
+        for n in range(8):
+            Book.objects.create(title=f'Dune {n}', author='herbert', description='<p>x</p>', category=self.fantasy if n < 5 else None)
+        Book.objects.create(title='Emma', author='austen', description='<p>x</p>', category=self.fantasy)
+        for params in ({'q': 'dune'}, {'q': 'dune', 'page': 2}, {'q': 'dune', 'category': 'Fantasy'}):
+            content = self.client.get(reverse('book_list'), params).content.decode()
+            self.assertRegex(content, r'Fantasy\s*<span class="badge[^"]*">5</span>')
+        content = self.client.get(reverse('book_list')).content.decode()
+        self.assertRegex(content, r'Fantasy\s*<span class="badge[^"]*">6</span>')
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class LeaderboardListTests(TestCase):
+    """book_list's board sorts, and how they combine with a search."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.readers = [User.objects.create_user(f'reader{n}', password='secret') for n in range(3)]
+        cls.dune = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+        cls.emma = Book.objects.create(title='Emma', author='austen', description='<p>x</p>')
+        cls.ulysses = Book.objects.create(title='Ulysses', author='joyce', description='<p>x</p>')
+        for reader in cls.readers:
+            Rating.objects.create(book=cls.emma, user=reader, score=5)
+        Rating.objects.create(book=cls.dune, user=cls.readers[0], score=3)
+        for n in range(2):
+            Comment.objects.create(book=cls.ulysses, user=cls.readers[n], content='hm')
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def listed(self, **params):
+        response = self.client.get(reverse('book_list'), params)
+        return [book.id for book in response.context['page_obj'].object_list], response.content.decode()
+
+    def test_boards_before_and_after_refresh(self):
+        expected = {
+            'top_rated': [self.emma.id, self.dune.id],
+            'most_discussed': [self.ulysses.id],
+            'trending': [self.ulysses.id, self.emma.id, self.dune.id],
+        }
+        # never refreshed: ranked live instead of an empty page
+        self.assertFalse(LeaderboardEntry.objects.exists())
+        for sort, ids in expected.items():
+            self.assertEqual(self.listed(sort=sort)[0], ids, sort)
+        leaderboards.refresh()
+        for sort, ids in expected.items():
+            with mock.patch.object(leaderboards, 'live_ranking') as live:
+                self.assertEqual(self.listed(sort=sort)[0], ids, sort)
+            live.assert_not_called()
+
+    def test_search_drops_the_board_sort(self):
+        leaderboards.refresh()
+        for fts in (True, False):
+            with self.subTest(fts=fts), override_settings(BOOK_SEARCH_FTS=fts):
+                ids, content = self.listed(q='dune', sort='top_rated')
+                self.assertEqual(ids, [self.dune.id])
+                self.assertIn('Results for “dune”', content)
+                self.assertNotIn('Top Rated Books', content)
+                self.assertNotIn('sort=top_rated&amp;page', content)
+
+
+try:
+    from . import recommendations
+except ImportError:  # numpy / scipy are optional
+    recommendations = None
+
+
+@unittest.skipIf(recommendations is None, "needs numpy and scipy")
+@override_settings(DATABASE_ROUTERS=[])
+class SimilarBooksTests(TestCase):
+    """compute() clears similarity_dirty only for the lists it actually wrote."""
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.books = [Book.objects.create(title=f'Book {n}', author='a', description='<p>x</p>') for n in range(4)]
+        self.users = [User.objects.create(username=f'reader{n}') for n in range(4)]
+        # readers who like book 0 like book 1 too, and not book 3; nobody rated book 2
+        for user, scores in zip(self.users, [(5, 5, 1), (1, 1, 5), (4, 5, 2), (2, 1, 4)]):
+            for book, score in zip([self.books[0], self.books[1], self.books[3]], scores):
+                Rating.objects.create(book=book, user=user, score=score)
+
+    def dirty(self):
+        return set(Book.objects.filter(similarity_dirty=True).values_list('id', flat=True))
+
+    def compute(self):
+        return recommendations.compute(log=lambda message: None)
+
+    def test_flags_cleared_with_the_written_lists(self):
+        self.assertEqual(self.dirty(), {book.id for book in self.books})
+        self.assertEqual(self.compute(), sorted(book.id for book in self.books))
+        self.assertEqual(self.dirty(), set())
+        self.assertEqual(
+            list(SimilarBook.objects.filter(book=self.books[0]).values_list('similar_id', flat=True)),
+            [self.books[1].id],
+        )
+        self.assertEqual(self.compute(), [])
+
+    def test_rating_during_the_run_keeps_its_flag(self):
+        load = recommendations.RatingMatrix.load
+
+        def load_then_rate(**kwargs):
+            matrix = load(**kwargs)
+            Rating.objects.create(book=self.books[2], user=self.users[0], score=3)  # not in the matrix
+            return matrix
+
+        with mock.patch.object(recommendations.RatingMatrix, 'load', side_effect=load_then_rate):
+            self.compute()
+        self.assertEqual(self.dirty(), {self.books[2].id})
+
+    def test_failed_run_keeps_the_flags(self):
+        with mock.patch.object(recommendations.RatingMatrix, 'similarities', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                self.compute()
+        # book 2 has no ratings: its empty list was written before the failure
+        self.assertEqual(self.dirty(), {self.books[0].id, self.books[1].id, self.books[3].id})
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class BookListPaginationTests(TestCase):
+    """Every page of the catalog, numbered or by cursor, lists each book once, newest first."""
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.books = []
+        # created out of id order (imports), with a tie on created_at
+        for n, minutes in enumerate([5, 1, 9, 3, 3, 7, 2, 8, 6, 4, 0, 11, 10]):
+            book = Book.objects.create(title=f'Book {n}', author='a', description='<p>x</p>')
+            Book.objects.filter(pk=book.pk).update(created_at=now - timedelta(minutes=minutes))
+            cls.books.append(book)
+        cls.newest_first = list(Book.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def page(self, **params):
+        response = self.client.get(reverse('book_list'), params)
+        return response.context['page_obj']
+
+    @override_settings(BOOK_LIST_CURSOR_PAGINATION=False)
+    def test_numbered_pages_are_ordered(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            listed = [book.id for number in (1, 2, 3) for book in self.page(page=number).object_list]
+        self.assertEqual(listed, self.newest_first)
+
+    def walk(self, paginator):
+        """Follow next cursors to the end, then previous cursors back: the pages both ways."""
+        forward = [paginator.get_page()]
+        while forward[-1].has_next():
+            forward.append(paginator.get_page(forward[-1].next_cursor))
+        backward = [forward[-1]]
+        while backward[-1].has_previous():
+            backward.append(paginator.get_page(backward[-1].previous_cursor))
+        ids = lambda pages: [[row.id for row in page] for page in pages]
+        return ids(forward), ids(reversed(backward))
+
+    def test_cursor_walk_latest(self):
+        forward, backward = self.walk(CursorPaginator(Book.objects.all(), 6, ordering='latest'))
+        self.assertEqual(forward, [self.newest_first[:6], self.newest_first[6:12], self.newest_first[12:]])
+        self.assertEqual(backward, forward)
+
+    def test_cursor_walk_rating_with_unrated_books(self):
+        for n, book in enumerate(self.books[:7]):
+            Book.objects.filter(pk=book.pk).update(rating_avg=[4.5, 3.0, 4.5, 5.0, 3.0, 4.5, 1.0][n], rating_count=n % 3 + 1)
+        rows = Book.objects.values_list('id', 'rating_avg', 'rating_count')
+        # DESC, unrated (NULL) books last
+        expected = [row[0] for row in sorted(rows, key=lambda row: (row[1] is not None, row[1] or 0, row[2], row[0]), reverse=True)]
+        forward, backward = self.walk(CursorPaginator(Book.objects.all(), 4, ordering='rating'))
+        self.assertEqual(sum(forward, []), expected)
+        self.assertEqual(backward, forward)
+
+    @override_settings(BOOK_LIST_CURSOR_PAGINATION=True)
+    def test_view_follows_cursors(self):
+        first = self.page()
+        second = self.page(cursor=first.next_cursor)
+        self.assertEqual([book.id for book in second], self.newest_first[6:12])
+        self.assertEqual([book.id for book in self.page(cursor=second.previous_cursor)], self.newest_first[:6])
+        content = self.client.get(reverse('book_list'), {'cursor': first.next_cursor}).content.decode()
+        self.assertIn(f'cursor={quote(second.next_cursor)}', content)
+
+    def test_bad_cursors_give_the_first_page(self):
+        paginator = CursorPaginator(Book.objects.all(), 6, ordering='latest')
+        next_cursor = paginator.get_page().next_cursor
+        values = signing.loads(next_cursor, salt=CURSOR_SALT)['v']
+        bad = {
+            'tampered': next_cursor[:-2] + ('AA' if not next_cursor.endswith('AA') else 'BB'),
+            'garbage': 'not-a-cursor',
+            'other salt': signing.dumps({'v': values, 'd': 'next'}, salt='elsewhere'),
+            'wrong length': encode_cursor(values[:1], 'next'),
+            'wrong direction': encode_cursor(values, 'sideways'),
+            'wrong type': encode_cursor(['yesterday', 'x'], 'next'),
+        }
+        for label, token in bad.items():
+            with self.subTest(label):
+                try:
+                    page = paginator.get_page(token)
+                except ValidationError:
+                    self.fail("an unparsable cursor value must not raise")
+                self.assertEqual([book.id for book in page], self.newest_first[:6])
+                self.assertFalse(page.has_previous())
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class JsonApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        category = Category.objects.create(name='Fantasy')
+        cls.books = []
+        for n in range(5):
+            book = Book.objects.create(title=f'Book {n}', author='a', description=f'<p>text {n}</p>', category=category)
+            Book.objects.filter(pk=book.pk).update(created_at=now - timedelta(minutes=n))
+            cls.books.append(book)
+        user = User.objects.create(username='reader')
+        for n in range(3):
+            Comment.objects.create(book=cls.books[0], user=user, content=f'comment {n}')
+
+    def get(self, name, *args, **params):
+        return self.client.get(reverse(name, args=args), params)
+
+    def test_default_fields_skip_the_description(self):
+        row = self.get('api_book_detail', self.books[0].id).json()
+        self.assertEqual(set(row), set(api.DEFAULT_BOOK_FIELDS))
+        self.assertNotIn('description', row)
+        self.assertEqual(row['category'], 'Fantasy')
+
+    def test_fields_selection(self):
+        row = self.get('api_book_detail', self.books[0].id, fields='title, description').json()
+        self.assertEqual(row, {'title': 'Book 0', 'description': '<p>text 0</p>'})
+        rows = self.get('api_book_list', fields='title').json()['results']
+        self.assertEqual(rows[0], {'title': 'Book 0'})
+
+    def test_unknown_fields_are_rejected(self):
+        for name, args in [('api_book_list', ()), ('api_book_detail', (self.books[0].id,)), ('api_book_batch', ())]:
+            with self.subTest(name):
+                response = self.get(name, *args, fields='title,password', ids='1')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'unknown fields: password'})
+
+    def test_cursor_round_trip(self):
+        first = self.get('api_book_list', limit=2, fields='id').json()
+        second = self.get('api_book_list', limit=2, fields='id', cursor=first['next']).json()
+        third = self.get('api_book_list', limit=2, fields='id', cursor=second['next']).json()
+        listed = [row['id'] for page in (first, second, third) for row in page['results']]
+        self.assertEqual(listed, [book.id for book in self.books])
+        self.assertIsNone(first['previous'])
+        self.assertIsNone(third['next'])
+        back = self.get('api_book_list', limit=2, fields='id', cursor=second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_tampered_cursor_gives_the_first_page(self):
+        first = self.get('api_book_list', limit=2, fields='id').json()
+        tampered = first['next'][:-2] + ('AA' if not first['next'].endswith('AA') else 'BB')
+        response = self.get('api_book_list', limit=2, fields='id', cursor=tampered)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], first['results'])
+
+    def test_bad_limit(self):
+        self.assertEqual(self.get('api_book_list', limit='lots').status_code, 400)
+        self.assertEqual(len(self.get('api_book_list', limit=1000).json()['results']), 5)
+
+    def test_batch_keeps_order_and_lists_missing_ids(self):
+        ids = [self.books[2].id, 999999, self.books[0].id]
+        data = self.get('api_book_batch', ids=','.join(map(str, ids)), fields='id,title').json()
+        self.assertEqual([row['id'] for row in data['results']], [self.books[2].id, self.books[0].id])
+        self.assertEqual(data['missing'], [999999])
+
+    def test_batch_rejects_bad_ids(self):
+        for ids, error in [
+            ('', "ids is required"),
+            ('1,two,3', "ids must be a comma separated list of integers"),
+            (','.join(str(n) for n in range(api.MAX_BATCH_IDS + 1)), f"at most {api.MAX_BATCH_IDS} ids per request"),
+        ]:
+            with self.subTest(ids=ids[:20]):
+                response = self.get('api_book_batch', ids=ids)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': error})
+
+    def test_missing_book_is_404(self):
+        response = self.get('api_book_detail', 999999)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'book not found'})
+
+    def test_only_get_is_allowed(self):
+        self.assertEqual(self.client.post(reverse('api_book_list')).status_code, 405)
+
+    def test_comments_follow_cursors(self):
+        first = self.get('api_book_comments', self.books[0].id, limit=2).json()
+        second = self.get('api_book_comments', self.books[0].id, limit=2, cursor=first['next']).json()
+        contents = [row['content'] for row in first['results'] + second['results']]
+        self.assertEqual(sorted(contents), ['comment 0', 'comment 1', 'comment 2'])
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['results'][0]['user'], 'reader')
+
+
+PROFILING_ON = {'ENABLED': True, 'SLOW_REQUEST_MS': 0, 'SLOWEST_QUERIES': 2, 'SERVER_TIMING': True}
+SERVER_TIMING = re.compile(
+    r'^db;dur=(?P<db>[\d.]+);desc="(?P<queries>\d+) queries", '
+    r'tpl;dur=(?P<tpl>[\d.]+);desc="templates", '
+    r'app;dur=(?P<app>[\d.]+);desc="total"$'
+)
+
+
+@override_settings(BOOK_PROFILING=PROFILING_ON, BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class RequestProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Fantasy')
+        cls.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>', category=category)
+
+    def setUp(self):
+        cache.get_cache().clear()
+        # the middleware swaps in the timed template render for the whole process
+        self.addCleanup(setattr, DjangoBackendTemplate, 'render', middleware._original_template_render)
+
+    def timing(self, response):
+        match = SERVER_TIMING.match(response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        return {key: float(value) for key, value in match.groupdict().items()}
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book_details', args=[self.book.id]))
+        timing = self.timing(response)
+        self.assertEqual(timing['queries'], len(queries))
+        self.assertGreater(timing['tpl'], 0)
+        self.assertGreaterEqual(timing['app'], timing['db'] + timing['tpl'])
+
+    def test_async_views_are_measured(self):
+        async def get():
+            return await self.async_client.get(reverse('book_details', args=[self.book.id]))
+
+        with override_settings(ROOT_URLCONF=AsyncPagesUrls):
+            response = async_to_sync(get)()
+        self.assertGreater(self.timing(response)['queries'], 0)
+
+    def test_slow_request_log(self):
+        with self.assertLogs('book.slow_requests', 'WARNING') as logs:
+            response = self.client.get(reverse('book_list'), {'category': 'Fantasy'})
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(
+            {key: record[key] for key in ('method', 'path', 'status')},
+            {'method': 'GET', 'path': '/?category=Fantasy', 'status': 200},
+        )
+        self.assertEqual(record['queries'], self.timing(response)['queries'])
+        slowest = record['slowest_queries']
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['ms'], slowest[1]['ms'])
+        self.assertTrue(all(query['call_site'].startswith('book' + os.sep) for query in slowest), slowest)
+
+    @override_settings(BOOK_PROFILING={**PROFILING_ON, 'SLOW_REQUEST_MS': 60_000})
+    def test_fast_request_is_not_logged(self):
+        with self.assertNoLogs('book.slow_requests'):
+            self.client.get(reverse('book_list'))
+
+    def test_template_render_outside_a_request(self):
+        self.client.get(reverse('book_list'))
+        self.assertIs(DjangoBackendTemplate.render, middleware._timed_template_render)
+        template = engines['django'].from_string('{{ n }} books')
+        self.assertEqual(template.render({'n': 3}), '3 books')
+
+    @override_settings(BOOK_PROFILING={**PROFILING_ON, 'ENABLED': False})
+    def test_disabled_middleware_removes_itself(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.RequestProfilingMiddleware(lambda request: HttpResponse())
+        self.assertNotIn('Server-Timing', self.client.get(reverse('book_list')))
+
+
+class AsyncPagesUrls:
+    """book/urls.py with the async pages, whatever LIBRARY_ASYNC_VIEWS says."""
+
+    urlpatterns = [
+        path('', async_views.book_list, name='book_list'),
+        path('books/details/<int:id>/', async_views.book_details, name='book_details'),
+        path('profile/', async_views.profile_view, name='profile'),
+        *(pattern for pattern in book_urls.urlpatterns if pattern.name not in ('book_list', 'book_details', 'profile')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncPagesUrls, BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Fantasy', book_count=1)
+        # not the author: the author actions link to the disabled book_update URL
+        cls.user = User.objects.create(username='reader')
+        cls.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>', category=category)
+        Comment.objects.create(book=cls.book, user=cls.user, content='Lovely')
+        Rating.objects.create(book=cls.book, user=cls.user, score=4)
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    async def test_book_list_anonymous(self):
+        response = await self.async_client.get(reverse('book_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.resolver_match.func, async_views.book_list)
+        self.assertEqual([book.id for book in response.context['page_obj']], [self.book.id])
+        self.assertContains(response, 'The Hobbit')
+
+    async def test_book_list_authenticated(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('book_list'), {'category': 'Fantasy'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book.id for book in response.context['page_obj']], [self.book.id])
+
+    async def test_book_details_anonymous(self):
+        response = await self.async_client.get(reverse('book_details', args=[self.book.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.resolver_match.func, async_views.book_details)
+        self.assertIsNone(response.context['user_rating'])
+        self.assertContains(response, 'Lovely')
+
+    async def test_book_details_authenticated(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('book_details', args=[self.book.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['user_rating'], 4)
+
+    async def test_book_details_post_uses_the_sync_view(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('book_details', args=[self.book.id])
+        with mock.patch.object(views, 'book_details', wraps=views.book_details) as sync_view:
+            response = await self.async_client.post(url, {'content': 'Read it twice'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        sync_view.assert_called_once()
+        self.assertTrue(await Comment.objects.filter(book=self.book, content='Read it twice').aexists())
+
+    async def test_missing_book_is_404(self):
+        response = await self.async_client.get(reverse('book_details', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_profile_anonymous_redirects_to_login(self):
+        response = await self.async_client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('next=', response['Location'])
+
+    async def test_profile_authenticated(self):
+        own = await Book.objects.acreate(title='Notes', author='reader', description='<p>x</p>')
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('profile'), {'section': 'books'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.resolver_match.func, async_views.profile_view)
+        self.assertEqual([book.id for book in response.context['books']], [own.id])
+
+    async def test_profile_post_uses_the_sync_view(self):
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(views, 'profile_view', return_value=HttpResponse('sync')) as sync_view:
+            response = await self.async_client.post(reverse('profile') + '?section=update', {})
+        sync_view.assert_called_once()
+        self.assertEqual(response.content, b'sync')
+
+
+@override_settings(BOOK_AUTOCOMPLETE={'ENABLED': True, 'MAX_AGE': 300}, DATABASE_ROUTERS=[])
+class AutocompleteTests(TestCase):
+    """The per-worker prefix index, its signal patches and api/autocomplete/."""
+
+    def setUp(self):
+        self.addCleanup(self.reset_index)
+        self.reset_index()
+        self.fantasy = Category.objects.create(name='Fantasy')
+        self.hobbit = Book.objects.create(title='The Hobbit', author='Tolkien', description='<p>x</p>', category=self.fantasy)
+        self.silmarillion = Book.objects.create(title='The Silmarillion', author='Tolkien', description='<p>x</p>')
+        self.emile = Book.objects.create(title='Émile', author='Rousseau', description='<p>x</p>')
+        self.tolstoy = Book.objects.create(title='War and Peace', author='Tolstoy', description='<p>x</p>')
+        Book.objects.filter(pk=self.hobbit.pk).update(rating_count=5)
+        Book.objects.filter(pk=self.tolstoy.pk).update(rating_count=3)
+
+    def reset_index(self):
+        autocomplete._index, autocomplete._built_at = None, 0.0
+
+    def labels(self, prefix, limit=8):
+        return [hit['label'] for hit in autocomplete.suggest(prefix, limit)]
+
+    def test_build_ranks_by_popularity(self):
+        index = autocomplete.get_index()
+        self.assertEqual(index.stats()['books'], 4)
+        # the author gathers the ratings of all their books
+        self.assertEqual(self.labels('tol'), ['Tolkien', 'Tolstoy'])
+        self.assertEqual(self.labels('the'), ['The Hobbit', 'The Silmarillion'])
+        self.assertEqual(self.labels('hob'), ['The Hobbit'])  # any word of a title
+        self.assertEqual(self.labels('EMI'), ['Émile'])  # case and accents folded
+        self.assertEqual(self.labels('tol', limit=1), ['Tolkien'])
+        self.assertEqual(self.labels('  '), [])
+        self.assertEqual(autocomplete.suggest('fan')[0], {'type': 'category', 'label': 'Fantasy', 'id': self.fantasy.id})
+
+    def test_signals_patch_the_index(self):
+        autocomplete.get_index()
+        book = Book.objects.create(title='Dune', author='Herbert', description='<p>x</p>')
+        self.assertEqual(self.labels('dun'), ['Dune'])
+        book.title = 'Dune Messiah'
+        book.save()
+        self.assertEqual(self.labels('mess'), ['Dune Messiah'])
+        book.delete()
+        self.assertEqual(self.labels('dun'), [])
+        self.assertEqual(self.labels('herb'), [])  # the author went with their last book
+
+        self.fantasy.name = 'Mythopoeia'
+        self.fantasy.save()
+        self.assertEqual(self.labels('myth'), ['Mythopoeia'])
+        self.assertEqual(self.labels('fant'), [])
+        self.fantasy.delete()
+        self.assertEqual(self.labels('myth'), [])
+
+    def test_stale_index_is_rebuilt_in_the_background(self):
+        old = autocomplete.get_index()
+        autocomplete._built_at -= 1000
+        new, release = autocomplete.PrefixIndex(), threading.Event()
+
+        def slow_build(max_suffixes):
+            release.wait(5)
+            return new
+
+        with mock.patch.object(autocomplete.PrefixIndex, 'build', side_effect=slow_build):
+            self.assertIs(autocomplete.get_index(), old)  # no wait for the build
+            self.assertIs(autocomplete.get_index(), old)
+            refresher = autocomplete._refresher
+            release.set()
+            refresher.join(5)
+        self.assertIs(autocomplete._refresher, refresher)  # a single rebuild was started
+        self.assertIs(autocomplete.get_index(), new)
+
+    def test_view(self):
+        url = reverse('api_autocomplete')
+        self.assertEqual(self.client.get(url).json(), {'query': '', 'results': []})
+        results = self.client.get(url, {'q': 'émi'}).json()['results']
+        self.assertEqual([(hit['label'], hit['url']) for hit in results], [('Émile', reverse('book_details', args=[self.emile.id]))])
+        self.assertEqual(self.client.get(url, {'q': 'x', 'limit': 'many'}).status_code, 400)
+
+        Book.objects.bulk_create([Book(title=f'Saga {n}', author=f'a{n}', description='<p>x</p>') for n in range(25)])
+        self.reset_index()
+        self.assertEqual(len(self.client.get(url, {'q': 'saga', 'limit': 100}).json()['results']), 20)
+        self.assertEqual(len(self.client.get(url, {'q': 'saga', 'limit': -3}).json()['results']), 1)
+        self.assertEqual(len(self.client.get(url, {'q': 'saga'}).json()['results']), 8)
+
+
+class SharedCacheSettingsTests(unittest.TestCase):
+    """The cache versions must be shared by every worker outside a single dev process."""
+
+    def load_settings(self, **env):
+        code = "import django; django.setup(); from django.conf import settings; print(settings.CACHES['default']['BACKEND'])"
+        inherited = {key: value for key, value in os.environ.items() if not key.startswith('LIBRARY_')}
+        env = {**inherited, 'DJANGO_SETTINGS_MODULE': 'online_library.settings', **env}
+        return subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+
+    def test_production_profile_defaults_to_a_shared_cache(self):
+        result = self.load_settings(LIBRARY_DB_PROFILE='production')
+        self.assertEqual(result.stdout.strip(), 'django.core.cache.backends.filebased.FileBasedCache', result.stderr)
+
+    def test_production_profile_refuses_a_per_process_cache(self):
+        result = self.load_settings(LIBRARY_DB_PROFILE='production', LIBRARY_CACHE_BACKEND='locmem')
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured', result.stderr)
+
+
+
+REPLICA_ROUTER = ['book.routers.PrimaryReplicaRouter']
+
+
+@override_settings(DATABASE_ROUTERS=REPLICA_ROUTER)
+class ReplicaRoutingTests(TestCase):
+    """The aliases PrimaryReplicaRouter picks, with a replica configured."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        patcher = mock.patch.object(routers, 'replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def probe(self, method='get'):
+        seen = {}
+
+        @routers.replica_reads
+        def view(request):
+            seen['book'] = router.db_for_read(Book)
+            seen['user'] = router.db_for_read(User)
+            seen['write'] = router.db_for_write(Book)
+            return HttpResponse()
+
+        view(getattr(self.factory, method)('/'))
+        return seen
+
+    def test_get_reads_from_the_replica(self):
+        self.assertEqual(self.probe('get')['book'], 'replica')
+        self.assertEqual(self.probe('head')['book'], 'replica')
+
+    def test_users_stay_on_the_primary(self):
+        self.assertEqual(self.probe()['user'], 'default')
+
+    def test_writes_go_to_the_primary(self):
+        self.assertEqual(self.probe('get')['write'], 'default')
+        self.assertEqual(self.probe('post')['write'], 'default')
+
+    def test_post_reads_from_the_primary(self):
+        self.assertEqual(self.probe('post')['book'], 'default')
+
+    def test_reads_outside_the_decorator_stay_on_the_primary(self):
+        self.probe()
+        self.assertEqual(router.db_for_read(Book), 'default')
+
+    def test_flag_is_reset_after_an_exception(self):
+        @routers.replica_reads
+        def view(request):
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            view(self.factory.get('/'))
+        self.assertFalse(routers._use_replica.get())
+        self.assertEqual(router.db_for_read(Book), 'default')
+
+    def test_flag_is_reset_after_an_exception_in_an_async_view(self):
+        @routers.replica_reads
+        async def view(request):
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            async_to_sync(view)(self.factory.get('/'))
+        self.assertFalse(routers._use_replica.get())
+        self.assertEqual(router.db_for_read(Book), 'default')
+
+    def test_search_follows_the_router(self):
+        seen = {}
+
+        @routers.replica_reads
+        def view(request):
+            seen['read'] = search._read_connection()
+            seen['write'] = search._write_connection()
+            return HttpResponse()
+
+        with mock.patch.object(search, 'connections', {'default': 'primary', 'replica': 'replica'}):
+            view(self.factory.get('/'))
+            self.assertEqual(search._read_connection(), 'primary')
+        self.assertEqual(seen, {'read': 'replica', 'write': 'primary'})
+
+
+@unittest.skipUnless(routers.replica_configured(), "needs the replica alias (LIBRARY_DB_PROFILE=production)")
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=REPLICA_ROUTER)
+class ReplicaViewTests(TransactionTestCase):
+    """
+    The real catalog views read through the replica alias. The test mirror is
+    a second connection to the test database, so the data must be committed.
+    """
+
+    # the runner checks every alias a test class names, even a skipped one
+    databases = {'default', 'replica'} if routers.replica_configured() else {'default'}
+
+    def setUp(self):
+        cache.get_cache().clear()
+        category = Category.objects.create(name='Fantasy')
+        self.book = Book.objects.create(title='The Hobbit', author='tolkien', description='<p>x</p>', category=category)
+
+    def routed_reads(self, path):
+        aliases = []
+        db_for_read = routers.PrimaryReplicaRouter.db_for_read
+
+        def record(router_, model, **hints):
+            alias = db_for_read(router_, model, **hints)
+            aliases.append((model._meta.label, alias))
+            return alias
+
+        with mock.patch.object(routers.PrimaryReplicaRouter, 'db_for_read', record):
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return aliases
+
+    def test_book_details(self):
+        self.assertIn(('book.Book', 'replica'), self.routed_reads(reverse('book_details', args=[self.book.id])))
+
+    def test_book_list(self):
+        self.assertIn(('book.Book', 'replica'), self.routed_reads(reverse('book_list')))
+
+    def test_reads_after_the_request_stay_on_the_primary(self):
+        self.routed_reads(reverse('book_list'))
+        self.assertEqual(router.db_for_read(Book), 'default')
+
+@override_settings(DATABASE_ROUTERS=[])
+class CategoryCountTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.fantasy = Category.objects.create(name='Fantasy')
+        self.classics = Category.objects.create(name='Classics')
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'book_count'))
+
+    def test_counts_follow_moves_and_deletes(self):
+        book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>', category=self.fantasy)
+        self.assertEqual(self.counts(), {'Fantasy': 1, 'Classics': 0})
+        book = Book.objects.get(pk=book.pk)
+        book.category = self.classics
+        book.save()
+        self.assertEqual(self.counts(), {'Fantasy': 0, 'Classics': 1})
+        book.delete()
+        self.assertEqual(self.counts(), {'Fantasy': 0, 'Classics': 0})
+
+    def test_move_out_of_a_zero_count_never_goes_negative(self):
+        book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>', category=self.fantasy)
+        Category.objects.update(book_count=0)  # drifted, e.g. a bulk load not reconciled yet
+        book = Book.objects.get(pk=book.pk)
+        book.category = self.classics
+        book.save()
+        self.assertEqual(self.counts(), {'Fantasy': 0, 'Classics': 1})
+
+
+@override_settings(BOOK_TASKS={'EAGER': False}, DATABASE_ROUTERS=[])
+class ImportBooksTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        self.dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, lines):
+        path = self.dir / name
+        path.write_text(''.join(f'{line}\n' for line in lines), encoding='utf-8')
+        return path
+
+    def books(self, count):
+        return [json.dumps({'title': f'Book {n}', 'author': 'a', 'category': 'Imported'}) for n in range(count)]
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command('import_books', str(path), *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_malformed_rows_are_skipped(self):
+        path = self.write('books.jsonl', [
+            json.dumps({'title': 'Dune', 'author': 'herbert', 'description': '<p>Spice</p>'}),
+            '{"title": "broken',
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'title': 'No author'}),
+            json.dumps({'title': 42, 'author': 'numbers'}),
+            json.dumps({'title': '  ', 'author': 'blank'}),
+            json.dumps({'title': 'Emma', 'author': 'austen', 'category': 'Classics'}),
+        ])
+        output = self.run_import(path, '--batch-size', '2')
+        self.assertIn('2 imported, 5 skipped', output)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Dune', 'Emma'])
+        self.assertEqual(Book.objects.get(title='Dune').excerpt, 'Spice')
+        self.assertEqual(Category.objects.get(name='Classics').book_count, 1)
+
+    def test_csv_rows_with_missing_columns_are_skipped(self):
+        path = self.write('books.csv', ['title,author,category', 'Dune,herbert,SF', 'Short row', ',nobody,SF'])
+        self.assertIn('1 imported, 2 skipped', self.run_import(path))
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['Dune'])
+
+    def test_resume_from_checkpoint(self):
+        path = self.write('books.jsonl', self.books(7))
+        build_book = import_books.Command._build_book
+
+        def crash_on_book_5(command, record):
+            if record['title'] == 'Book 5':
+                raise RuntimeError("killed")
+            return build_book(command, record)
+
+        with mock.patch.object(import_books.Command, '_build_book', crash_on_book_5):
+            with self.assertRaises(RuntimeError):
+                self.run_import(path, '--batch-size', '2', '--checkpoint')
+        self.assertEqual(Book.objects.count(), 4)
+        self.assertEqual(ImportCheckpoint.objects.get().records, 4)
+
+        output = self.run_import(path, '--batch-size', '2', '--checkpoint')
+        self.assertIn('Resuming after record 4.', output)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), [f'Book {n}' for n in range(7)])
+        self.assertEqual(ImportCheckpoint.objects.get().records, 7)
+
+        # the whole file is done: importing it again with the checkpoint adds nothing
+        self.run_import(path, '--batch-size', '2', '--checkpoint')
+        self.assertEqual(Book.objects.count(), 7)
+
+    def test_checkpoint_commits_with_its_batch(self):
+        """A crash between a batch and its checkpoint rolls the batch back too, so resuming never duplicates it."""
+        path = self.write('books.jsonl', self.books(6))
+        save_checkpoint = import_books.Command._save_checkpoint
+        saves = []
+
+        def crash_on_second_save(command, records):
+            saves.append(records)
+            if len(saves) == 2:
+                raise RuntimeError("killed")
+            return save_checkpoint(command, records)
+
+        with mock.patch.object(import_books.Command, '_save_checkpoint', crash_on_second_save):
+            with self.assertRaises(RuntimeError):
+                self.run_import(path, '--batch-size', '2', '--checkpoint')
+        self.assertEqual(Book.objects.count(), 2)
+
+        self.run_import(path, '--batch-size', '2', '--checkpoint')
+        titles = list(Book.objects.values_list('title', flat=True))
+        self.assertEqual(sorted(titles), [f'Book {n}' for n in range(6)])
+
+    def test_without_checkpoint_nothing_is_recorded(self):
+        self.run_import(self.write('books.jsonl', self.books(3)))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_imported_covers_get_their_variants_queued(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        covers_dir = self.dir / 'covers'
+        covers_dir.mkdir()
+        Image.new('RGB', (40, 60), 'red').save(covers_dir / 'dune.png')
+        path = self.write('books.jsonl', [
+            json.dumps({'title': 'Dune', 'author': 'herbert', 'cover': 'dune.png'}),
+            json.dumps({'title': 'Emma', 'author': 'austen'}),
+            json.dumps({'title': 'Lost', 'author': 'nobody', 'cover': 'missing.png'}),
+        ])
+        self.run_import(path, '--covers-dir', str(covers_dir))
+
+        dune = Book.objects.get(title='Dune')
+        queued = Task.objects.filter(name=signals.generate_book_cover_variants.task_name, status=Task.QUEUED)
+        self.assertEqual([task.args for task in queued], [[dune.id]])
+        self.assertFalse(dune.has_cover_variants)
+        call_command('run_worker', concurrency=1, burst=True, stdout=io.StringIO())
+        dune.refresh_from_db()
+        self.assertTrue(dune.has_cover_variants)
+
+
+SEED_COUNTS = {'users': 3, 'categories': 2, 'books': 6, 'ratings': 8, 'comments': 5}
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class SeedAndBenchmarkTests(TestCase):
+    """Smoke runs of the load-testing commands on a tiny catalog."""
+
+    def seed(self, seed=3):
+        out = io.StringIO()
+        options = {name: count for name, count in SEED_COUNTS.items()}
+        call_command('seed_library', seed=seed, batch_size=4, stdout=out, **options)
+        return out.getvalue()
+
+    def snapshot(self):
+        return {
+            'books': list(Book.objects.order_by('id').values_list('title', 'author', 'category__name', 'rating_count')),
+            'ratings': sorted(Rating.objects.values_list('user__username', 'book__title', 'score')),
+            'comments': sorted(Comment.objects.values_list('user__username', 'book__title', 'content')),
+        }
+
+    def test_seed_library(self):
+        output = self.seed()
+        self.assertEqual(User.objects.count(), SEED_COUNTS['users'])
+        self.assertEqual(Category.objects.count(), SEED_COUNTS['categories'])
+        self.assertEqual(Book.objects.count(), SEED_COUNTS['books'])
+        self.assertEqual(Rating.objects.count(), SEED_COUNTS['ratings'])
+        self.assertEqual(Comment.objects.count(), SEED_COUNTS['comments'])
+        for line in ('3 users', '2 categories', '6 books', '8 ratings', '5 comments'):
+            self.assertIn(line, output)
+        # bulk_create skips the signals: the command rebuilds what they maintain
+        self.assertEqual(sum(Book.objects.values_list('rating_count', flat=True)), SEED_COUNTS['ratings'])
+        self.assertEqual(sum(Category.objects.values_list('book_count', flat=True)), SEED_COUNTS['books'])
+        self.assertTrue(all(Book.objects.values_list('excerpt', flat=True)))
+
+    def test_seed_library_is_deterministic(self):
+        self.seed()
+        first = self.snapshot()
+        for model in (Comment, Rating, Book, Category, User):
+            model.objects.all().delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+
+    def test_benchmark_views(self):
+        self.seed()
+        before = self.snapshot()
+        baseline = Path(tempfile.mkdtemp()) / 'baseline.json'
+        self.addCleanup(shutil.rmtree, baseline.parent)
+        real_db = Path(settings.BASE_DIR) / 'db.sqlite3'  # DATABASES now names the test database
+        real_db_mtime = real_db.stat().st_mtime_ns if real_db.exists() else None
+
+        out = io.StringIO()
+        call_command('benchmark_views', requests=1, output=str(baseline), stdout=out)
+
+        results = json.loads(baseline.read_text())
+        self.assertEqual(set(results), {
+            'book_list', 'book_list_q', 'book_list_category', 'book_list_deep_page',
+            'book_details_get', 'book_details_get_auth', 'book_details_post', 'profile_view',
+        })
+        self.assertTrue(all(row['requests'] == 1 and row['queries_max'] > 0 for row in results.values()))
+        # the benchmarked POSTs are rolled back, and only the test database is used
+        self.assertEqual(self.snapshot(), before)
+        if real_db_mtime:
+            self.assertEqual(real_db.stat().st_mtime_ns, real_db_mtime)
+
+        call_command('benchmark_views', requests=1, baseline=str(baseline), tolerance=1000, stdout=out)
+        self.assertIn('No regressions', out.getvalue())
+
+    def test_benchmark_views_needs_books(self):
+        with self.assertRaisesMessage(CommandError, 'seed_library'):
+            call_command('benchmark_views', requests=1, stdout=io.StringIO())
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class RenderedDescriptionBackfillTests(TestCase):
+    def test_migration_renders_old_books(self):
+        book = Book.objects.create(title='Dune', author='herbert', description='<p>Spice <em onclick="x()">must</em> flow</p>')
+        Book.objects.update(excerpt='', description_html='')  # as saved before migration 0014
+        backfill = import_module('book.migrations.0019_backfill_rendered_descriptions')
+        backfill.render_descriptions(django_apps, None)
+        book.refresh_from_db()
+        self.assertEqual(book.excerpt, 'Spice must flow')
+        self.assertEqual(book.description_html, '<p>Spice <em>must</em> flow</p>')
+
+    def test_migration_does_not_use_the_live_renderer(self):
+        backfill = import_module('book.migrations.0019_backfill_rendered_descriptions')
+        # imported modules have a __name__, imported functions and classes a __module__
+        origins = {name: getattr(value, '__module__', None) or getattr(value, '__name__', '') for name, value in vars(backfill).items()}
+        app_code = [name for name, origin in origins.items() if origin.startswith('book.') and not origin.startswith('book.migrations.')]
+        self.assertEqual(app_code, [])
+        html = '<p>Go <a href="javascript:x()">here</a><script>x()</script></p>'
+        self.assertEqual(backfill.sanitize_html(html), '<p>Go <a>here</a></p>')
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class RatingAggregateTests(TestCase):
+    """Book.rating_count / rating_sum / rating_avg follow the Rating rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'reader{n}') for n in range(3)]
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+
+    def assertAggregates(self, count, total, avg):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum, self.book.rating_avg), (count, total, avg))
+
+    def test_create_change_delete(self):
+        Rating.objects.create(book=self.book, user=self.users[0], score=4)
+        Rating.objects.create(book=self.book, user=self.users[1], score=1)
+        self.assertAggregates(2, 5, 2.5)
+
+        rating = Rating.objects.get(user=self.users[1])
+        rating.score = 5
+        rating.save()
+        self.assertAggregates(2, 9, 4.5)
+        rating.save()  # unchanged score: no delta
+        self.assertAggregates(2, 9, 4.5)
+
+        rating.score = 2  # not saved: the stored 5 is what goes away
+        rating.delete()
+        self.assertAggregates(1, 4, 4.0)
+        Rating.objects.get().delete()
+        self.assertAggregates(0, 0, None)
+
+    def test_unloaded_instance_recounts_the_book(self):
+        rating = Rating.objects.create(book=self.book, user=self.users[0], score=4)
+        Rating(pk=rating.pk, book=self.book, user=self.users[0], score=2).save()
+        self.assertAggregates(1, 2, 2.0)
+
+    def test_delta_marks_the_book_changed(self):
+        Book.objects.filter(pk=self.book.pk).update(similarity_dirty=False)
+        version = Book.objects.get(pk=self.book.pk).version
+        Book.apply_rating_delta(self.book.id, 2, 7)
+        self.assertAggregates(2, 7, 3.5)
+        self.assertTrue(self.book.similarity_dirty)
+        self.assertEqual(self.book.version, version + 1)
+
+    def test_reconcile_fixes_drift(self):
+        for user, score in zip(self.users, (3, 4, 5)):
+            Rating.objects.create(book=self.book, user=user, score=score)
+        Book.objects.filter(pk=self.book.pk).update(rating_count=7, rating_sum=1, rating_avg=0.1)
+        call_command('reconcile_ratings', stdout=io.StringIO())
+        self.assertAggregates(3, 12, 4.0)
+
+
+@override_settings(BOOK_PAGE_CACHE=False, DATABASE_ROUTERS=[])
+class RatingWriteBehindTests(TestCase):
+    """Star clicks reach Rating and the book aggregates once they have been quiet."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Dune', author='herbert', description='<p>x</p>')
+        cls.reader = User.objects.create_user('reader', password='secret')
+        cls.critic = User.objects.create_user('critic', password='secret')
+        Rating.objects.create(book=cls.book, user=cls.critic, score=5)
+
+    def setUp(self):
+        cache.get_cache().clear()
+
+    def click(self, user, score):
+        self.client.force_login(user)
+        return self.client.post(reverse('rate_book', args=[self.book.id]), {'score': score}).json()
+
+    def assertAggregates(self, count, total):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum), (count, total))
+        self.assertAlmostEqual(self.book.rating_avg, total / count)
+
+    def age_clicks(self):
+        # as if DELAY_SECONDS had passed
+        PendingRating.objects.update(updated_at=timezone.now() - timedelta(seconds=60))
+        Task.objects.filter(status=Task.QUEUED).update(run_after=timezone.now())
+
+    @override_settings(BOOK_TASKS={'EAGER': True})
+    def test_eager_click_is_written_at_once(self):
+        response = self.click(self.reader, 3)
+        self.assertEqual((response['rating_count'], response['rating_avg']), (2, 4.0))
+        self.assertEqual(Rating.objects.get(user=self.reader).score, 3)
+        self.assertFalse(PendingRating.objects.exists())
+        self.assertAggregates(2, 8)
+
+    @override_settings(BOOK_TASKS={'EAGER': False})
+    def test_flush_waits_until_quiet(self):
+        self.click(self.reader, 2)
+        self.click(self.reader, 4)
+        self.assertEqual(Task.objects.filter(status=Task.QUEUED).count(), 1)
+        self.assertEqual(tasks.run_pending(), 0)  # not due yet
+        self.assertFalse(Rating.objects.filter(user=self.reader).exists())
+
+        self.age_clicks()
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(Rating.objects.get(user=self.reader).score, 4)
+        self.assertFalse(PendingRating.objects.exists())
+        self.assertFalse(Task.objects.filter(status=Task.QUEUED).exists())
+        self.assertAggregates(2, 9)
+
+    @override_settings(BOOK_TASKS={'EAGER': False})
+    def test_flush_rearms_for_recent_clicks(self):
+        self.click(self.reader, 2)
+        self.age_clicks()
+        self.click(self.critic, 1)  # still fresh when the flush runs
+        tasks.run_pending()
+        self.assertEqual(Rating.objects.get(user=self.reader).score, 2)
+        self.assertEqual(Rating.objects.get(user=self.critic).score, 5)
+        self.assertGreater(Task.objects.get(status=Task.QUEUED).run_after, timezone.now())
+
+        self.age_clicks()
+        tasks.run_pending()
+        self.assertEqual(Rating.objects.get(user=self.critic).score, 1)
+        self.assertAggregates(2, 3)
+
+    @override_settings(BOOK_TASKS={'EAGER': False})
+    def test_flush_command_writes_quiet_clicks(self):
+        self.click(self.reader, 4)
+        self.age_clicks()
+        call_command('flush_ratings', stdout=io.StringIO())
+        self.assertAggregates(2, 9)
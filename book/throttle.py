@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# Rate limits for the write endpoints (comment / rating POSTs), checked before
+# anything takes SQLite's write lock.
+#
+# Every (action, subject) pair is a token bucket: RATES['comment']['user'] =
+# (5, 60) lets a user post 5 comments at once and then one every 12 seconds.
+# A bucket is stored as a single number, the time at which it will be full
+# again ("theoretical arrival time", GCRA): taking a token pushes it forward by
+# per / rate seconds, and a request is refused while it is more than `per`
+# seconds ahead. All the buckets of a request are read and written in one
+# get_many / set_many on the shared cache; if that cache is unreachable each
+# worker falls back to its own in-process buckets.
+#
+# Two workers updating the same bucket at the same instant may both get the
+# token (read-modify-write without a lock): the limits are for scripts, not
+# for exact accounting.
+
+DEFAULTS = {
+    'ENABLED': True,
+    # action -> subject ('user' / 'ip') -> (requests, per seconds)
+    'RATES': {
+        'comment': {'user': (5, 60), 'ip': (30, 60)},
+        'rating': {'user': (30, 60), 'ip': (120, 60)},
+    },
+    'DUPLICATE_WINDOW': 600,   # seconds the same comment text is refused on the same book
+    'PROXY_COUNT': 0,          # reverse proxies appending to X-Forwarded-For in front of Django
+    'LOCAL_MAX_KEYS': 10000,   # in-process fallback size
+}
+
+KEY_PREFIX = 'throttle'
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, 'BOOK_THROTTLE', {})}
+
+
+class LocalStore:
+    """The part of the cache API used here, in this process's memory (LRU-bounded)."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires at)
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            found = {}
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[1] > now:
+                    found[key] = entry[0]
+            return found
+
+    def set_many(self, values, timeout):
+        with self.lock:
+            for key, value in values.items():
+                self._store(key, value, timeout)
+        return []
+
+    def add(self, key, value, timeout):
+        with self.lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+            self._store(key, value, timeout)
+            return True
+
+    def _store(self, key, value, timeout):
+        self._data[key] = (value, time.monotonic() + timeout)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+
+_local = LocalStore(DEFAULTS['LOCAL_MAX_KEYS'])
+
+
+def _call(method, *args):
+    try:
+        return getattr(cache.get_cache(), method)(*args)
+    except Exception:
+        # e.g. Redis down: keep limiting, per worker
+        logger.warning("Throttle cache unavailable, using in-process buckets")
+        _local.max_keys = get_options()['LOCAL_MAX_KEYS']
+        return getattr(_local, method)(*args)
+
+
+def client_ip(request, proxy_count=0):
+    """The client address, skipping the ``proxy_count`` trusted proxies in front of Django."""
+    if proxy_count:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= proxy_count:
+            return forwarded[-proxy_count]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _subject_id(request, subject, options):
+    if subject == 'user':
+        return request.user.pk if request.user.is_authenticated else None
+    if subject == 'ip':
+        return client_ip(request, options['PROXY_COUNT']) or None
+    raise ValueError(f"Unknown throttle subject {subject!r}")
+
+
+def check(request, action):
+    """
+    Take a token from each of ``action``'s buckets for this request. Returns
+    None when allowed, else the seconds to wait (nothing is taken then).
+    """
+    options = get_options()
+    if not options['ENABLED']:
+        return None
+    buckets = {}
+    for subject, (rate, per) in options['RATES'].get(action, {}).items():
+        subject_id = _subject_id(request, subject, options)
+        if subject_id is not None:
+            buckets[f'{KEY_PREFIX}:{action}:{subject}:{subject_id}'] = (rate, per)
+    if not buckets:
+        return None
+
+    now = time.time()
+    full_at = _call('get_many', list(buckets))
+    updates, wait = {}, 0.0
+    for key, (rate, per) in buckets.items():
+        # the bucket is full at (or before) now: start from now
+        new_full_at = max(full_at.get(key, now), now) + per / rate
+        if new_full_at - now > per:
+            wait = max(wait, new_full_at - now - per)
+        updates[key] = new_full_at
+    if wait:
+        return math.ceil(wait)
+    _call('set_many', updates, max(per for rate, per in buckets.values()))
+    return None
+
+
+def is_duplicate_comment(user_id, book_id, content):
+    """
+    True if the user already posted this text (whitespace and case aside) on
+    this book within DUPLICATE_WINDOW seconds; otherwise records it.
+    """
+    normalized = ' '.join(content.split()).casefold()
+    digest = hashlib.sha256(f'{user_id}:{book_id}:{normalized}'.encode()).hexdigest()
+    return not _call('add', f'{KEY_PREFIX}:dup:{digest}', 1, get_options()['DUPLICATE_WINDOW'])
+
+
+def throttled(retry_after, json=False):
+    """429 Too Many Requests with Retry-After (JSON for the AJAX endpoints)."""
+    if json:
+        response = JsonResponse({'error': 'too many requests', 'retry_after': retry_after}, status=429)
+    else:
+        response = HttpResponse(
+            f"Too many requests, try again in {retry_after} seconds.",
+            status=429, content_type='text/plain; charset=utf-8',
+        )
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -1,16 +1,35 @@
 from django.urls import path
+from django.conf import settings
 from . import views
+from . import api
+from . import async_views
 from django.contrib.auth.views import LoginView, LogoutView
 
+# async pages under ASGI (BOOK_ASYNC_VIEWS, set by asgi.py), sync ones under WSGI
+pages = async_views if getattr(settings, 'BOOK_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
-    path('', views.book_list, name = 'book_list'),
+    path('', pages.book_list, name = 'book_list'),
     # path('books/create', views.book_create, name = 'book_create'),
     # path('books/update/<int:id>/', views.book_update, name = 'book_update'),
     # path('books/delete/<int:id>/', views.book_delete, name = 'book_delete'),
-    # path('books/rate/<int:id>/', views.rate_book, name = 'rate_book'),
-    path('books/details/<int:id>/', views.book_details, name = 'book_details'),
+    path('books/details/<int:id>/', pages.book_details, name = 'book_details'),
+    path('books/details/<int:id>/comments/', views.book_comments, name = 'book_comments'),
+    path('books/rate/<int:id>/', views.rate_book, name = 'rate_book'),
+    # per-user fragments of the statically exported pages (export_static)
+    path('books/details/<int:id>/interactive/', views.book_interactive, name = 'book_interactive'),
+    path('fragments/user-nav/', views.user_nav, name = 'user_nav'),
     path('signup/', views.signup_view, name = 'signup_view'),
     path('login/', LoginView.as_view(template_name='user/login.html'), name = 'login'),
     path('logout/', LogoutView.as_view(next_page='book_list'), name = 'logout'),
-    path('profile/', views.profile_view, name = 'profile'),
+    path('profile/', pages.profile_view, name = 'profile'),
+
+    # read-only JSON API
+    path('api/books/', api.book_list, name = 'api_book_list'),
+    path('api/books/batch/', api.book_batch, name = 'api_book_batch'),
+    path('api/books/<int:id>/', api.book_detail, name = 'api_book_detail'),
+    path('api/books/<int:id>/ratings/', api.book_ratings, name = 'api_book_ratings'),
+    path('api/books/<int:id>/comments/', api.book_comments, name = 'api_book_comments'),
+    path('api/categories/', api.category_list, name = 'api_category_list'),
+    path('api/autocomplete/', api.autocomplete_view, name = 'api_autocomplete'),
 ]
\ No newline at end of file
@@ -1,50 +1,188 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Book, Comment, Category, Rating
+from .models import Book, Comment, Category, Rating, SimilarBook, LeaderboardEntry
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.core.paginator import Paginator
+from django.conf import settings
+from django.utils.http import http_date, urlencode
 from . import forms
+from . import search
+from . import cache
+from . import leaderboards
+from . import ratings
+from . import throttle
+from .pagination import CursorPaginator, CursorPage
+from .routers import replica_reads
 from django.views.decorators.http import require_POST
+from django.views.decorators.cache import never_cache
+from django.http import JsonResponse
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg # Used for efficient database aggregation
 
 # Create your views here.
 # Book list 
 # category, search 
 
+# ?sort= values served from the precomputed leaderboards
+LEADERBOARD_SORTS = {
+    'top_rated': LeaderboardEntry.TOP_RATED,
+    'most_discussed': LeaderboardEntry.MOST_DISCUSSED,
+    'trending': LeaderboardEntry.TRENDING,
+}
+TRENDING_SIDEBAR_SIZE = 5
+CATALOG_SCOPES = ('catalog', 'categories', 'leaderboards')
+
+
+def catalog_validators(request):
+    # ⚡ the catalog-wide versions are bumped by every change shown on the list
+    versions = cache.get_versions(*CATALOG_SCOPES)
+    return f'"catalog-{cache.page_digest(request, versions)}"', None
+
+
+def book_etag(book_id, version):
+    return f'"book-{book_id}-{version}"'
+
+
+def book_validators(request, id):
+    # ⚡ one primary key read, before any of the page's queries
+    row = Book.objects.filter(pk=id).values_list('version', 'updated_at').first()
+    if row is None:
+        return None  # the view answers 404
+    version, updated_at = row
+    return book_etag(id, version), updated_at
+
+
+def set_book_validators(request, response, book):
+    # a plain GET takes its validators from the row the page was rendered from
+    if not request.user.is_authenticated:
+        response['ETag'] = book_etag(book.id, book.version)
+        response['Last-Modified'] = http_date(book.updated_at.timestamp())
+    return response
+
+
+@cache.conditional_page(catalog_validators)
+@cache.cache_anonymous_page(lambda request: list(CATALOG_SCOPES))
+@replica_reads
 def book_list(request):
     categoryQ = request.GET.get('category')
     searchQ = request.GET.get('q')
-
-    books = Book.objects.all().annotate(
-        avg_score=Avg('rating__score')
-    )
-    
-    if categoryQ:
-        books = books.filter(category__name = categoryQ)
+    sortQ = request.GET.get('sort')
+    page_number = request.GET.get('page')
     if searchQ:
-        books = books.filter(
-            Q(title__icontains = searchQ) |
-            Q(description__icontains = searchQ) | 
-            Q(category__name__icontains = searchQ) 
-        ).distinct()
-    
-    # books = books.order_by('-avg_score') 
+        sortQ = None  # a search is listed in its own order: best match first (FTS) or latest
 
-    paginator = Paginator(books, 6)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    facet_source = None  # what the per-category counts of the search are taken from
+    if searchQ and search.is_enabled():
+        # ⚡ FTS5 path: COUNT(*) and LIMIT/OFFSET run on the index, only the current page hits book_book
+        # the sidebar counts every match: grouped over a MATCH subquery, not an id list
+        facet_source = Book.objects.filter(id__in=search.matching_ids(searchQ))
+        paginator = Paginator(search.SearchResults(searchQ, category=categoryQ), 6)
+        page_obj = paginator.get_page(page_number)
+        page_books = Book.objects.filter(id__in=page_obj.object_list).defer('description')
+        books_by_id = {book.id: book for book in page_books}
+        # keep the relevance order of the index
+        page_obj.object_list = [books_by_id[i] for i in page_obj.object_list if i in books_by_id]
+    elif sortQ in LEADERBOARD_SORTS:
+        # ⚡ precomputed board: an indexed range scan on (board, category, rank), no GROUP BY
+        board = LEADERBOARD_SORTS[sortQ]
+        paginator = Paginator(leaderboards.entries(board, categoryQ).defer('book__description'), 6)
+        page_obj = paginator.get_page(page_number)
+        if paginator.count:
+            page_obj.object_list = [entry.book for entry in page_obj.object_list]
+        else:
+            # not computed yet (refresh_leaderboards hasn't run): rank live, slower but not empty
+            books = Book.objects.defer('description')
+            if categoryQ:
+                books = books.filter(category_id__in = _category_ids(categoryQ))
+            page_obj = Paginator(leaderboards.live_ranking(board, books), 6).get_page(page_number)
+    else:
+        # ratings are denormalized on Book (rating_avg / rating_count), no join needed;
+        # the cards show the stored excerpt, so the description HTML stays in the database
+        books = Book.objects.defer('description')
+
+        if searchQ:
+            books = books.filter(
+                Q(title__icontains = searchQ) |
+                Q(description__icontains = searchQ) | 
+                Q(category__name__icontains = searchQ) 
+            ).distinct()
+            facet_source = books
+        if categoryQ:
+            # ids from the cached category list: filtering on category_id lets SQLite
+            # walk book_category_latest_idx in order instead of joining and sorting
+            books = books.filter(category_id__in = _category_ids(categoryQ))
+
+        if getattr(settings, 'BOOK_LIST_CURSOR_PAGINATION', False):
+            # ⚡ keyset pagination: no COUNT(*) and no OFFSET, every page costs the same
+            paginator = CursorPaginator(books, 6, ordering='rating' if sortQ == 'rating' else 'latest')
+            page_obj = paginator.get_page(request.GET.get('cursor'))
+        else:
+            if sortQ == 'rating':
+                books = books.order_by('-rating_avg', '-rating_count', '-id')
+            else:
+                # newest first, walking book_latest_idx (book_category_latest_idx with a category)
+                books = books.order_by('-created_at', '-id')
+
+            paginator = Paginator(books, 6)
+            page_obj = paginator.get_page(page_number)
     
+    # book cards are cached per book, keyed by the book's cache version
+    page_obj.object_list = list(page_obj.object_list)
+    versions = cache.get_versions('catalog', 'categories', 'leaderboards', *(f'book:{book.id}' for book in page_obj.object_list))
+    for book in page_obj.object_list:
+        book.cache_version = versions[f'book:{book.id}']
+
     context = {
         'page_obj' : page_obj,
-        'categories' : Category.objects.all().order_by('name'),
+        # callable: only evaluated when the cached sidebar fragment is missing
+        'sidebar_categories' : lambda: _sidebar_categories(versions['categories'], facet_source),
+        'categories_version' : versions['categories'],
+        # search counts also move with the catalog
+        'facets_version' : versions['catalog'] if facet_source is not None else '',
+        # lazy as well: the trending widget is a cached fragment
+        'trending' : leaderboards.entries(LeaderboardEntry.TRENDING).defer('book__description')[:TRENDING_SIDEBAR_SIZE],
+        'leaderboards_version' : versions['leaderboards'],
         'search_query' : searchQ,
         'categoryQ' : categoryQ,
+        'sortQ' : sortQ,
+        'cursor_mode' : isinstance(page_obj, CursorPage),
+        # current filters, for building next/prev links
+        'filter_query' : urlencode({
+            key: value for key, value in (('q', searchQ), ('category', categoryQ), ('sort', sortQ)) if value
+        }),
     }
     return render(request, 'book/book_list.html', context)
 
+
+def _category_list(version=None):
+    """All categories with their book counts, from the process-local cache."""
+    return cache.get_local(
+        'categories', 'categories',
+        lambda: list(Category.objects.order_by('name').only('id', 'name', 'book_count')),
+        version=version,
+    )
+
+
+def _category_ids(name, version=None):
+    return [category.id for category in _category_list(version) if category.name == name]
+
+
+def _sidebar_categories(version, facet_source):
+    """
+    (category, count) pairs for the sidebar: whole-catalog counts, or the
+    number of matching books per category when a search is active.
+    """
+    categories = _category_list(version)
+    if facet_source is None:
+        return [(category, category.book_count) for category in categories]
+
+    # one grouped query over the matching books
+    counts = dict(
+        facet_source.order_by().values_list('category_id').annotate(n=Count('id', distinct=True))
+    )
+    return [(category, counts.get(category.id, 0)) for category in categories]
+
 # @login_required
 # def book_create(request):
 #     if request.method == 'POST':
@@ -90,12 +228,19 @@ def book_list(request):
 #     book.delete()
 #     return redirect('book_list')
 
+@cache.conditional_page(book_validators)
+@cache.cache_anonymous_page(lambda request, id: [f'book:{id}', 'categories'])
+@replica_reads
 def book_details(request, id):
-    # 🌟 IMPROVEMENT: Annotate the single book with its average rating 
-    book = get_object_or_404(
-        Book.objects.annotate(avg_score=Avg('rating__score')), 
-        id=id
-    )
+    if request.method == 'POST' and request.user.is_authenticated:
+        # ⚡ token buckets (per user, per IP): a rejected write costs no query at all
+        retry_after = throttle.check(request, 'comment')
+        if retry_after:
+            return throttle.throttled(retry_after)
+
+    # ⚡ rating_avg / rating_count are stored on the book row, no aggregate needed
+    # the page shows the pre-rendered description_html, not the raw CKEditor HTML
+    book = get_object_or_404(Book.objects.select_related('category').defer('description'), id=id)
     
     # comment and rating form handle
     if request.method == 'POST':
@@ -112,16 +257,22 @@ def book_details(request, id):
             try:
                 score = int(score)
                 # 1. RATING LOGIC: Update or create the rating
+                # (the Rating post_save signal updates the book's stored aggregates)
                 Rating.objects.update_or_create(
                     user=request.user, # request.user is safe here because of the 'if not request.user.is_authenticated' check above
                     book=book,
                     defaults={'score': score}
                 )
+                # the form's score wins over a star click still waiting to be written
+                ratings.discard(request.user, book)
             except ValueError:
                 pass 
         
         # 2. COMMENT LOGIC: Save the comment if content is provided
-        if form.is_valid():
+        # (a resubmitted or scripted copy of the same text is dropped)
+        if form.is_valid() and not throttle.is_duplicate_comment(
+            request.user.id, book.id, form.cleaned_data['content']
+        ):
             comment = form.save(commit=False)
             comment.user = request.user
             comment.book = book
@@ -138,20 +289,99 @@ def book_details(request, id):
     user_rating = None
     if request.user.is_authenticated:
         # This only runs if request.user is a real User object, avoiding TypeError
-        user_rating = Rating.objects.filter(user=request.user, book=book).first()
+        # a star click may still be pending (write-behind, see ratings.py)
+        user_rating = ratings.current_score(request.user.id, book.id)
+
+    # ⚡ First page of comments only; each commenter's score comes from the same query
+    comments_page = _comment_page(book.id)
 
-    # Prefetch the user for comments (visible to everyone)
-    comments = book.comment_set.all().select_related('user').order_by('-created_at')
+    # precomputed by `manage.py compute_similar_books`, read through the (book, rank) index
+    similar_books = [
+        entry.similar for entry in
+        SimilarBook.objects.filter(book_id=book.id).select_related('similar').defer('similar__description')
+        .order_by('rank')[:SIMILAR_BOOKS_SHOWN]
+    ]
     
     context = {
         'book' : book,
-        'categories' : Category.objects.all(),
-        'comments' : comments,
+        'comments' : comments_page,
+        'similar_books' : similar_books,
         'comment_form' : form,
-        'user_rating' : user_rating.score if user_rating else None, # Pass existing score
+        'book_version' : cache.get_versions(f'book:{book.id}')[f'book:{book.id}'],
+        'user_rating' : user_rating, # Pass existing score
     }
     
-    return render(request, 'book/book_details.html', context)
+    response = render(request, 'book/book_details.html', context)
+    return set_book_validators(request, response, book)
+
+@require_POST
+def rate_book(request, id):
+    """
+    Star click from the detail page (AJAX). Takes ``score`` (1-5), returns the
+    book's new average and count so the page updates in place.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'login required'}, status=401)
+    retry_after = throttle.check(request, 'rating')
+    if retry_after:
+        return throttle.throttled(retry_after, json=True)
+    book = get_object_or_404(Book.objects.only('id', 'rating_count', 'rating_sum', 'rating_avg'), id=id)
+    try:
+        score = int(request.POST.get('score', ''))
+    except ValueError:
+        score = 0
+    if not 1 <= score <= 5:
+        return JsonResponse({'error': 'score must be between 1 and 5'}, status=400)
+
+    # ⚡ write-behind: rapid clicks on the same book coalesce into one Rating write
+    rating_avg, rating_count = ratings.submit(request.user, book, score)
+    ratings.schedule_flush()
+    return JsonResponse({
+        'score': score,
+        'rating_avg': round(rating_avg, 2) if rating_avg is not None else None,
+        'rating_count': rating_count,
+    })
+
+COMMENTS_PER_PAGE = 10
+SIMILAR_BOOKS_SHOWN = 6
+
+
+def _comment_paginator(book_id):
+    comments = (
+        Comment.objects.filter(book_id=book_id)
+        .select_related('user')
+        .with_rating_score()
+    )
+    # newest first, seeking on (created_at, id) so "load more" never uses OFFSET
+    return CursorPaginator(comments, COMMENTS_PER_PAGE, ordering='latest')
+
+
+def _comment_page(book_id, cursor=None):
+    return _comment_paginator(book_id).get_page(cursor)
+
+
+def book_comments(request, id):
+    """HTML fragment with the next page of comments, used by "Load more" on the detail page."""
+    comments_page = _comment_page(id, request.GET.get('cursor'))
+    return render(request, 'book/comment_list.html', {'book_id' : id, 'comments' : comments_page})
+
+
+# Per-user parts of the pages written by `manage.py export_static`, fetched by
+# the exported HTML on load (base.html); never cached, never exported.
+
+@never_cache
+def book_interactive(request, id):
+    """Rating and comment form of the detail page (the login prompt for anonymous visitors)."""
+    book = get_object_or_404(Book.objects.only('id'), id=id)
+    user_rating = ratings.current_score(request.user.id, book.id) if request.user.is_authenticated else None
+    context = {'book' : book, 'comment_form' : forms.CommentForm(), 'user_rating' : user_rating}
+    return render(request, 'book/book_interactive.html', context)
+
+
+@never_cache
+def user_nav(request):
+    """Navbar login / profile menu."""
+    return render(request, 'book/user_nav.html')
 
 # ... (rest of the views remain the same) ...
 
@@ -178,10 +408,6 @@ def profile_view(request):
     if section == 'books':
         # 💡 Filter by the CharField 'author' which stores the username
         books = Book.objects.filter(author = request.user.username)
-        
-        # 🌟 IMPROVEMENT: Annotate books for profile list too
-        books = books.annotate(avg_score=Avg('rating__score')) 
-        
         context['books'] = books 
     
     elif section == 'update':
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'online_library.settings')
+# serve the async catalog views (book/async_views.py) under ASGI
+os.environ.setdefault('LIBRARY_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# build the search-as-you-type index while the worker waits for its first request
+from book import autocomplete  # noqa: E402
+
+autocomplete.warm()
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -49,16 +52,56 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Full-text search for book_list (SQLite FTS5 index kept in sync by book/signals.py).
+# Set to False to fall back to the icontains search.
+BOOK_SEARCH_FTS = True
+
+# Keyset (cursor) pagination for book_list: opaque next/prev tokens instead of
+# ?page=N, so deep pages cost the same as the first one.
+BOOK_LIST_CURSOR_PAGINATION = False
+
+# Route book_list / book_details / profile to the async views (book/async_views.py).
+# asgi.py turns this on; keep it off under WSGI, where async views cost an event loop per request.
+BOOK_ASYNC_VIEWS = os.environ.get('LIBRARY_ASYNC_VIEWS') == '1'
+
 MIDDLEWARE = [
+    # first, so its timings cover the whole stack (removes itself when disabled)
+    'book.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # cookie-less anonymous GETs: no session / auth lookups (after AuthenticationMiddleware)
+    'book.middleware.AnonymousFastPathMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Anonymous visitors without a session cookie get an AnonymousUser up front
+# (book/middleware.py), so catalog pages don't touch the session or auth tables.
+BOOK_ANONYMOUS_FAST_PATH = os.environ.get('LIBRARY_ANONYMOUS_FAST_PATH', '1') == '1'
+
+# Per-request SQL / template timing (book/middleware.py): Server-Timing headers
+# and a JSON log line for every request slower than SLOW_REQUEST_MS.
+BOOK_PROFILING = {
+    'ENABLED': os.environ.get('LIBRARY_PROFILING') == '1',
+    'SLOW_REQUEST_MS': 500,
+    'SLOWEST_QUERIES': 5,
+    'SERVER_TIMING': True,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'book.slow_requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'online_library.urls'
 
 TEMPLATES = [
@@ -89,6 +132,163 @@ DATABASES = {
     }
 }
 
+# Production profile (LIBRARY_DB_PROFILE=production): WAL journal so readers never
+# block the writer, a busy timeout instead of instant "database is locked",
+# IMMEDIATE transactions (take the write lock up front, no lock-upgrade deadlocks),
+# persistent connections, and a read replica for the catalog pages (book/routers.py).
+# The replica is a second SQLite file kept in sync outside Django (e.g. Litestream /
+# LiteFS); tests mirror it to the default database.
+LIBRARY_DB_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'dev')
+
+SQLITE_PRAGMAS = ';'.join([
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',    # safe with WAL, no fsync per commit
+    'PRAGMA busy_timeout = 5000',     # ms
+    'PRAGMA cache_size = -64000',     # KiB (64 MB page cache per connection)
+    'PRAGMA mmap_size = 268435456',   # 256 MB
+    'PRAGMA temp_store = MEMORY',
+])
+
+if LIBRARY_DB_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+        },
+    })
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('LIBRARY_DB_REPLICA', BASE_DIR / 'db_replica.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # never written through Django
+            'init_command': SQLITE_PRAGMAS.replace('PRAGMA journal_mode = WAL', 'PRAGMA query_only = ON'),
+            'timeout': 5,
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['book.routers.PrimaryReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Pick the backend with LIBRARY_CACHE_BACKEND: 'locmem' (dev/tests, one process),
+# 'file' (single box, shared by all workers; the production profile default) or
+# 'redis' (any Redis-compatible server).
+# The page cache, the conditional GET validators and the category list all hang on
+# version counters in this cache (book/cache.py): with several workers it must be
+# shared, or a worker that didn't handle a write keeps serving its old pages.
+
+LIBRARY_CACHE_BACKEND = os.environ.get(
+    'LIBRARY_CACHE_BACKEND', 'file' if LIBRARY_DB_PROFILE == 'production' else 'locmem'
+)
+
+if LIBRARY_CACHE_BACKEND == 'locmem' and (LIBRARY_DB_PROFILE == 'production' or not DEBUG):
+    raise ImproperlyConfigured(
+        "LIBRARY_CACHE_BACKEND=locmem is per process: the cache versions in book/cache.py "
+        "must be shared by every worker. Use 'file' or 'redis'."
+    )
+
+if LIBRARY_CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+elif LIBRARY_CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('LIBRARY_CACHE_DIR', BASE_DIR / 'cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Session storage (LIBRARY_SESSION_ENGINE): 'db', 'cached_db' (reads from the cache,
+# writes through to the db), 'cache' or 'signed_cookies' (no server-side storage).
+# The production profile reads sessions from the cache so a visitor carrying a
+# session cookie doesn't cost a django_session query per page.
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get(
+    'LIBRARY_SESSION_ENGINE', 'cached_db' if LIBRARY_DB_PROFILE == 'production' else 'db'
+)
+
+# Anonymous page cache + template fragment cache for the catalog (book/cache.py).
+# Entries are invalidated by the model signals in book/signals.py.
+BOOK_PAGE_CACHE = True
+BOOK_CACHE_ALIAS = 'default'
+BOOK_CACHE_TIMEOUT = 600
+
+# Write-behind for AJAX star ratings (book/ratings.py): clicks on the same book are
+# coalesced and written to Rating once quiet for DELAY_SECONDS by a queued flush task
+# (run_worker, or `manage.py flush_ratings`).
+BOOK_RATING_WRITE_BEHIND = {
+    'ENABLED': True,
+    'DELAY_SECONDS': 5,
+    'BATCH_SIZE': 500,
+}
+
+# Token-bucket limits on comment / rating POSTs (book/throttle.py), kept in the
+# BOOK_CACHE_ALIAS cache (in-process if it fails): (requests, per seconds) per
+# user and per client IP. PROXY_COUNT: proxies in front of Django that append
+# to X-Forwarded-For (0 uses REMOTE_ADDR).
+BOOK_THROTTLE = {
+    'ENABLED': True,
+    'RATES': {
+        'comment': {'user': (5, 60), 'ip': (30, 60)},
+        'rating': {'user': (30, 60), 'ip': (120, 60)},
+    },
+    'DUPLICATE_WINDOW': 600,
+    'PROXY_COUNT': int(os.environ.get('LIBRARY_PROXY_COUNT', '0')),
+}
+
+# Background tasks (book/tasks.py): a queue in the book_task table, drained by
+# `manage.py run_worker --concurrency N --pool thread|process`. EAGER runs every
+# task inline when it is enqueued (the dev profile, where no worker is running).
+BOOK_TASKS = {
+    'EAGER': os.environ.get('LIBRARY_TASKS_EAGER', '1' if LIBRARY_DB_PROFILE == 'dev' else '0') == '1',
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_SECONDS': 10,
+    'CLAIM_TIMEOUT': 600,
+    'KEEP_DONE': 60 * 60 * 24,
+}
+
+# Precomputed leaderboards (book/leaderboards.py), rebuilt by `manage.py refresh_leaderboards`.
+BOOK_LEADERBOARDS = {
+    'SIZE': 100,
+    'PRIOR_WEIGHT': 10,
+    'TRENDING_WINDOW_DAYS': 30,
+    'TRENDING_HALF_LIFE_HOURS': 72,
+}
+
+# Search-as-you-type (book/autocomplete.py): per-worker in-memory prefix index
+# over titles, authors and category names. Patched by signals in the worker that
+# made a change, rebuilt from the database every MAX_AGE seconds. Check its
+# footprint with `manage.py autocomplete_index`.
+BOOK_AUTOCOMPLETE = {
+    'ENABLED': True,
+    'MAX_AGE': 300,
+    'MAX_SUFFIXES': 6,
+    'MAX_SCAN': 2000,
+}
+
+# Static export of the anonymous catalog (book/export.py, `manage.py export_static`):
+# output directory and how many numbered catalog pages to pre-render.
+BOOK_EXPORT = {
+    'ROOT': BASE_DIR / 'export',
+    'CATALOG_PAGES': 10,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,6 +325,29 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# `manage.py collectstatic` target, served by book.assets.serve when DEBUG is off
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Outside DEBUG, collectstatic writes content-hashed names (styles.<hash>.css)
+# plus precompressed .gz/.br variants, so static files can be cached for a year
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'book.assets.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Cache headers / offload for covers and static files (book/assets.py).
+# OFFLOAD: None streams the file from Django; 'x-accel-redirect' (nginx, with an
+# `internal` location per OFFLOAD_PREFIX) or 'x-sendfile' (Apache/lighttpd)
+# hand the bytes to the web server.
+BOOK_ASSETS = {
+    'OFFLOAD': os.environ.get('LIBRARY_ASSET_OFFLOAD') or None,
+    'OFFLOAD_PREFIX': {'media': '/protected/media/', 'static': '/protected/static/'},
+    'MAX_AGE': 60 * 60 * 24 * 365,
+    'SHORT_MAX_AGE': 60 * 60,
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -15,14 +15,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from book import assets
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('book.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# covers are served with long-lived cache headers (or offloaded) in every mode;
+# with DEBUG on, runserver serves static files itself
+urlpatterns += [
+    re_path(rf'^{settings.MEDIA_URL.strip("/")}/(?P<path>.+)$', assets.serve, {'kind': 'media'}),
+]
+if not settings.DEBUG:
+    urlpatterns += [
+        re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', assets.serve, {'kind': 'static'}),
+    ]
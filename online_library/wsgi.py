@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'online_library.settings')
 
 application = get_wsgi_application()
+
+# build the search-as-you-type index while the worker waits for its first request
+from book import autocomplete  # noqa: E402
+
+autocomplete.warm()